@@ -0,0 +1,550 @@
+import collections
+import gzip
+import io
+import logging
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple, Type
+
+import numpy as np
+
+from opuspocus.runner_resources import RunnerResources
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+logger = logging.getLogger(__name__)
+
+# Maximum size of the uncompressed data in a single BGZF block (same as in htslib)
+BGZF_BLOCK_SIZE = 0xFF00
+
+BGZF_INDEX_SUFFIX = ".gzi"
+
+READ_CHUNK_SIZE = 2**24
+
+_BGZF_HEADER = struct.Struct("<4BI2BH2BHH")
+_BGZF_TRAILER = struct.Struct("<II")
+_BGZF_HEADER_MAGIC = b"\x1f\x8b\x08\x04"
+_BGZF_EXTRA = b"BC\x02\x00"
+
+BlockIndex = Tuple[np.ndarray, np.ndarray]
+
+_block_index_cache: Dict[Tuple[str, int, int], Optional[BlockIndex]] = {}
+
+
+def bgzf_compress_block(data: bytes, compresslevel: int = -1) -> bytes:
+    """Compress the data into a single BGZF block, i.e. an independent gzip member with the BGZF extra field.
+
+    The extra field contains the size of the compressed block, so the block boundaries can be found without
+    decompressing the file.
+    """
+    assert len(data) <= BGZF_BLOCK_SIZE
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+    cdata = compressor.compress(data) + compressor.flush()
+    block_size = _BGZF_HEADER.size + len(cdata) + _BGZF_TRAILER.size
+    header = _BGZF_HEADER.pack(0x1F, 0x8B, 8, 4, 0, 0, 0xFF, 6, ord("B"), ord("C"), 2, block_size - 1)
+    return header + cdata + _BGZF_TRAILER.pack(zlib.crc32(data), len(data))
+
+
+BGZF_EOF = bgzf_compress_block(b"")
+
+
+def bgzf_index_path(file: Path) -> Path:
+    """Location of the BGZF block index of a given file."""
+    return Path(f"{file}{BGZF_INDEX_SUFFIX}")
+
+
+def is_bgzf(file: Path) -> bool:
+    """Check whether the file starts with a BGZF block."""
+    with file.open("rb") as fh:
+        header = fh.read(_BGZF_HEADER.size)
+    return len(header) == _BGZF_HEADER.size and header[:4] == _BGZF_HEADER_MAGIC and header[12:16] == _BGZF_EXTRA
+
+
+def save_block_index(file: Path, block_index: BlockIndex) -> None:
+    """Save the BGZF block index (compatible with the bgzip .gzi format).
+
+    The .gzi file contains the number of entries followed by the (compressed offset, uncompressed offset) pairs of
+    all blocks except the first one, stored as little-endian uint64 values.
+    """
+    coffsets, uoffsets = block_index
+    entries = np.stack([coffsets[1:], uoffsets[1:]], axis=1).astype("<u8")
+    with bgzf_index_path(file).open("wb") as fh:
+        fh.write(struct.pack("<Q", entries.shape[0]))
+        entries.tofile(fh)
+
+
+def _read_block_index(file: Path) -> BlockIndex:
+    """Read the BGZF block index of a given file."""
+    with bgzf_index_path(file).open("rb") as fh:
+        (n_entries,) = struct.unpack("<Q", fh.read(8))
+        entries = np.fromfile(fh, dtype="<u8", count=2 * n_entries).reshape(n_entries, 2)
+    coffsets = np.concatenate([np.zeros(1, dtype=np.uint64), entries[:, 0].astype(np.uint64)])
+    uoffsets = np.concatenate([np.zeros(1, dtype=np.uint64), entries[:, 1].astype(np.uint64)])
+    return coffsets, uoffsets
+
+
+def _scan_block_index(file: Path) -> BlockIndex:
+    """Create the BGZF block index by reading the header and trailer of each block.
+
+    Only the block headers and trailers are read, the blocks are not decompressed.
+    """
+    coffsets, uoffsets = [], []
+    coffset, uoffset = 0, 0
+    file_size = file.stat().st_size
+    with file.open("rb") as fh:
+        while coffset < file_size:
+            fh.seek(coffset)
+            header = fh.read(_BGZF_HEADER.size)
+            if len(header) != _BGZF_HEADER.size or header[:4] != _BGZF_HEADER_MAGIC or header[12:16] != _BGZF_EXTRA:
+                err_msg = f"{file} is not a valid BGZF file (invalid block header at offset {coffset})."
+                raise ValueError(err_msg)
+            block_size = _BGZF_HEADER.unpack(header)[-1] + 1
+            fh.seek(coffset + block_size - 4)
+            (isize,) = struct.unpack("<I", fh.read(4))
+            if isize == 0:
+                # skip the empty (EOF) blocks
+                coffset += block_size
+                continue
+            coffsets.append(coffset)
+            uoffsets.append(uoffset)
+            coffset += block_size
+            uoffset += isize
+    if not coffsets:
+        coffsets, uoffsets = [0], [0]
+    return np.array(coffsets, dtype=np.uint64), np.array(uoffsets, dtype=np.uint64)
+
+
+def _has_fresh_block_index(file: Path, stat: os.stat_result) -> bool:
+    """Check whether the .gzi index exists and was not created before the last file modification."""
+    index_path = bgzf_index_path(file)
+    return index_path.exists() and index_path.stat().st_mtime_ns >= stat.st_mtime_ns
+
+
+def load_block_index(file: Path) -> Optional[BlockIndex]:
+    """Return the (compressed offsets, uncompressed offsets) of the gzip members (BGZF blocks) of a given file.
+
+    The .gzi index is used when available, otherwise the BGZF block headers are scanned. Returns None if neither
+    is possible. The results are cached until the file is modified.
+    """
+    stat = file.stat()
+    key = (str(file.resolve()), stat.st_mtime_ns, stat.st_size)
+    if key not in _block_index_cache:
+        block_index = None
+        if _has_fresh_block_index(file, stat):
+            block_index = _read_block_index(file)
+        elif is_bgzf(file):
+            logger.debug("BGZF index of %s not found. Scanning block headers...", file)
+            block_index = _scan_block_index(file)
+        _block_index_cache[key] = block_index
+    return _block_index_cache[key]
+
+
+def gzip_tail(file: Path) -> Tuple[int, bytes]:
+    """Return the uncompressed size and the last uncompressed byte of a gzip file.
+
+    With the block index available, only the last block is decompressed. Otherwise, the whole file is decompressed
+    (but nothing is decoded or re-compressed).
+    """
+    block_index = load_block_index(file)
+    start = 0 if block_index is None else int(block_index[1][-1])
+    size, tail = start, b""
+    with open_gzip_at(file, start) as fh:
+        while True:
+            chunk = fh.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            tail = chunk[-1:]
+    return size, tail
+
+
+def default_compression_threads() -> int:
+    """Number of compression threads, based on the number of CPUs allocated to the running task."""
+    return int(os.environ.get(RunnerResources.get_env_name("cpus"), "1"))
+
+
+class BgzfWriter(io.BufferedIOBase):
+    """Binary file writer producing BGZF (blocked gzip) files.
+
+    The output is a sequence of independent gzip members, therefore, it can be read by any gzip reader (including
+    zcat). In addition, the writer stores the block offset table in the .gzi file, which enables random access
+    to the file contents.
+
+    Since the blocks are independent, they can be compressed in parallel (similarly to pigz). With threads > 1,
+    the blocks are compressed by a thread pool (zlib releases the GIL during compression) and written in their
+    original order.
+    """
+
+    def __init__(self, file: Path, compresslevel: int = -1, threads: Optional[int] = None) -> None:
+        super().__init__()
+        self.name = str(file)
+        self.compresslevel = compresslevel
+        self.threads = threads if threads is not None else default_compression_threads()
+        self._file = file
+        self._fh = file.open("wb")
+        self._buffer = bytearray()
+        self._coffsets = []
+        self._uoffsets = []
+        self._coffset = 0
+        self._uoffset = 0
+
+        self._executor = None
+        self._pending = collections.deque()
+        if self.threads > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads)
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        if self.closed:
+            err_msg = "I/O operation on closed file."
+            raise ValueError(err_msg)
+        data = memoryview(data)
+        self._buffer += data
+        if len(self._buffer) >= BGZF_BLOCK_SIZE:
+            n_full = len(self._buffer) - len(self._buffer) % BGZF_BLOCK_SIZE
+            for i in range(0, n_full, BGZF_BLOCK_SIZE):
+                self._submit_block(bytes(self._buffer[i : i + BGZF_BLOCK_SIZE]))
+            del self._buffer[:n_full]
+        return data.nbytes
+
+    def _submit_block(self, data: bytes) -> None:
+        """Compress the block (in the thread pool, if available) and write the finished blocks."""
+        if self._executor is None:
+            self._write_block(bgzf_compress_block(data, self.compresslevel), len(data))
+            return
+        future = self._executor.submit(bgzf_compress_block, data, self.compresslevel)
+        self._pending.append((future, len(data)))
+        # Keep enough blocks in flight to saturate the pool while bounding the memory usage
+        while len(self._pending) > 4 * self.threads:
+            self._write_pending_block()
+
+    def _write_pending_block(self) -> None:
+        future, data_size = self._pending.popleft()
+        self._write_block(future.result(), data_size)
+
+    def _write_block(self, block: bytes, data_size: int) -> None:
+        self._fh.write(block)
+        self._coffsets.append(self._coffset)
+        self._uoffsets.append(self._uoffset)
+        self._coffset += len(block)
+        self._uoffset += data_size
+
+    def flush(self) -> None:
+        """Flush the underlying file. The partial blocks are written only when closing the file."""
+        if not self._fh.closed:
+            self._fh.flush()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            if self._buffer:
+                self._submit_block(bytes(self._buffer))
+                self._buffer.clear()
+            while self._pending:
+                self._write_pending_block()
+            self._fh.write(BGZF_EOF)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+            self._fh.close()
+            super().close()
+
+        if not self._coffsets:
+            self._coffsets, self._uoffsets = [0], [0]
+        save_block_index(
+            self._file, (np.array(self._coffsets, dtype=np.uint64), np.array(self._uoffsets, dtype=np.uint64))
+        )
+
+
+class _SeekedGzipFile(gzip.GzipFile):
+    """GzipFile reading from an already positioned file object which is closed together with the GzipFile."""
+
+    def __init__(self, fileobj: io.BufferedReader) -> None:
+        super().__init__(fileobj=fileobj, mode="rb")
+        self._raw_fileobj = fileobj
+
+    def close(self) -> None:
+        try:
+            super().close()
+        finally:
+            self._raw_fileobj.close()
+
+
+def open_gzip_at(file: Path, offset: int) -> io.BufferedIOBase:
+    """Open a gzip file for binary reading starting at the given uncompressed offset.
+
+    In BGZF files, only the block containing the offset needs to be decompressed to reach the offset. Other gzip
+    files are decompressed from the beginning.
+    """
+    block_index = load_block_index(file)
+    if block_index is None:
+        fh = gzip.open(file, "rb")
+        fh.seek(offset)
+        return fh
+
+    coffsets, uoffsets = block_index
+    block = int(np.searchsorted(uoffsets, offset, side="right")) - 1
+    raw_fh = file.open("rb")
+    raw_fh.seek(int(coffsets[block]))
+    fh = _SeekedGzipFile(raw_fh)
+    skip = offset - int(uoffsets[block])
+    if skip and len(fh.read(skip)) != skip:
+        fh.close()
+        err_msg = f"Offset {offset} is beyond the end of {file}."
+        raise ValueError(err_msg)
+    return fh
+
+
+CODEC_REGISTRY = {}
+
+
+def register_codec(name: str) -> Callable:
+    """Register a compression codec for the pipeline corpus files.
+
+    The decorated Codec subclass is instantiated and stored under the given name, which is then used as the value
+    of the CorpusStep's `compression` parameter.
+
+    For example:
+
+        @register_codec("zstd")
+        class ZstdCodec(Codec):
+            (...)
+
+    Args:
+        name (str): the name of the codec
+    """
+
+    def register_codec_cls(cls: "Codec") -> "Codec":
+        if name in CODEC_REGISTRY:
+            err_msg = f"Cannot register duplicate codec ({name})"
+            raise ValueError(err_msg)
+        if not issubclass(cls, Codec):
+            err_msg = f"Codec ({name}: {cls.__name__}) must extend Codec"
+            raise TypeError(err_msg)
+        CODEC_REGISTRY[name] = cls(name=name)
+        return cls
+
+    return register_codec_cls
+
+
+def get_codec(name: str) -> "Codec":
+    """Return the registered codec with the given name."""
+    if name not in CODEC_REGISTRY:
+        err_msg = f"Unknown compression codec ({name}). Available codecs: {', '.join(CODEC_REGISTRY)}."
+        raise ValueError(err_msg)
+    return CODEC_REGISTRY[name]
+
+
+def get_codec_by_path(file: Path) -> "Codec":
+    """Return the codec of a file based on its suffix. Files with an unknown suffix are considered uncompressed."""
+    for codec in CODEC_REGISTRY.values():
+        if codec.suffix and file.name.endswith(codec.suffix):
+            return codec
+    return CODEC_REGISTRY["none"]
+
+
+class Codec:
+    """Base class for the compression codecs of the corpus files.
+
+    The codec of a file is determined by its suffix. The codecs are expected to produce formats that allow
+    byte-level concatenation of the compressed files (concatenated gzip members, zstd or lz4 frames).
+    """
+
+    suffix = ""
+    max_level = None
+    module = None
+    module_name = None
+
+    # Exceptions raised by the reader when the compressed data are truncated or corrupted
+    read_errors: Tuple[Type[Exception], ...] = (EOFError,)
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def check_available(self) -> None:
+        """Raise an error if the (optional) Python module required by the codec is not installed."""
+        if self.module_name is not None and self.module is None:
+            err_msg = (
+                f"Compression codec {self.name} requires the {self.module_name} Python package. "
+                f"Install it using `pip install {self.module_name}`."
+            )
+            raise ImportError(err_msg)
+
+    def check_level(self, compresslevel: Optional[int]) -> None:
+        """Check whether the codec supports the given compression level."""
+        if compresslevel is None:
+            return
+        if self.max_level is None or not 0 <= compresslevel <= self.max_level:
+            err_msg = f"Compression codec {self.name} does not support compression level {compresslevel}."
+            raise ValueError(err_msg)
+
+    def open_reader(self, file: Path) -> io.BufferedIOBase:
+        """Open the file for binary reading of the uncompressed contents."""
+        raise NotImplementedError()
+
+    def open_writer(self, file: Path, compresslevel: Optional[int] = None) -> io.BufferedIOBase:
+        """Open the file for binary writing, compressing the written data."""
+        raise NotImplementedError()
+
+    def compress(self, data: bytes) -> bytes:
+        """Compress the data into a self-contained unit (gzip member, frame) that can be appended to a file."""
+        raise NotImplementedError()
+
+    def open_reader_at(self, file: Path, offset: int) -> io.BufferedIOBase:
+        """Open the file for binary reading, starting at the given uncompressed offset.
+
+        By default, the file is decompressed from the beginning up to the offset.
+        """
+        fh = self.open_reader(file)
+        while offset > 0:
+            chunk = fh.read(min(offset, READ_CHUNK_SIZE))
+            if not chunk:
+                fh.close()
+                err_msg = f"Offset {offset} is beyond the end of {file}."
+                raise ValueError(err_msg)
+            offset -= len(chunk)
+        return fh
+
+    def is_seekable(self, file: Path) -> bool:  # noqa: ARG002
+        """Whether open_reader_at can reach an offset without decompressing the preceding file contents."""
+        return False
+
+    def tail(self, file: Path) -> Tuple[int, bytes]:
+        """Return the uncompressed size and the last uncompressed byte of the file."""
+        size, tail = 0, b""
+        with self.open_reader(file) as fh:
+            while True:
+                chunk = fh.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                tail = chunk[-1:]
+        return size, tail
+
+
+@register_codec("none")
+class PlainCodec(Codec):
+    """Uncompressed files."""
+
+    read_errors = ()
+
+    def open_reader(self, file: Path) -> io.BufferedIOBase:
+        return file.open("rb")
+
+    def open_writer(self, file: Path, compresslevel: Optional[int] = None) -> io.BufferedIOBase:
+        self.check_level(compresslevel)
+        return file.open("wb")
+
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def open_reader_at(self, file: Path, offset: int) -> io.BufferedIOBase:
+        fh = file.open("rb")
+        fh.seek(offset)
+        return fh
+
+    def is_seekable(self, file: Path) -> bool:  # noqa: ARG002
+        return True
+
+    def tail(self, file: Path) -> Tuple[int, bytes]:
+        size = file.stat().st_size
+        if size == 0:
+            return 0, b""
+        with file.open("rb") as fh:
+            fh.seek(-1, os.SEEK_END)
+            return size, fh.read(1)
+
+
+@register_codec("gzip")
+class GzipCodec(Codec):
+    """Gzip files, written in the BGZF format which enables random access (see BgzfWriter)."""
+
+    suffix = ".gz"
+    max_level = 9
+    read_errors = (EOFError, gzip.BadGzipFile, zlib.error)
+
+    def open_reader(self, file: Path) -> io.BufferedIOBase:
+        return gzip.open(file, "rb")
+
+    def open_writer(self, file: Path, compresslevel: Optional[int] = None) -> io.BufferedIOBase:
+        self.check_level(compresslevel)
+        return BgzfWriter(file, compresslevel=-1 if compresslevel is None else compresslevel)
+
+    def compress(self, data: bytes) -> bytes:
+        return bgzf_compress_block(data)
+
+    def open_reader_at(self, file: Path, offset: int) -> io.BufferedIOBase:
+        return open_gzip_at(file, offset)
+
+    def is_seekable(self, file: Path) -> bool:
+        return load_block_index(file) is not None
+
+    def tail(self, file: Path) -> Tuple[int, bytes]:
+        return gzip_tail(file)
+
+
+@register_codec("zstd")
+class ZstdCodec(Codec):
+    """Zstandard files (requires the zstandard package). Compression uses the CPUs allocated to the task."""
+
+    suffix = ".zst"
+    max_level = 22
+    module = zstandard
+    module_name = "zstandard"
+    read_errors = (EOFError,) if zstandard is None else (EOFError, zstandard.ZstdError)
+
+    def open_reader(self, file: Path) -> io.BufferedIOBase:
+        self.check_available()
+        reader = zstandard.ZstdDecompressor().stream_reader(file.open("rb"), read_across_frames=True, closefd=True)
+        return io.BufferedReader(reader, buffer_size=io.DEFAULT_BUFFER_SIZE * 16)
+
+    def open_writer(self, file: Path, compresslevel: Optional[int] = None) -> io.BufferedIOBase:
+        self.check_available()
+        self.check_level(compresslevel)
+        threads = default_compression_threads()
+        compressor = zstandard.ZstdCompressor(
+            level=3 if compresslevel is None else compresslevel, threads=threads if threads > 1 else 0
+        )
+        return compressor.stream_writer(file.open("wb"), closefd=True)
+
+    def compress(self, data: bytes) -> bytes:
+        self.check_available()
+        return zstandard.ZstdCompressor().compress(data)
+
+
+@register_codec("lz4")
+class Lz4Codec(Codec):
+    """LZ4 frame files (requires the lz4 package)."""
+
+    suffix = ".lz4"
+    max_level = 16
+    module = lz4_frame
+    module_name = "lz4"
+    read_errors = (EOFError, RuntimeError)
+
+    def open_reader(self, file: Path) -> io.BufferedIOBase:
+        self.check_available()
+        return lz4_frame.open(file, "rb")
+
+    def open_writer(self, file: Path, compresslevel: Optional[int] = None) -> io.BufferedIOBase:
+        self.check_available()
+        self.check_level(compresslevel)
+        return lz4_frame.open(file, "wb", compression_level=0 if compresslevel is None else compresslevel)
+
+    def compress(self, data: bytes) -> bytes:
+        self.check_available()
+        return lz4_frame.compress(data)
@@ -124,6 +124,12 @@ def parse_run_args(argv: Sequence[str]) -> DictConfig:
         action="store_true",
         help="Re-initialize failed steps of an existing pipeline.",
     )
+    parser.add_argument(
+        "--reinit-incremental",
+        default=False,
+        action="store_true",
+        help="Re-initialize an existing pipeline, keeping the finished steps and datasets that did not change.",
+    )
     parser.add_argument(
         "--stop-previous-run", default=False, action="store_true", help="Stop previous pipeline execution first."
     )
@@ -166,6 +172,12 @@ def parse_status_args(argv: Sequence[str]) -> DictConfig:
     parser = OpusPocusParser(description=f"{GENERAL_DESCRIPTION}: Pipeline Step Status")
 
     _add_general_arguments(parser, pipeline_dir_required=True)
+    parser.add_argument(
+        "--verbose",
+        default=False,
+        action="store_true",
+        help="Include the output corpora statistics of the finished corpus steps.",
+    )
 
     return parse2config(parser, argv)
 
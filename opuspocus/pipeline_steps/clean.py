@@ -1,3 +1,4 @@
+import functools
 import json
 import logging
 import os
@@ -6,24 +7,55 @@ import signal
 import subprocess
 import sys
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-from attrs import define, field
+import numpy as np
+from attrs import converters, define, field, validators
 
 from opuspocus.pipeline_steps import register_step
 from opuspocus.pipeline_steps.corpus_step import CorpusStep
 from opuspocus.runner_resources import RunnerResources
-from opuspocus.utils import cut_filestream
+from opuspocus.tools import opuscleaner_clean
+from opuspocus.tools.deduplicate import read_example_range, read_examples
+from opuspocus.utils import cut_filestream, link_file, materialize_file
 
 logger = logging.getLogger(__name__)
 
+# "python": run the filter pipeline using the OpusCleaner Python modules (see opuspocus.tools.opuscleaner_clean)
+# "subprocess": run the opuscleaner_cmd executable
+CLEAN_BACKENDS = ("python", "subprocess")
+
 
 @register_step("clean")
 @define(kw_only=True)
 class CleanCorpusStep(CorpusStep):
-    """Class implementing dataset cleaning using OpusCleaner."""
+    """Class implementing dataset cleaning using OpusCleaner.
+
+    With the "python" `backend`, the .filters.json pipeline is loaded using the OpusCleaner Python modules once
+    per worker process and the dataset is cleaned in batches by a pool of the OPUSPOCUS_cpus worker processes.
+    The input datasets are read directly (no conversion of the input files is needed) and the cleaned examples
+    are written into the output dataset files. If OpusCleaner is not installed in the step's Python environment,
+    the "subprocess" backend (running `opuscleaner_cmd`) is used instead.
+
+    With `shard_size` set, the datasets are split into shards (see CorpusStep.shard_mode) cleaned by the parallel
+    subtasks. The datasets whose pipeline contains any of the `whole_file_filters` (or a filter with "dedup"
+    in its name) are cleaned unsharded by a single pipeline run, so e.g. the duplicates are removed across the whole
+    dataset.
+
+    With the "python" backend and `filter_cache_dir` set, the keep/drop decisions of the pipeline filters are cached
+    per input line (see opuspocus.tools.opuscleaner_clean.FilterDecisionCache), so rerunning the step with a modified
+    .filters.json only evaluates the filters from the first changed one onward. The uncached filters are run one
+    by one over each batch (instead of as a connected pipeline), so the cache is only enabled on request.
+    """
 
     opuscleaner_cmd: str = field(default="opuscleaner-clean")
+    backend: str = field(default="python", validator=validators.in_(CLEAN_BACKENDS))
+    whole_file_filters: List[str] = field(factory=lambda: list(opuscleaner_clean.WHOLE_FILE_FILTERS))
+    filter_cache_dir: Optional[Path] = field(converter=converters.optional(Path), default=None, eq=False)
+
+    # The filter decision cache does not affect the step outputs
+    fingerprint_exclude = (*CorpusStep.fingerprint_exclude, "filter_cache_dir")
+    cache_exclude = (*CorpusStep.cache_exclude, "filter_cache_dir")
 
     def register_categories(self) -> None:
         """Create a dataset list using the datasets listed in categories.json file.
@@ -33,41 +65,235 @@ class CleanCorpusStep(CorpusStep):
         """
         shutil.copy(self.prev_corpus_step.categories_path, self.categories_path)
 
+    @property
+    def n_workers(self) -> int:
+        """Number of the parallel processes (CPUs allocated to the running task)."""
+        return int(os.environ.get(RunnerResources.get_env_name("cpus"), "1"))
+
+    @property
+    def filter_decision_cache(self) -> Optional[opuscleaner_clean.FilterDecisionCache]:
+        """Cache of the filter decisions, None if the filter_cache_dir is not set."""
+        if self.filter_cache_dir is None:
+            return None
+        return opuscleaner_clean.FilterDecisionCache(cache_dir=self.filter_cache_dir)
+
+    def filter_cache_input_key(self, dataset: str, languages: List[str], line_range: Tuple[int, int]) -> Dict[str, Any]:
+        """Identify the cleaned examples by the checksums of the input dataset files and the (start, end) line range."""
+        prev_step = self.prev_corpus_step
+        checksums = [
+            prev_step.dataset_manifest_entry(prev_step.dataset_filename(dataset, lang))["sha256"] for lang in languages
+        ]
+        return {"sha256": checksums, "lines": list(line_range)}
+
+    def filters_path(self, dataset: str) -> Path:
+        """Full path to the dataset's .filters.json pipeline (created by the OpusCleaner server app)."""
+        return Path(self.input_dir, f"{dataset}.filters.json")
+
+    def needs_whole_file(self, dataset: str) -> bool:
+        """Check whether the dataset's filter pipeline contains a filter that must see the whole dataset at once."""
+        return opuscleaner_clean.needs_whole_file(self.filters_path(dataset), self.whole_file_filters)
+
+    def is_dataset_sharded(self, dataset: str) -> bool:
+        """Whether the dataset is cleaned in shards.
+
+        The datasets without a .filters.json pipeline (only linked to the output) and the datasets with a whole-file
+        filter in their pipeline (see CleanCorpusStep.needs_whole_file) are processed by a single subtask.
+        """
+        return self.is_sharded and self.filters_path(dataset).exists() and not self.needs_whole_file(dataset)
+
+    def shard_input_filename(self, filename: str) -> str:
+        """The shards of all languages are created from the source-side input dataset (so they stay aligned)."""
+        dataset, _ = self.parse_dataset_filename(filename)
+        return self.prev_corpus_step.dataset_filename(dataset, self.src_lang)
+
+    def shard_line_range(self, dataset: str, shard_idx: int) -> Tuple[int, int]:
+        """Return the (start, end) line numbers of the dataset shard.
+
+        The byte ranges of the shard plan are aligned to the line beginnings, they are converted using the input
+        line index.
+        """
+        src_filename = self.dataset_filename(dataset, self.src_lang)
+        line_index = self.prev_corpus_step.get_line_index(self.shard_input_filename(src_filename))
+        if not self.uses_shard_plan:
+            start = shard_idx * self.shard_size
+            return start, min(start + self.shard_size, len(line_index))
+        start, end = self.shard_plan["datasets"][src_filename][shard_idx]
+        return int(np.searchsorted(line_index, start)), int(np.searchsorted(line_index, end))
+
+    def read_shard_examples(self, dataset: str, languages: List[str], shard_idx: int) -> Iterator[List[bytes]]:
+        """Yield the aligned examples (segments in the given language order) of the dataset shard."""
+        input_files = [self.prev_corpus_step.dataset_path(dataset, lang) for lang in languages]
+        start, end = self.shard_line_range(dataset, shard_idx)
+        offsets = [int(self.prev_corpus_step.get_line_index(file.name)[start]) for file in input_files]
+        return read_example_range(input_files, offsets, end - start)
+
     def get_command_targets(self) -> List[Path]:
-        """One target file per each processed dataset."""
-        return [Path(self.output_dir, f"{dset}.{self.src_lang}.gz") for dset in self.dataset_list]
+        """One target file per each processed dataset.
+
+        If shard_size is set, return a target file for each source-side output dataset shard of the sharded datasets
+        instead (see CleanCorpusStep.is_dataset_sharded). The target-side shards are created by the same subtask
+        and all shards are merged in the CorpusStep.main_task_postprocess().
+        """
+        targets = []
+        for dset in self.dataset_list:
+            if self.is_dataset_sharded(dset):
+                targets.extend(self.infer_dataset_output_shard_path_list(self.dataset_filename(dset, self.src_lang)))
+            else:
+                targets.append(self.dataset_path(dset, self.src_lang))
+        return targets
 
     def command(self, target_file: Path) -> None:
         """Invoke OpusCleaner to process corpus based on the target_file.
 
         We infer the input corpus file, target-side corpus file and .filter.json file using the target_file.
+        If the target_file is a dataset shard, only the shard lines are cleaned and written into the output
+        shards of each language.
         """
-        # TODO: use OpusCleaner Python API instead when available
-        target_filename = target_file.stem + target_file.suffix
-        dataset = ".".join(str(target_filename).split(".")[:-2])
-        input_file = Path(self.input_dir, f"{dataset}.filters.json")
+        shard_idx = None
+        if target_file.parent == self.shard_dir:
+            filename, shard_idx = self.parse_dataset_shard_path(target_file)
+            dataset, _ = self.parse_dataset_filename(filename)
+        else:
+            dataset, _ = self.parse_dataset_filename(target_file.name)
+        input_file = self.filters_path(dataset)
 
-        opuscleaner_cmd = "opuscleaner-clean"
         if not input_file.exists():
             logger.info("%s file not found. Copying input corpora to output.", input_file)
             for lang in self.languages:
-                Path(self.output_dir, f"{dataset}.{lang}.gz").hardlink_to(Path(self.input_dir, f"{dataset}.{lang}.gz"))
+                link_file(
+                    self.prev_corpus_step.dataset_path(dataset, lang),
+                    self.dataset_path(dataset, lang),
+                    self.compression_level,
+                )
+            return
+
+        # Get the correct order of languages
+        corpus_filenames = json.load(open(input_file))["files"]  # noqa: PTH123, SIM115
+        languages = [file.split(".")[-2] for file in corpus_filenames]
+        # TODO(varisd): replace these asserts with something more clever
+        for lang in self.languages:
+            assert lang in languages
+        for lang in languages:
+            assert lang in self.languages
+
+        if shard_idx is None:
+            output_files = [self.dataset_path(dataset, lang) for lang in languages]
+        else:
+            output_files = [
+                self.dataset_shard_path(self.dataset_filename(dataset, lang), shard_idx) for lang in languages
+            ]
+
+        backend = self.backend
+        if backend == "python" and not opuscleaner_clean.is_available():
+            logger.warning(
+                "[%s] OpusCleaner Python package is not available, running %s instead.",
+                self.step_label,
+                self.opuscleaner_cmd,
+            )
+            backend = "subprocess"
+        if backend == "python":
+            self.clean_with_python(dataset, languages, output_files, shard_idx)
+        elif shard_idx is None:
+            base_dir = self.materialize_inputs(dataset, corpus_filenames, languages)
+            # The whole-file filters (e.g. deduplication) must process all examples by a single pipeline run
+            n_workers = 1 if self.needs_whole_file(dataset) else self.n_workers
+            self.run_opuscleaner_cmd(["-b", str(base_dir), str(input_file)], output_files, n_workers=n_workers)
+        else:
+            self.clean_shard_with_subprocess(dataset, languages, output_files, shard_idx)
+
+    def clean_with_python(
+        self, dataset: str, languages: List[str], output_files: List[Path], shard_idx: Optional[int] = None
+    ) -> None:
+        """Clean the dataset (or its shard) using the OpusCleaner Python modules (see CleanCorpusStep.backend).
+
+        The whole-file pipelines (see CleanCorpusStep.needs_whole_file) are streamed through a single pipeline run.
+        """
+
+        def step_terminate_handler(signum, _):  # noqa: ANN001, ANN202
+            err_msg = f"{self.step_label}.command received signal {signum}. Terminating..."
+            raise InterruptedError(err_msg)
+
+        signal.signal(signal.SIGUSR1, step_terminate_handler)
+        signal.signal(signal.SIGTERM, step_terminate_handler)
+
+        input_file = self.filters_path(dataset)
+        if shard_idx is None:
+            input_files = [self.prev_corpus_step.dataset_path(dataset, lang) for lang in languages]
+            read_input = functools.partial(read_examples, input_files)
+            line_range = (0, self.prev_corpus_step.dataset_line_count(input_files[0].name))
+        else:
+            read_input = functools.partial(self.read_shard_examples, dataset, languages, shard_idx)
+            line_range = self.shard_line_range(dataset, shard_idx)
+
+        cache = self.filter_decision_cache
+        if cache is None:
+            opuscleaner_clean.clean_corpus(
+                read_input(),
+                output_files,
+                input_file,
+                n_workers=self.n_workers,
+                compresslevel=self.compression_level,
+                whole_file=self.needs_whole_file(dataset),
+            )
             return
+        n_cached, examples = cache.clean_examples(
+            read_input,
+            line_range[1] - line_range[0],
+            input_file,
+            self.filter_cache_input_key(dataset, languages, line_range),
+            n_workers=self.n_workers,
+            whole_file_filters=self.whole_file_filters,
+        )
+        logger.info(
+            "[%s] Reusing the cached decisions of %i filter(s) of %s.", self.step_label, n_cached, output_files[0].name
+        )
+        opuscleaner_clean.write_examples(examples, output_files, self.compression_level)
+
+    def clean_shard_with_subprocess(
+        self, dataset: str, languages: List[str], output_files: List[Path], shard_idx: int
+    ) -> None:
+        """Clean the dataset shard using the opuscleaner_cmd executable.
 
-        # Run OpusCleaner
+        OpusCleaner reads the shard as a single tab-separated input file (created in the tmp_dir).
+        """
+        shard_input = Path(self.tmp_dir, f"{output_files[0].name}.tsv")
+        with shard_input.open("wb") as fh:
+            for example in self.read_shard_examples(dataset, languages, shard_idx):
+                fh.write(b"\t".join(example) + b"\n")
+        self.run_opuscleaner_cmd(
+            ["--input", str(shard_input), str(self.filters_path(dataset)), *languages],
+            output_files,
+            n_workers=self.n_workers,
+        )
+        shard_input.unlink()
+
+    def materialize_inputs(self, dataset: str, corpus_filenames: List[str], languages: List[str]) -> Path:
+        """Return the directory containing the input corpus files listed in the .filters.json file.
+
+        OpusCleaner expects the input corpus filenames listed in the .filters.json file (usually .gz). If the
+        prev_corpus_step uses a different compression (or virtual datasets), the input corpora are converted
+        (materialized) into the tmp_dir first.
+        """
+        base_dir = self.input_dir
+        if not all(Path(self.input_dir, filename).exists() for filename in corpus_filenames):
+            base_dir = Path(self.tmp_dir, dataset)
+            base_dir.mkdir(exist_ok=True)
+            for filename, lang in zip(corpus_filenames, languages):
+                corpus_path = Path(base_dir, filename)
+                if not corpus_path.exists():
+                    materialize_file(self.prev_corpus_step.dataset_path(dataset, lang), corpus_path)
+        return base_dir
+
+    def run_opuscleaner_cmd(self, input_args: List[str], output_files: List[Path], *, n_workers: int) -> None:
+        """Run the opuscleaner_cmd executable and split its output into the output files.
+
+        The input_args specify the pipeline file and its input (see `opuscleaner-clean --help`).
+        """
         proc = subprocess.Popen(
-            [
-                str(opuscleaner_cmd),
-                str(input_file),
-                "--parallel",
-                os.environ[RunnerResources.get_env_name("cpus")],
-                "-b",
-                str(self.input_dir),
-            ],
+            [str(self.opuscleaner_cmd), "--parallel", str(n_workers), *input_args],
             stdout=subprocess.PIPE,
             stderr=sys.stderr,
             env=os.environ,
-            text=True,
         )
 
         # Propagate the termination signal to the child process
@@ -80,17 +306,8 @@ class CleanCorpusStep(CorpusStep):
         signal.signal(signal.SIGUSR1, step_terminate_handler)
         signal.signal(signal.SIGTERM, step_terminate_handler)
 
-        # Get the correct order of languages
-        languages = [file.split(".")[-2] for file in json.load(open(input_file))["files"]]  # noqa: PTH123, SIM115
-        # TODO(varisd): replace these asserts with something more clever
-        for lang in self.languages:
-            assert lang in languages
-        for lang in languages:
-            assert lang in self.languages
-
         # Split OpusCleaner output into files
-        output_files = [Path(self.output_dir, f"{dataset}.{lang}.gz") for lang in languages]
-        cut_filestream(input_stream=proc.stdout, output_files=output_files)
+        cut_filestream(input_stream=proc.stdout, output_files=output_files, compresslevel=self.compression_level)
 
         # Check the return code
         rc = proc.poll()
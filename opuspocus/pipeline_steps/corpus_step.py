@@ -1,16 +1,55 @@
+import contextlib
+import hashlib
+import itertools
 import json
 import logging
+import os
+import time
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Dict, List, Optional
+from types import TracebackType
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Type, Union
 
+import numpy as np
 from attrs import Attribute, define, field, validators
-from typing_extensions import TypedDict
+from typing_extensions import Self, TypedDict
 
+from opuspocus.compression import CODEC_REGISTRY, Codec, bgzf_index_path, get_codec, get_codec_by_path
 from opuspocus.pipeline_steps.opuspocus_step import OpusPocusStep, StepState
-from opuspocus.utils import clean_dir, concat_files, file_line_index, read_shard
+from opuspocus.runner_resources import RunnerResources
+from opuspocus.utils import (
+    clean_dir,
+    concat_files,
+    file_byte_spans,
+    file_line_index,
+    file_sha256,
+    file_weighted_spans,
+    json_digest,
+    load_line_index,
+    open_file,
+    read_byte_range,
+    read_shard,
+    save_line_index,
+)
+from opuspocus.virtual_files import (
+    check_virtual_file,
+    file_exists,
+    is_relocatable_virtual_file,
+    is_virtual_file,
+    load_virtual_parts,
+    save_virtual_file,
+    stored_file_size,
+    virtual_file_path,
+)
 
 logger = logging.getLogger(__name__)
 
+# "lines": shards of shard_size lines located using the input line index
+# "bytes": shards of similar byte size (approx. shard_size lines) planned by CorpusStep.build_shard_plan
+# "chars", "tokens": same number of shards as "bytes", balanced by the number of characters or whitespace tokens
+SHARD_MODES = ("lines", "bytes", "chars", "tokens")
+
 
 # TODO(varisd): can we future-proof this against type changes in OpusCleaner?
 class CategoryEntry(TypedDict):
@@ -22,6 +61,149 @@ class CategoriesDict(TypedDict):
     mapping: Dict[str, List[str]]
 
 
+class CorpusValidationError(Exception):
+    """Error class for reporting invalid (misaligned, truncated or corrupted) corpus files."""
+
+    def __init__(self, message):  # noqa: ANN001,ANN204
+        self.message = message
+        super().__init__(self.message)
+
+
+class DatasetManifestEntry(TypedDict):
+    file: str
+    lines: int
+    bytes: int
+    file_bytes: int
+    compression: str
+    sha256: str
+
+
+class ManifestDict(TypedDict):
+    version: int
+    datasets: Dict[str, Dict[str, DatasetManifestEntry]]
+
+
+class ShardPlanDict(TypedDict):
+    version: int
+    mode: str
+    datasets: Dict[str, List[Tuple[int, int]]]
+
+
+class DatasetFingerprintsDict(TypedDict):
+    version: int
+    datasets: Dict[str, str]
+    checksums: Dict[str, Tuple[int, int, str]]
+
+
+class ContentDigest:
+    """Accumulate the size and the SHA-256 checksum of the (uncompressed) file contents."""
+
+    def __init__(self) -> None:
+        self.n_bytes = 0
+        self._sha256 = hashlib.sha256()
+
+    def update(self, data: bytes) -> None:
+        self.n_bytes += len(data)
+        self._sha256.update(data)
+
+    def hexdigest(self) -> str:
+        return self._sha256.hexdigest()
+
+
+class LineIndexDict(Mapping):
+    """Read-only view of the CorpusStep dataset line indices.
+
+    The individual line indices are loaded lazily on access using CorpusStep.get_line_index().
+    """
+
+    def __init__(self, step: "CorpusStep") -> None:
+        self._step = step
+
+    def __getitem__(self, filename: str) -> np.ndarray:
+        if filename not in self._step.dataset_filename_list:
+            raise KeyError(filename)
+        return self._step.get_line_index(filename)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._step.dataset_filename_list)
+
+    def __len__(self) -> int:
+        return len(self._step.dataset_filename_list)
+
+
+@define(kw_only=True)
+class ParallelCorpus:
+    """Lazy line-aligned view of the per-language files of a (parallel) dataset.
+
+    Iterating yields tuples of the aligned lines (without the trailing newlines) in the order of the files,
+    so the bilingual data can be streamed without pasting the files into a temporary TSV file.
+    """
+
+    files: List[Path] = field(converter=lambda files: [Path(file) for file in files])
+
+    @classmethod
+    def from_step(cls: "ParallelCorpus", step: "CorpusStep", dataset: str) -> "ParallelCorpus":
+        """Create the view of a CorpusStep output dataset (one file per step language)."""
+        return cls(files=[step.dataset_path(dataset, lang) for lang in step.languages])
+
+    def __iter__(self) -> Iterator[Tuple[str, ...]]:
+        with contextlib.ExitStack() as stack:
+            fhs = [stack.enter_context(open_file(file, "r")) for file in self.files]
+            for i, lines in enumerate(itertools.zip_longest(*fhs)):
+                if None in lines:
+                    err_msg = (
+                        f"Parallel corpus files {', '.join(str(file) for file in self.files)} have a different "
+                        f"number of lines (mismatch at line {i + 1})."
+                    )
+                    raise ValueError(err_msg)
+                yield tuple(line.rstrip("\n") for line in lines)
+
+
+class ParallelCorpusWriter:
+    """Writer of the line-aligned examples into the per-language files.
+
+    Counterpart of the ParallelCorpus. Each written example (tuple of segments without the newlines) is split
+    into the respective files. Use as a context manager, so the (compressed) files are properly closed.
+    """
+
+    def __init__(self, files: Sequence[Path], compresslevel: Optional[int] = None) -> None:
+        self.files = [Path(file) for file in files]
+        self._fhs = [open_file(file, "w", compresslevel) for file in self.files]
+
+    def write(self, example: Sequence[str]) -> None:
+        """Write a single example."""
+        if len(example) != len(self._fhs):
+            err_msg = f"Example has {len(example)} segments, expected {len(self._fhs)} ({example})."
+            raise ValueError(err_msg)
+        for segment, fh in zip(example, self._fhs):
+            if "\n" in segment:
+                err_msg = f"Segment contains a newline, which would break the corpus alignment ({segment!r})."
+                raise ValueError(err_msg)
+            fh.write(segment)
+            fh.write("\n")
+
+    def writelines(self, examples: Iterable[Sequence[str]]) -> None:
+        """Write a sequence of examples."""
+        for example in examples:
+            self.write(example)
+
+    def close(self) -> None:
+        """Close all the files."""
+        for fh in self._fhs:
+            fh.close()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+
 @define(kw_only=True)
 class CorpusStep(OpusPocusStep):
     """Base class for corpus-producing pipeline steps.
@@ -32,15 +214,80 @@ class CorpusStep(OpusPocusStep):
     Compared to OpusPocusStep, it provides additional functionality, such as
     file sharding or indication of the corpora provided by the step at the end
     of its execution.
+
+    With `shard_size`, the step processes its datasets in shards of shard_size lines of the prev_corpus_step
+    datasets. With `shard_mode` set to "bytes", the shards are instead byte ranges of a similar size planned
+    at the beginning of the step execution (see CorpusStep.build_shard_plan), so the input line index is not needed.
+    The "chars" and "tokens" modes balance the byte ranges by the number of characters or (whitespace) tokens
+    instead, which better reflects the processing time of, e.g., translation. With shard_size="auto", the number
+    of shards of each dataset is derived from its size, the runner parallelism and the measured throughput of
+    the previous runs of the same step type, aiming at `shard_target_seconds` per shard (see CorpusStep.infer_n_shards).
+
+    The dataset files are compressed using the `compression` codec (gzip, zstd, lz4 or none) at the
+    `compression_level` (codec default if None). Both are inherited from the prev_corpus_step unless set,
+    so the intermediate steps can use a fast codec while the final steps produce, e.g., gzip-compressed corpora.
+
+    At the end of the execution, the output dataset files are validated (complete compressed streams, same number
+    of lines in each language and, with `validate_utf8`, valid UTF-8 contents).
+
+    With `virtual_datasets` (inherited from the prev_corpus_step), the sharded output datasets (and the gathered
+    datasets, see GatherCorpusStep) are not concatenated into new files. They are virtual files listing their parts
+    instead (see opuspocus.virtual_files), which are read as a single stream by open_file. The steps running
+    external tools that need a real file (Marian, OpusCleaner) materialize their inputs (see materialize_file).
+
+    Every dataset has a fingerprint derived from its inputs and the step parameters (see
+    CorpusStep.build_dataset_fingerprints). When the pipeline is re-initialized incrementally, only the new
+    or changed datasets are processed again, the outputs of the unchanged ones are kept
+    (see CorpusStep.reinit_incremental).
     """
 
     prev_corpus_step: "CorpusStep" = field(default=None)
 
     src_lang: str = field(validator=validators.instance_of(str))
     tgt_lang: str = field(validator=validators.optional(validators.instance_of(str)))
-    shard_size: int = field(validator=validators.optional(validators.gt(0)))
+    shard_size: Optional[Union[int, str]] = field()
+    shard_mode: str = field(validator=validators.in_(SHARD_MODES))
+    shard_target_seconds: int = field(validator=validators.gt(0))
+    compression: str = field(validator=validators.in_(CODEC_REGISTRY))
+    compression_level: Optional[int] = field(validator=validators.optional(validators.instance_of(int)))
+    validate_utf8: bool = field(default=False, validator=validators.instance_of(bool))
+    virtual_datasets: bool = field(validator=validators.instance_of(bool))
 
     _categories_file = "categories.json"
+    _manifest_file = "manifest.json"
+    _manifest_version = 1
+    _shard_plan_file = "shard_plan.json"
+    _shard_plan_version = 1
+    _shard_throughput_file = "shard_throughput.json"
+    _subtask_times_file = "subtask_times.tsv"
+    _shard_done_suffix = ".done"
+    _line_index_suffix = ".idx"
+    _fingerprints_file = "dataset_fingerprints.json"
+    _fingerprints_version = 1
+
+    # Dependencies providing the input datasets (see CorpusStep.dataset_input_fingerprints), the fingerprints
+    # of the other corpus step dependencies affect every dataset of the step
+    _fingerprint_input_steps = ("prev_corpus_step",)
+    # Parameters that do not affect the contents of the output datasets
+    fingerprint_exclude = (
+        "step_label",
+        "pipeline_dir",
+        "runner_resources",
+        "shard_size",
+        "shard_mode",
+        "shard_target_seconds",
+        "virtual_datasets",
+        "cache_dir",
+    )
+    cache_exclude = (*OpusPocusStep.cache_exclude, "shard_size", "shard_mode", "shard_target_seconds")
+
+    # shard_size="auto": lines per shard without the throughput measurements, minimum lines per shard
+    _auto_shard_default_lines = 100000
+    _auto_shard_min_lines = 10000
+
+    _line_index_cache: Dict[str, np.ndarray] = field(init=False, factory=dict, eq=False, repr=False)
+    _json_cache: Dict[Path, Tuple[Tuple[int, int], Any]] = field(init=False, factory=dict, eq=False, repr=False)
+    _file_checksums: Dict[str, Tuple[int, int, str]] = field(init=False, factory=dict, eq=False, repr=False)
 
     @prev_corpus_step.validator
     def _none_or_inherited_from_corpus_step(self, attribute: Attribute, value: Optional["CorpusStep"]) -> None:
@@ -61,11 +308,63 @@ class CorpusStep(OpusPocusStep):
         return None
 
     @shard_size.default
-    def _inherit_shard_size_from_prev_step(self) -> Optional[int]:
+    def _inherit_shard_size_from_prev_step(self) -> Optional[Union[int, str]]:
         if self.prev_corpus_step is not None:
             return self.prev_corpus_step.shard_size
         return None
 
+    @shard_size.validator
+    def _positive_int_or_auto(self, attribute: Attribute, value: Optional[Union[int, str]]) -> None:
+        if value is None or value == "auto":
+            return
+        if not isinstance(value, int) or value <= 0:
+            err_msg = f"{attribute.name} value must be a positive integer, 'auto' or None (got {value!r})"
+            raise ValueError(err_msg)
+
+    @shard_mode.default
+    def _inherit_shard_mode_from_prev_step(self) -> str:
+        if self.prev_corpus_step is not None:
+            return self.prev_corpus_step.shard_mode
+        return "lines"
+
+    @shard_target_seconds.default
+    def _inherit_shard_target_seconds_from_prev_step(self) -> int:
+        if self.prev_corpus_step is not None:
+            return self.prev_corpus_step.shard_target_seconds
+        return 3600
+
+    @virtual_datasets.default
+    def _inherit_virtual_datasets_from_prev_step(self) -> bool:
+        if self.prev_corpus_step is not None:
+            return self.prev_corpus_step.virtual_datasets
+        return False
+
+    @compression.default
+    def _inherit_compression_from_prev_step(self) -> str:
+        if self.prev_corpus_step is not None:
+            return self.prev_corpus_step.compression
+        return "gzip"
+
+    @compression.validator
+    def _codec_available(self, _: str, value: str) -> None:
+        get_codec(value).check_available()
+
+    @compression_level.default
+    def _inherit_compression_level_from_prev_step(self) -> Optional[int]:
+        # The compression levels are codec-specific
+        if self.prev_corpus_step is not None and self.prev_corpus_step.compression == self.compression:
+            return self.prev_corpus_step.compression_level
+        return None
+
+    @compression_level.validator
+    def _level_supported_by_codec(self, _: str, value: Optional[int]) -> None:
+        get_codec(self.compression).check_level(value)
+
+    @property
+    def codec(self) -> Codec:
+        """Compression codec of the dataset files."""
+        return get_codec(self.compression)
+
     @property
     def input_dir(self) -> Optional[Path]:
         """Previous step's output directory."""
@@ -78,12 +377,37 @@ class CorpusStep(OpusPocusStep):
         """Full path to the categories.json."""
         return Path(self.output_dir, self._categories_file)
 
+    def _load_json(self, file_path: Path) -> Optional[Any]:  # noqa: ANN401
+        """Load a JSON step file, caching its contents until the file is modified.
+
+        Only the file status is checked on the repeated calls, so the step metadata can be safely accessed
+        in loops. Return None if the file does not exist.
+        """
+        try:
+            stat = file_path.stat()
+        except FileNotFoundError:
+            self._json_cache.pop(file_path, None)
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._json_cache.get(file_path)
+        if cached is None or cached[0] != key:
+            with file_path.open("r") as fh:
+                cached = (key, json.load(fh))
+            self._json_cache[file_path] = cached
+        return cached[1]
+
+    def _save_json(self, obj: Any, file_path: Path) -> None:  # noqa: ANN401
+        """Atomically (over)write a JSON step file."""
+        tmp_path = file_path.with_name(f".{file_path.name}.tmp")
+        with tmp_path.open("w") as fh:
+            json.dump(obj, fh, indent=2)
+        tmp_path.replace(file_path)
+        self._json_cache.pop(file_path, None)
+
     @property
     def categories_dict(self) -> Optional[CategoriesDict]:
         """Contents of the categories.json file."""
-        if not self.categories_path.exists():
-            return None
-        return json.load(self.categories_path.open("r"))
+        return self._load_json(self.categories_path)
 
     @property
     def categories(self) -> Optional[List[str]]:
@@ -109,31 +433,613 @@ class CorpusStep(OpusPocusStep):
     @property
     def dataset_filename_list(self) -> List[str]:
         """Full list of all the output_dir dataset filenames."""
-        return [f"{dset}.{lang}.gz" for dset in self.dataset_list for lang in self.languages]
+        return [self.dataset_filename(dset, lang) for dset in self.dataset_list for lang in self.languages]
+
+    def dataset_filename(self, dataset: str, lang: str) -> str:
+        """Filename of the dataset file in a given language (including the compression suffix)."""
+        return f"{dataset}.{lang}{self.codec.suffix}"
+
+    def dataset_path(self, dataset: str, lang: str) -> Path:
+        """Full path to the output_dir dataset file in a given language."""
+        return Path(self.output_dir, self.dataset_filename(dataset, lang))
+
+    def parse_dataset_filename(self, filename: str) -> Tuple[str, str]:
+        """Split the dataset filename (created by CorpusStep.dataset_filename) into the dataset name and language."""
+        suffix = self.codec.suffix
+        if suffix and filename.endswith(suffix):
+            filename = filename[: -len(suffix)]
+        dataset, lang = filename.rsplit(".", 1)
+        return dataset, lang
+
+    @property
+    def shard_dir(self) -> Path:
+        """Location of the output dataset shards.
+
+        Unlike the tmp_dir, the finished shards are kept when a failed step is resubmitted without the removal
+        of the finished command targets, so only the missing shards are processed again. The directory gets deleted
+        after a successful step completion.
+        """
+        return Path(self.step_dir, "shards")
+
+    def dataset_shard_path(self, filename: str, shard_idx: int) -> Path:
+        """Full path to the output shard of a given dataset file."""
+        return Path(self.shard_dir, f"{filename}.{shard_idx}{self.codec.suffix}")
 
     @property
-    def line_index_dict(self) -> Dict[str, List[int]]:
-        """Provide a list of file seek indices for each registered dataset.
+    def parts_dir(self) -> Path:
+        """Location of the member files of the virtual output datasets (see CorpusStep.virtual_datasets)."""
+        return Path(self.output_dir, "parts")
+
+    def shard_done_path(self, shard_path: Path) -> Path:
+        """Full path to the completion marker of a given output shard."""
+        return Path(self.shard_dir, f"{shard_path.name}{self._shard_done_suffix}")
+
+    def parse_dataset_shard_path(self, shard_path: Path) -> Tuple[str, int]:
+        """Return the dataset filename and the shard index of a shard created by CorpusStep.dataset_shard_path."""
+        shard_name = shard_path.name
+        if self.codec.suffix:
+            shard_name = shard_name[: -len(self.codec.suffix)]
+        filename, shard_idx = shard_name.rsplit(".", 1)
+        return filename, int(shard_idx)
+
+    @property
+    def line_index_dict(self) -> Mapping[str, np.ndarray]:
+        """Provide file seek indices for each registered dataset.
 
         The indices can be used to seek shard inputs for the respective output shard files.
 
         Return:
-            A dictionary with keys reflecting the .output_dir filenames
-            and values containing the lists of seek indices indicating
-            beginning of line in the respective files.
+            A mapping with keys reflecting the .output_dir filenames
+            and values containing the arrays of seek indices indicating
+            beginning of line in the respective files. The arrays are
+            loaded lazily, on access.
         """
         assert self.state == StepState.DONE, (
             f"{self.step_label}.output_dir dataset's line index can only be construceted "
             "after the step successfully finished execution."
         )
+        return LineIndexDict(self)
+
+    def line_index_path(self, filename: str) -> Path:
+        """Location of the line index file of a given output_dir dataset file."""
+        return Path(self.output_dir, f"{filename}{self._line_index_suffix}")
+
+    def build_line_index(self, filename: str, *, check_utf8: bool = False) -> DatasetManifestEntry:
+        """Create the line index file for a given output_dir dataset file.
+
+        The whole file is decompressed, therefore, the truncated or corrupted compressed files are detected.
+        With check_utf8=True, the file contents are also checked to be valid UTF-8.
+
+        Return:
+            The dataset file manifest entry. The file statistics are collected while reading the file for
+            the line index construction.
+        """
+        file_path = Path(self.output_dir, filename)
+        digest = ContentDigest()
+        try:
+            line_index = file_line_index(file_path, digest, check_utf8=check_utf8)
+        except UnicodeDecodeError as err:
+            err_msg = f"[{self.step_label}] {filename} is not a valid UTF-8 file: {err}"
+            raise CorpusValidationError(err_msg) from err
+        except get_codec_by_path(file_path).read_errors as err:
+            err_msg = f"[{self.step_label}] {filename} is truncated or corrupted: {err}"
+            raise CorpusValidationError(err_msg) from err
+        save_line_index(line_index, self.line_index_path(filename))
+        self._line_index_cache.pop(filename, None)
+        return {
+            "file": filename,
+            "lines": len(line_index),
+            "bytes": digest.n_bytes,
+            "file_bytes": stored_file_size(file_path),
+            "compression": self.compression,
+            "sha256": digest.hexdigest(),
+        }
+
+    def get_line_index(self, filename: str) -> np.ndarray:
+        """Return the (memory-mapped) line index of a given output_dir dataset file.
+
+        The index is loaded only once per step instance. If the index file does not exist (e.g. the step finished
+        before the index files were introduced), it is created first.
+        """
+        assert self.state == StepState.DONE, (
+            f"{self.step_label}.output_dir dataset's line index can only be loaded "
+            "after the step successfully finished execution."
+        )
+        if filename not in self._line_index_cache:
+            index_path = self.line_index_path(filename)
+            if not index_path.exists():
+                logger.info("[%s] Line index %s not found. Creating...", self.step_label, index_path)
+                self.build_line_index(filename)
+            self._line_index_cache[filename] = load_line_index(index_path)
+        return self._line_index_cache[filename]
+
+    @property
+    def manifest_path(self) -> Path:
+        """Full path to the manifest.json describing the output_dir dataset files."""
+        return Path(self.output_dir, self._manifest_file)
+
+    @property
+    def manifest(self) -> ManifestDict:
+        """Contents of the manifest.json file.
+
+        The manifest is written at the end of the step execution and contains the line count, the uncompressed
+        and compressed byte size, the compression codec and the content checksum of every dataset file.
+        If the manifest does not exist (e.g. the step finished before the manifests were introduced), it is
+        created first.
+        """
+        assert (
+            self.state == StepState.DONE
+        ), f"{self.step_label}.output_dir manifest can only be loaded after the step successfully finished execution."
+        manifest = self._load_json(self.manifest_path)
+        if manifest is None:
+            logger.info("[%s] Manifest %s not found. Creating...", self.step_label, self.manifest_path)
+            self.build_manifest()
+            manifest = self._load_json(self.manifest_path)
+        return manifest
+
+    def build_manifest(self, *, reuse_entries: bool = False) -> None:
+        """Index and validate every output_dir dataset file and save the collected file statistics into manifest.json.
+
+        The files are read in parallel (one thread per file, up to the OPUSPOCUS_cpus allocated to the running task),
+        the first invalid file cancels the remaining work. Afterwards, the line counts of the dataset files
+        in the individual languages are compared.
+
+        With reuse_entries, the entries of an existing manifest (i.e. the datasets kept by
+        CorpusStep.reinit_incremental) are reused if their files were not modified and their line indices exist.
+        """
+        entries: Dict[str, DatasetManifestEntry] = {}
+        previous = self._load_json(self.manifest_path) if reuse_entries else None
+        if previous is not None:
+            for langs in previous["datasets"].values():
+                for entry in langs.values():
+                    file_path = Path(self.output_dir, entry["file"])
+                    if (
+                        file_exists(file_path)
+                        and stored_file_size(file_path) == entry["file_bytes"]
+                        and self.line_index_path(entry["file"]).exists()
+                    ):
+                        entries[entry["file"]] = entry
+        filenames = [f_name for f_name in self.dataset_filename_list if f_name not in entries]
+        if filenames:
+            n_threads = int(os.environ.get(RunnerResources.get_env_name("cpus"), "1"))
+            with ThreadPoolExecutor(max_workers=min(len(filenames), n_threads)) as executor:
+                futures = {
+                    executor.submit(self.build_line_index, f_name, check_utf8=self.validate_utf8): f_name
+                    for f_name in filenames
+                }
+                try:
+                    for future in as_completed(futures):
+                        entries[futures[future]] = future.result()
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+
+        manifest: ManifestDict = {"version": self._manifest_version, "datasets": {}}
+        for dset in self.dataset_list:
+            manifest["datasets"][dset] = {lang: entries[self.dataset_filename(dset, lang)] for lang in self.languages}
+        self._check_line_parity(manifest)
+        self._save_json(manifest, self.manifest_path)
+
+    def _check_line_parity(self, manifest: ManifestDict) -> None:
+        """Check that the dataset files in the individual languages have the same number of lines."""
+        mismatched = []
+        for dset, langs in manifest["datasets"].items():
+            if len({entry["lines"] for entry in langs.values()}) > 1:
+                counts = ", ".join(f"{lang}: {entry['lines']}" for lang, entry in langs.items())
+                mismatched.append(f"{dset} ({counts})")
+        if mismatched:
+            err_msg = (
+                f"[{self.step_label}] Dataset files have a different number of lines in the individual languages: "
+                f"{'; '.join(mismatched)}."
+            )
+            raise CorpusValidationError(err_msg)
 
-        idx_dict = {}
+    def preflight_check(self, datasets: Optional[Iterable[str]] = None) -> None:
+        """Cheap validation of the output_dir dataset files before they are used by an expensive step.
+
+        Only the manifest and the file status are checked (no decompression): the files must exist, they must
+        not be modified after the manifest was written (same compressed size) and the line counts in the individual
+        languages must match.
+
+        Args:
+            datasets: datasets to check (all step datasets if None)
+        """
+        manifest = self.manifest
+        if datasets is None:
+            datasets = self.dataset_list
+        checked: ManifestDict = {"version": manifest["version"], "datasets": {}}
+        for dset in datasets:
+            if dset not in manifest["datasets"]:
+                err_msg = f"[{self.step_label}] Dataset {dset} is not listed in {self.manifest_path}."
+                raise CorpusValidationError(err_msg)
+            for entry in manifest["datasets"][dset].values():
+                file_path = Path(self.output_dir, entry["file"])
+                if not file_exists(file_path):
+                    err_msg = f"[{self.step_label}] Dataset file {file_path} does not exist."
+                    raise CorpusValidationError(err_msg)
+                if stored_file_size(file_path) != entry["file_bytes"]:
+                    err_msg = (
+                        f"[{self.step_label}] Dataset file {file_path} was modified after the step finished "
+                        f"(size {stored_file_size(file_path)}, expected {entry['file_bytes']})."
+                    )
+                    raise CorpusValidationError(err_msg)
+                if is_virtual_file(file_path):
+                    try:
+                        check_virtual_file(file_path)
+                    except FileNotFoundError as err:
+                        err_msg = f"[{self.step_label}] {err}"
+                        raise CorpusValidationError(err_msg) from err
+            checked["datasets"][dset] = manifest["datasets"][dset]
+        self._check_line_parity(checked)
+        logger.info("[%s] Preflight check of %i dataset(s) passed.", self.step_label, len(checked["datasets"]))
+
+    def dataset_manifest_entry(self, filename: str) -> DatasetManifestEntry:
+        """Return the manifest entry of a given output_dir dataset file."""
+        dset, lang = self.parse_dataset_filename(filename)
+        try:
+            return self.manifest["datasets"][dset][lang]
+        except KeyError:
+            err_msg = f"{filename} is not listed in {self.manifest_path}."
+            raise KeyError(err_msg) from None
+
+    def dataset_line_count(self, filename: str) -> int:
+        """Return the number of lines of a given output_dir dataset file (without reading the file)."""
+        return self.dataset_manifest_entry(filename)["lines"]
+
+    @property
+    def dataset_fingerprints_path(self) -> Path:
+        """Full path to the dataset_fingerprints.json."""
+        return Path(self.step_dir, self._fingerprints_file)
+
+    @property
+    def dataset_fingerprints(self) -> Dict[str, str]:
+        """Fingerprints of the step datasets saved during the step initialization.
+
+        If the fingerprint file does not exist (e.g. the step was initialized before the fingerprints were
+        introduced), it is created first.
+        """
+        fingerprints = self._load_json(self.dataset_fingerprints_path)
+        if fingerprints is None:
+            logger.info("[%s] Fingerprints %s not found. Creating...", self.step_label, self.dataset_fingerprints_path)
+            self._save_json(self.build_dataset_fingerprints(), self.dataset_fingerprints_path)
+            fingerprints = self._load_json(self.dataset_fingerprints_path)
+        return fingerprints["datasets"]
+
+    def build_dataset_fingerprints(self) -> DatasetFingerprintsDict:
+        """Compute the fingerprints of the registered datasets.
+
+        A dataset fingerprint is a checksum of the step parameters affecting the dataset contents, the fingerprints
+        of the corpus step dependencies that do not provide the dataset inputs (e.g. the decontamination test sets)
+        and the fingerprints of the dataset inputs (see CorpusStep.dataset_input_fingerprints). The fingerprints
+        only depend on the dependency fingerprints, so they are available before the dependencies are executed.
+        """
+        params = {
+            k: v
+            for k, v in self.get_parameters_dict(exclude_dependencies=False).items()
+            if k not in self.fingerprint_exclude
+        }
+        deps = {
+            name: dep.dataset_fingerprints
+            for name, dep in self.dependencies.items()
+            if isinstance(dep, CorpusStep) and name not in self._fingerprint_input_steps
+        }
+        step_digest = json_digest({"step": self.step, "parameters": params, "dependencies": deps})
+
+        self._file_checksums.clear()
+        datasets = {
+            dset: json_digest([step_digest, self.dataset_input_fingerprints(dset)]) for dset in self.dataset_list
+        }
+        return {"version": self._fingerprints_version, "datasets": datasets, "checksums": dict(self._file_checksums)}
+
+    def dataset_input_fingerprints(self, dataset: str) -> List[str]:
+        """Fingerprints of the inputs of a given dataset.
+
+        By default, the dataset is created from the prev_corpus_step dataset of the same name. Steps without
+        the prev_corpus_step should return the checksums of their input files (see CorpusStep.file_checksum).
+        """
+        if self.prev_corpus_step is None:
+            return []
+        return [self.prev_corpus_step.dataset_fingerprints[dataset]]
+
+    def file_checksum(self, file_path: Path) -> str:
+        """SHA-256 checksum of an input file.
+
+        The checksums are saved together with the dataset fingerprints and reused as long as the file size and
+        modification time do not change, so the unchanged input files are not read again.
+        """
+        stat = file_path.stat()
+        key = str(file_path.resolve())
+        checksum = self._file_checksums.get(key)
+        if checksum is None:
+            saved = self._load_json(self.dataset_fingerprints_path)
+            if saved is not None:
+                checksum = saved["checksums"].get(key)
+        if checksum is None or list(checksum[:2]) != [stat.st_size, stat.st_mtime_ns]:
+            checksum = (stat.st_size, stat.st_mtime_ns, file_sha256(file_path))
+        self._file_checksums[key] = tuple(checksum)
+        return checksum[2]
+
+    def dataset_output_files(self, dataset: str) -> List[Path]:
+        """All output_dir files belonging to a given dataset.
+
+        Besides the dataset files, it includes their line indices, BGZF indices and the virtual file manifests
+        with their parts (if present).
+        """
+        files = []
+        for lang in self.languages:
+            file_path = self.dataset_path(dataset, lang)
+            files += [file_path, self.line_index_path(file_path.name), bgzf_index_path(file_path)]
+            if is_virtual_file(file_path):
+                files.append(virtual_file_path(file_path))
+                for part in load_virtual_parts(file_path):
+                    part_path = Path(part["file"])
+                    if part_path.parent == self.parts_dir.resolve():
+                        part_path = Path(self.parts_dir, part_path.name)
+                        files += [part_path, bgzf_index_path(part_path)]
+        return files
+
+    @property
+    def output_digest(self) -> str:
+        """Use the dataset content checksums from the manifest instead of reading the dataset files again.
+
+        The other output_dir files (e.g. categories.json) are checksummed directly.
+        """
+        dataset_files = {self.manifest_path}
         for f_name in self.dataset_filename_list:
-            idx_dict[f_name] = file_line_index(Path(self.output_dir, f_name))
-        return idx_dict
+            file_path = Path(self.output_dir, f_name)
+            dataset_files |= {
+                file_path,
+                virtual_file_path(file_path),
+                self.line_index_path(f_name),
+                bgzf_index_path(file_path),
+            }
+        other_files = {
+            path.relative_to(self.output_dir).as_posix(): file_sha256(path)
+            for path in sorted(self.output_dir.rglob("*"))
+            if path.is_file() and path not in dataset_files and self.parts_dir not in path.parents
+        }
+        datasets = {f_name: self.dataset_manifest_entry(f_name)["sha256"] for f_name in self.dataset_filename_list}
+        return json_digest({"datasets": datasets, "files": other_files})
+
+    @property
+    def is_cacheable(self) -> bool:
+        """Virtual datasets referencing files outside of the output_dir (e.g. the inputs of a virtual
+        GatherCorpusStep dataset) cannot be cached.
+        """
+        return all(
+            is_relocatable_virtual_file(Path(self.output_dir, f_name))
+            for f_name in self.dataset_filename_list
+            if is_virtual_file(Path(self.output_dir, f_name))
+        )
+
+    def restore_from_cache(self) -> bool:
+        """Also drop the cached contents of the replaced step files."""
+        if not super().restore_from_cache():
+            return False
+        self._line_index_cache.clear()
+        self._json_cache.clear()
+        return True
+
+    def clean_directories(self, *, remove_finished_command_targets: bool = True) -> None:
+        """Also drop the cached line indices and manifest of the removed files.
+
+        The output shards (see CorpusStep.shard_dir) and the shard plan are removed together with the finished
+        command targets. Otherwise, the unfinished shards are reprocessed by the resubmitted step.
+        """
+        super().clean_directories(remove_finished_command_targets=remove_finished_command_targets)
+        self._line_index_cache.clear()
+        self._json_cache.pop(self.manifest_path, None)
+        if remove_finished_command_targets:
+            if self.shard_dir.exists():
+                clean_dir(self.shard_dir)
+            self.shard_plan_path.unlink(missing_ok=True)
+            self._json_cache.pop(self.shard_plan_path, None)
+
+    @property
+    def is_sharded(self) -> bool:
+        """Whether the step processes the prev_corpus_step datasets in shards."""
+        return self.shard_size is not None and self.prev_corpus_step is not None
+
+    @property
+    def uses_shard_plan(self) -> bool:
+        """Whether the shards are given by the shard plan instead of the fixed number of lines per shard."""
+        return self.is_sharded and (self.shard_mode != "lines" or self.shard_size == "auto")
+
+    @property
+    def shard_plan_path(self) -> Path:
+        """Full path to the shard_plan.json."""
+        return Path(self.step_dir, self._shard_plan_file)
+
+    @property
+    def shard_plan(self) -> ShardPlanDict:
+        """Contents of the shard_plan.json file (created first, if it does not exist).
+
+        The plan maps each output_dir dataset filename to the list of (start, end) byte ranges of its
+        shard input file (see CorpusStep.shard_input_filename).
+        """
+        plan = self._load_json(self.shard_plan_path)
+        if plan is None:
+            self.build_shard_plan()
+            plan = self._load_json(self.shard_plan_path)
+        return plan
+
+    def build_shard_plan(self, runner: Optional["OpusPocusRunner"] = None) -> None:  # noqa: F821
+        """Split the shard input files into byte ranges aligned to the line beginnings and save the shard_plan.json.
+
+        The number of shards is derived from the prev_corpus_step manifest (see CorpusStep.infer_n_shards),
+        so neither the line index nor the full contents of the (seekable) input files are read in the "bytes"
+        shard mode. In the "chars" and "tokens" shard modes, the input files are read once to balance the shards
+        by their line weights. In the "lines" mode (with shard_size="auto"), the input line index is used
+        to split the files into shards with the same number of lines.
+
+        The inputs of the datasets kept from the previous run (see CorpusStep.reinit_incremental) are not split.
+        """
+        input_filenames = {f_name: self.shard_input_filename(f_name) for f_name in self.dataset_filename_list}
+        entries = {
+            input_filename: self.prev_corpus_step.dataset_manifest_entry(input_filename)
+            for input_filename in input_filenames.values()
+        }
+        kept = set(entries) - {
+            input_filename
+            for f_name, input_filename in input_filenames.items()
+            if not file_exists(Path(self.output_dir, f_name))
+        }
+        n_shards = self.infer_n_shards(
+            {filename: entry["lines"] for filename, entry in entries.items() if filename not in kept}, runner
+        )
+
+        spans = {}
+        for input_filename, entry in entries.items():
+            input_path = Path(self.input_dir, input_filename)
+            if input_filename in kept:
+                spans[input_filename] = [(0, entry["bytes"])]
+            elif self.shard_mode == "lines":
+                line_index = self.prev_corpus_step.get_line_index(input_filename)
+                n_lines, n = len(line_index), n_shards[input_filename]
+                bounds = sorted({int(line_index[i * n_lines // n]) for i in range(n)}) if n_lines else []
+                spans[input_filename] = list(zip(bounds, [*bounds[1:], entry["bytes"]]))
+            elif self.shard_mode == "bytes":
+                spans[input_filename] = file_byte_spans(input_path, n_shards[input_filename], size=entry["bytes"])
+            else:
+                spans[input_filename] = file_weighted_spans(
+                    input_path, n_shards[input_filename], weight=self.shard_mode, size=entry["bytes"]
+                )
+
+        plan: ShardPlanDict = {"version": self._shard_plan_version, "mode": self.shard_mode, "datasets": {}}
+        for f_name, input_filename in input_filenames.items():
+            plan["datasets"][f_name] = spans[input_filename]
+        self._save_json(plan, self.shard_plan_path)
+        logger.info("[%s] Saved the shard plan to %s.", self.step_label, self.shard_plan_path)
+
+    def infer_n_shards(
+        self,
+        line_counts: Dict[str, int],
+        runner: Optional["OpusPocusRunner"] = None,  # noqa: F821
+    ) -> Dict[str, int]:
+        """Return the number of shards of each shard input file given the file line counts.
+
+        With an integer shard_size, each shard contains approx. shard_size lines. With shard_size="auto",
+        each shard should take approx. shard_target_seconds to process given the throughput of the previous
+        runs of the same step type (see CorpusStep.shard_throughput), or contain _auto_shard_default_lines lines
+        if the throughput was not measured yet. Additionally, if the runner reports the number of tasks it can
+        run in parallel, the datasets are split into more shards to occupy all of the task slots
+        (proportionally to the dataset sizes) as long as each shard contains at least _auto_shard_min_lines lines.
+        """
+        if self.shard_size != "auto":
+            return {filename: max(-(-n_lines // self.shard_size), 1) for filename, n_lines in line_counts.items()}
+
+        throughput = self.shard_throughput
+        shard_lines = self._auto_shard_default_lines
+        if throughput is not None:
+            shard_lines = max(int(throughput * self.shard_target_seconds), 1)
+        n_parallel = runner.max_parallel_tasks(self) if runner is not None else None
+        total_lines = max(sum(line_counts.values()), 1)
+
+        n_shards = {}
+        for filename, n_lines in line_counts.items():
+            n_shards[filename] = max(-(-n_lines // shard_lines), 1)
+            if n_parallel is not None:
+                n_slots = max(n_parallel * n_lines // total_lines, 1)
+                n_max = max(n_lines // self._auto_shard_min_lines, 1)
+                n_shards[filename] = max(n_shards[filename], min(n_slots, n_max))
+            logger.info(
+                "[%s] Splitting %s (%i lines) into %i shard(s) (throughput: %s lines/s, parallel tasks: %s).",
+                self.step_label,
+                filename,
+                n_lines,
+                n_shards[filename],
+                throughput,
+                n_parallel,
+            )
+        return n_shards
+
+    @property
+    def shard_throughput_path(self) -> Path:
+        """Full path to the pipeline-wide shard_throughput.json."""
+        return Path(self.pipeline_dir, self._shard_throughput_file)
+
+    @property
+    def shard_throughput(self) -> Optional[float]:
+        """Lines per second processed by a single subtask of the same step type in the previous runs (if any)."""
+        throughput_dict = self._load_json(self.shard_throughput_path)
+        if throughput_dict is None or self.step not in throughput_dict:
+            return None
+        record = throughput_dict[self.step]
+        if record["lines"] <= 0 or record["seconds"] <= 0:
+            return None
+        return record["lines"] / record["seconds"]
+
+    def is_command_target_finished(self, target_file: Path) -> bool:
+        """The output shards are finished only if their subtask created the completion marker.
+
+        A shard file without the marker can be a leftover of an interrupted subtask. The shards of the datasets
+        kept from the previous run (see CorpusStep.reinit_incremental) are always finished.
+        """
+        if target_file.parent == self.shard_dir:
+            filename, _ = self.parse_dataset_shard_path(target_file)
+            if file_exists(Path(self.output_dir, filename)):
+                return True
+            return target_file.exists() and self.shard_done_path(target_file).exists()
+        return file_exists(target_file)
+
+    def run_subtask(self, target_file: Path) -> None:
+        """Run the subtask and mark the finished dataset shards.
+
+        The processing time of the shards is also recorded (see CorpusStep.save_shard_throughput).
+        """
+        start = time.perf_counter()
+        super().run_subtask(target_file)
+        if target_file is not None and target_file.parent == self.shard_dir:
+            with Path(self.shard_dir, self._subtask_times_file).open("a") as fh:
+                print(f"{target_file.name}\t{time.perf_counter() - start}", file=fh)
+            self.shard_done_path(target_file).touch()
+
+    def save_shard_throughput(self) -> None:
+        """Add the number of lines and the processing time of the finished shards to the shard_throughput.json.
+
+        The shard line counts are not known, therefore, the line count of each shard input file is scaled
+        by the ratio of the timed shards.
+        """
+        times_path = Path(self.shard_dir, self._subtask_times_file)
+        if not times_path.exists():
+            return
+        shard_times: Dict[str, List[float]] = {}
+        with times_path.open("r") as fh:
+            for line in fh:
+                shard_name, seconds = line.rstrip("\n").split("\t")
+                filename, _ = self.parse_dataset_shard_path(Path(self.shard_dir, shard_name))
+                shard_times.setdefault(filename, []).append(float(seconds))
+
+        n_lines, n_seconds = 0, 0.0
+        for filename, times in shard_times.items():
+            n_shards = len(self.infer_dataset_output_shard_path_list(filename))
+            n_input_lines = self.prev_corpus_step.dataset_line_count(self.shard_input_filename(filename))
+            n_lines += n_input_lines * len(times) // n_shards
+            n_seconds += sum(times)
+
+        throughput_dict = self._load_json(self.shard_throughput_path) or {}
+        record = throughput_dict.get(self.step, {"lines": 0, "seconds": 0.0})
+        throughput_dict[self.step] = {"lines": record["lines"] + n_lines, "seconds": record["seconds"] + n_seconds}
+        self._save_json(throughput_dict, self.shard_throughput_path)
+
+    def main_task_preprocess(self, runner: Optional["OpusPocusRunner"] = None) -> None:  # noqa: F821
+        """Plan the shards (see CorpusStep.uses_shard_plan) before the subtasks are submitted.
+
+        An existing plan is kept, so the shards of a resubmitted step stay the same.
+        """
+        super().main_task_preprocess(runner)
+        if self.is_sharded:
+            self.shard_dir.mkdir(exist_ok=True)
+        if self.uses_shard_plan and not self.shard_plan_path.exists():
+            self.build_shard_plan(runner)
 
     def main_task_postprocess(self) -> None:
-        """By default, merge all sharded output datasets into the single dataset files."""
+        """By default, merge all sharded output datasets into the single dataset files.
+
+        Afterwards, index the beginnings of lines of every output dataset file, validate the files and save
+        the manifest.json, so the following steps can shard them without re-reading the files.
+        """
         super().main_task_postprocess()
 
         # By default, all dataset files must be available after a successful
@@ -141,8 +1047,25 @@ class CorpusStep(OpusPocusStep):
         # be concatenated into the target file
         for f_name in self.dataset_filename_list:
             target_file = Path(self.output_dir, f_name)
-            if not target_file.exists():
-                concat_files(self.infer_dataset_output_shard_path_list(f_name), target_file)
+            if file_exists(target_file):
+                continue
+            shard_paths = self.infer_dataset_output_shard_path_list(f_name)
+            if self.virtual_datasets:
+                # Keep the shards (without copying) as the parts of a virtual dataset file
+                self.parts_dir.mkdir(exist_ok=True)
+                for shard_path in shard_paths:
+                    shard_path.replace(Path(self.parts_dir, shard_path.name))
+                    if bgzf_index_path(shard_path).exists():
+                        bgzf_index_path(shard_path).replace(bgzf_index_path(Path(self.parts_dir, shard_path.name)))
+                save_virtual_file(target_file, [Path(self.parts_dir, shard_path.name) for shard_path in shard_paths])
+            else:
+                concat_files(shard_paths, target_file, self.compression_level)
+        self.build_manifest(reuse_entries=True)
+        if self.is_sharded:
+            self.save_shard_throughput()
+        if self.shard_dir.exists():
+            clean_dir(self.shard_dir)
+            self.shard_dir.rmdir()
 
     def read_shard_from_dataset_file(self, filename: str, start: int, shard_size: int) -> List[str]:
         """Provides input by reading a part of an input (CorpusStep.prev_corpus_step) dataset corpus with regard
@@ -166,14 +1089,45 @@ class CorpusStep(OpusPocusStep):
             err_msg = f"File {file_path} does not exists"
             raise FileNotFoundError(err_msg)
 
-        return read_shard(file_path, self.line_index_dict[filename], start, shard_size)
+        return read_shard(file_path, self.get_line_index(filename), start, shard_size)
+
+    def shard_input_filename(self, filename: str) -> str:
+        """Return the prev_corpus_step dataset filename providing the shard inputs of a given output dataset file.
+
+        By default, it is the same dataset in the same language.
+        """
+        # The prev_corpus_step files can use a different compression (filename suffix)
+        return self.prev_corpus_step.dataset_filename(*self.parse_dataset_filename(filename))
+
+    def read_shard_input(self, filename: str, shard_idx: int) -> List[str]:
+        """Read the input lines of a given output dataset file shard from the prev_corpus_step dataset.
+
+        Args:
+            filename (str): output_dir dataset filename
+            shard_idx (int): index of the shard
+
+        Return:
+            List of the shard input lines.
+        """
+        input_filename = self.shard_input_filename(filename)
+        input_path = Path(self.input_dir, input_filename)
+        if not self.uses_shard_plan:
+            return read_shard(
+                input_path,
+                self.prev_corpus_step.get_line_index(input_filename),
+                shard_idx * self.shard_size,
+                self.shard_size,
+            )
+        start, end = self.shard_plan["datasets"][filename][shard_idx]
+        return read_byte_range(input_path, start, end)
 
     def infer_dataset_output_shard_path_list(self, filename: str) -> List[Path]:
         """Return a list of output shard file paths useful for parallel data processing.
 
         The output shard filenames are computed based on the size of the respective input CorpusStep.prev_corpus_step
-        dataset. The CorpusStep suporting sharding should implement OpusPocusStep.command() in a way that fetches
-        the relevant shard input using the CorpusStep.prev_corpus_step.line_index_dict method.
+        dataset (or on the shard plan, see CorpusStep.shard_mode). The CorpusStep suporting sharding should implement
+        OpusPocusStep.command() in a way that fetches the relevant shard input using the CorpusStep.read_shard_input
+        method.
 
         Args:
             filename: dataset's filename
@@ -187,16 +1141,19 @@ class CorpusStep(OpusPocusStep):
             f"in the {self.step_label}.output_dir is determined using "
             f"{self.step_label}.previvous_corpus_step.output_dir {filename} file"
         )
-        n_lines = len(self.prev_corpus_step.line_index_dict[filename])
-        n_shards = n_lines // self.shard_size
-        if n_lines % self.shard_size != 0:
-            n_shards += 1
-        return [Path(self.tmp_dir, f"{filename}.{i}.gz") for i in range(n_shards)]
+        if not self.uses_shard_plan:
+            n_lines = self.prev_corpus_step.dataset_line_count(self.shard_input_filename(filename))
+            n_shards = n_lines // self.shard_size
+            if n_lines % self.shard_size != 0:
+                n_shards += 1
+        else:
+            n_shards = len(self.shard_plan["datasets"][filename])
+        return [self.dataset_shard_path(filename, i) for i in range(n_shards)]
 
     def save_categories_dict(self, categories_dict: CategoriesDict) -> None:
         """Save the categories dict into categories.json."""
         # TODO(varisd): add syntax checking for the categories_dict parameter
-        json.dump(categories_dict, self.categories_path.open("w"), indent=2)
+        self._save_json(categories_dict, self.categories_path)
 
     def init_step(self) -> None:
         """Step initialization method.
@@ -223,6 +1180,7 @@ class CorpusStep(OpusPocusStep):
 
         self.init_dependencies()
         self.init_categories_file()
+        self._save_json(self.build_dataset_fingerprints(), self.dataset_fingerprints_path)
         self.save_parameters()
         self.save_dependencies()
         self.create_cmd_file()
@@ -230,6 +1188,90 @@ class CorpusStep(OpusPocusStep):
         # Initialize state
         logger.info("[%s] Step Initialized.", self.step_label)
         self.state = StepState.INITED
+        self.restore_from_cache()
+
+    def reinit_incremental(self) -> None:
+        """Re-initialize the step, keeping the output datasets whose fingerprints did not change.
+
+        The datasets are registered again and their fingerprints are compared with the ones saved during
+        the previous initialization. The output files and the manifest entries of the unchanged datasets are kept,
+        so only the new or changed datasets are processed when the step is executed. If no dataset changed
+        (and none was removed), the step stays finished.
+
+        Unfinished steps, steps initialized without the fingerprints and steps depending on a re-initialized
+        non-corpus step (e.g. a re-trained model) are re-initialized from scratch.
+        """
+        saved_fingerprints = self._load_json(self.dataset_fingerprints_path)
+        if (
+            not self.has_state(StepState.DONE)
+            or saved_fingerprints is None
+            or any(
+                dep is not None and not isinstance(dep, CorpusStep) and not dep.has_state(StepState.DONE)
+                for dep in self.dependencies.values()
+            )
+        ):
+            logger.info("[%s] Re-initializing...", self.step_label)
+            clean_dir(self.step_dir)
+            self.init_step()
+            return
+
+        manifest = self.manifest
+        self.state = StepState.INIT_INCOMPLETE
+        self.categories_path.unlink()
+        self.init_categories_file()
+        fingerprints = self.build_dataset_fingerprints()
+        saved = saved_fingerprints["datasets"]
+        kept = [
+            dset
+            for dset in self.dataset_list
+            if dset in manifest["datasets"] and fingerprints["datasets"][dset] == saved.get(dset)
+        ]
+        if len(kept) == len(self.dataset_list) == len(manifest["datasets"]):
+            self._save_json(fingerprints, self.dataset_fingerprints_path)
+            self.save_parameters()
+            logger.info("[%s] No dataset was added or changed. Skipping...", self.step_label)
+            self.state = StepState.DONE
+            return
+        logger.info(
+            "[%s] Keeping %i unchanged dataset(s), %i new or changed dataset(s) will be processed.",
+            self.step_label,
+            len(kept),
+            len(self.dataset_list) - len(kept),
+        )
+
+        # Remove everything except the outputs of the unchanged datasets
+        for path in self.step_dir.iterdir():
+            if path in (self.output_dir, self.state_path):
+                continue
+            if path.is_dir():
+                clean_dir(path)
+                path.rmdir()
+            else:
+                path.unlink()
+        keep_files = {self.categories_path, *(file for dset in kept for file in self.dataset_output_files(dset))}
+        for path in sorted(self.output_dir.rglob("*"), reverse=True):
+            if path.is_dir():
+                if not any(path.iterdir()):
+                    path.rmdir()
+            elif path not in keep_files:
+                path.unlink()
+        self._line_index_cache.clear()
+        for d in [self.log_dir, self.tmp_dir]:
+            d.mkdir()
+
+        # The manifest entries of the kept datasets are reused by CorpusStep.build_manifest
+        kept_manifest: ManifestDict = {
+            "version": self._manifest_version,
+            "datasets": {dset: manifest["datasets"][dset] for dset in kept},
+        }
+        self._save_json(kept_manifest, self.manifest_path)
+        self._save_json(fingerprints, self.dataset_fingerprints_path)
+        self.save_parameters()
+        self.save_dependencies()
+        self.create_cmd_file()
+
+        logger.info("[%s] Step Initialized.", self.step_label)
+        self.state = StepState.INITED
 
     def init_categories_file(self) -> None:
         """Initialize the categories.json file."""
@@ -1,15 +1,15 @@
 import logging
+import os
 import shutil
-from argparse import Namespace
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, List, Optional
 
 from attrs import define, field, validators
 
 from opuspocus.pipeline_steps import register_step
-from opuspocus.pipeline_steps.corpus_step import CorpusStep
-from opuspocus.tools.decontaminate import main as decontaminate_main
-from opuspocus.utils import cut_file, paste_files
+from opuspocus.pipeline_steps.corpus_step import CorpusStep, ParallelCorpus, ParallelCorpusWriter
+from opuspocus.runner_resources import RunnerResources
+from opuspocus.tools.decontaminate import DECONTAMINATION_MODES, ContaminationIndex, decontaminate
 
 logger = logging.getLogger(__name__)
 
@@ -17,11 +17,26 @@ logger = logging.getLogger(__name__)
 @register_step("decontaminate")
 @define(kw_only=True)
 class DecontaminateCorpusStep(CorpusStep):
-    """Class implementing training dataset decontamination (removing test data examples)>"""
+    """Class implementing training dataset decontamination (removing test data examples).
+
+    With `mode` set to "ngram", the training examples sharing at least `ngram_threshold` word n-grams
+    of the `ngram_order` with the valid/test examples are removed instead of the exact matches only.
+
+    The valid/test examples are hashed once per step execution into a compact index file (see
+    opuspocus.tools.decontaminate.ContaminationIndex) that is memory-mapped by the subtasks. Each dataset is filtered
+    in batches by the OPUSPOCUS_cpus worker processes sharing the index, the order of the examples is kept.
+
+    For each dataset, a JSON report with the numbers of the kept/removed examples and the matches of the individual
+    valid/test datasets (labeled "<step_label>/<dataset>") is saved in the output_dir (see
+    DecontaminateCorpusStep.decontamination_report).
+    """
 
     valid_data_step: CorpusStep = field(validator=validators.optional(validators.instance_of(CorpusStep)))
     test_data_step: CorpusStep = field(validator=validators.optional(validators.instance_of(CorpusStep)))
     min_length: int = field(default=25)
+    mode: str = field(default="exact", validator=validators.in_(DECONTAMINATION_MODES))
+    ngram_order: int = field(default=8, validator=validators.gt(0))
+    ngram_threshold: int = field(default=1, validator=validators.gt(0))
 
     def __attrs_post_init__(self) -> None:
         """Check that at least one of the valid/test steps is defined."""
@@ -31,32 +46,39 @@ class DecontaminateCorpusStep(CorpusStep):
                 self.step_label,
             )
 
-    def get_valid_test_corpora(self) -> List[Path]:
-        """Collect paths to all available valid/test corpora."""
-        valid_corpora = []
-        test_corpora = []
-        if self.valid_data_step is not None:
-            valid_corpora = []
-            for dset in self.valid_data_step.dataset_list:
-                infile = Path(
-                    self.tmp_dir,
-                    "valid.{}.{}.gz".format(dset, "-".join(self.languages)),
-                )
-                paste_files(
-                    [Path(self.valid_data_step.output_dir, f"{dset}.{lang}.gz") for lang in self.languages],
-                    infile,
-                )
-                valid_corpora.append(infile)
-        if self.test_data_step is not None:
-            test_corpora = []
-            for dset in self.test_data_step.dataset_list:
-                infile = Path(self.tmp_dir, "test.{}.{}.gz".format(dset, "-".join(self.languages)))
-                paste_files(
-                    [Path(self.test_data_step.output_dir, f"{dset}.{lang}.gz") for lang in self.languages],
-                    infile,
+    def get_valid_test_corpora(self) -> Dict[str, ParallelCorpus]:
+        """Collect all available valid/test corpora (labeled by the step label and the dataset name)."""
+        corpora = {}
+        for step in [self.valid_data_step, self.test_data_step]:
+            if step is None:
+                continue
+            for dset in step.dataset_list:
+                corpora[f"{step.step_label}/{dset}"] = ParallelCorpus(
+                    files=[step.dataset_path(dset, lang) for lang in self.languages]
                 )
-                test_corpora.append(infile)
-        return valid_corpora + test_corpora
+        return corpora
+
+    @property
+    def test_index_path(self) -> Path:
+        """Location of the valid/test example index."""
+        return Path(self.tmp_dir, "test_index.bin")
+
+    @property
+    def report_dir(self) -> Path:
+        """Location of the per-dataset decontamination reports."""
+        return Path(self.output_dir, "decontamination")
+
+    def report_path(self, dataset: str) -> Path:
+        """Location of the decontamination report of a given dataset."""
+        return Path(self.report_dir, f"{dataset}.json")
+
+    def decontamination_report(self, dataset: str) -> Dict[str, Any]:
+        """Load the decontamination report of a given dataset (see tools.decontaminate.ContaminationStats.report)."""
+        return self._load_json(self.report_path(dataset))
+
+    def dataset_output_files(self, dataset: str) -> List[Path]:
+        """Additionally, the decontamination report belongs to the dataset."""
+        return [*super().dataset_output_files(dataset), self.report_path(dataset)]
 
     def register_categories(self) -> None:
         """Copy the categories from the previous step."""
@@ -64,38 +86,39 @@ class DecontaminateCorpusStep(CorpusStep):
 
     def get_command_targets(self) -> List[Path]:
         """One target file per each decontaminated dataset."""
-        return [Path(self.output_dir, f"{dset}.{self.src_lang}.gz") for dset in self.dataset_list]
+        return [self.dataset_path(dset, self.src_lang) for dset in self.dataset_list]
+
+    def main_task_preprocess(self, runner: Optional["OpusPocusRunner"] = None) -> None:  # noqa: F821
+        """Index the valid/test examples before the subtasks are submitted."""
+        super().main_task_preprocess(runner)
+        index = ContaminationIndex.build(
+            self.get_valid_test_corpora(),
+            mono=self.tgt_lang is None,
+            mode=self.mode,
+            ngram_order=self.ngram_order,
+        )
+        index.save(self.test_index_path)
 
     def command(self, target_file: Path) -> None:
-        """Invoke tools/decontaminate.py to remove training examples similar to ones in the valid/test files.
+        """Remove training examples similar to ones in the valid/test corpora (see tools/decontaminate.py).
 
-        We infer the input files (source-side, target-side) using the target_file.
+        We infer the input files (source-side, target-side) using the target_file. The training corpus is streamed
+        as aligned examples and compared with the test index built by the main task.
         """
-        dset_name = ".".join(target_file.stem.split(".")[:-1])
-        languages_str = "-".join(self.languages)
-
-        # Combine the corpora before decontaminating
-        infile = Path(self.tmp_dir, f"{dset_name}.input.{languages_str}.gz")
-        outfile = Path(self.tmp_dir, f"{dset_name}.output.{languages_str}.gz")
-
-        paste_files(
-            [Path(self.input_dir, f"{dset_name}.{lang}.gz") for lang in self.languages],
-            infile,
-        )
-
-        # Run decontamination
-        args = Namespace(
-            **{
-                "mono": False,
-                "input_file": str(infile),
-                "output_file": str(outfile),
-                "min_length": self.min_length,
-                "test_files": ",".join([str(f) for f in self.get_valid_test_corpora()]),
-            }
-        )
-        decontaminate_main(args)
-
-        cut_file(
-            outfile,
-            [Path(self.output_dir, f"{dset_name}.{lang}.gz") for lang in self.languages],
-        )
+        dset_name, _ = self.parse_dataset_filename(target_file.name)
+
+        self.report_dir.mkdir(exist_ok=True)
+        with ParallelCorpusWriter(
+            [self.dataset_path(dset_name, lang) for lang in self.languages], self.compression_level
+        ) as writer:
+            writer.writelines(
+                decontaminate(
+                    ParallelCorpus.from_step(self.prev_corpus_step, dset_name),
+                    ContaminationIndex.load(self.test_index_path),
+                    self.min_length,
+                    mono=self.tgt_lang is None,
+                    ngram_threshold=self.ngram_threshold,
+                    n_workers=int(os.environ.get(RunnerResources.get_env_name("cpus"), "1")),
+                    report_file=self.report_path(dset_name),
+                )
+            )
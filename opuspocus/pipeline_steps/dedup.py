@@ -0,0 +1,219 @@
+import contextlib
+import logging
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from attrs import define, field, validators
+
+from opuspocus.pipeline_steps import register_step
+from opuspocus.pipeline_steps.corpus_step import CorpusStep
+from opuspocus.runner_resources import RunnerResources
+from opuspocus.tools.deduplicate import (
+    HASH_CHUNK_LINES,
+    deduplicate,
+    find_bucket_duplicates,
+    load_drop_mask,
+    partition_dataset_chunk,
+    read_examples,
+)
+from opuspocus.utils import open_file
+from opuspocus.virtual_files import file_exists
+
+logger = logging.getLogger(__name__)
+
+DEDUP_KEYS = ("src", "tgt", "pair")
+
+
+@register_step("dedup")
+@define(kw_only=True)
+class DedupCorpusStep(CorpusStep):
+    """Class implementing the exact deduplication of the datasets.
+
+    The examples are compared by the 64-bit hashes of their source side, target side or the whole example
+    (`dedup_key`). The first occurrence of each example is kept. With `across_datasets`, the examples occurring
+    in any of the preceding datasets (in the order of the dataset list) are removed as well.
+
+    To keep the memory usage bounded, the hashes are partitioned into 2**prefix_bits bucket files (see
+    DedupCorpusStep.bucket_dir) by their prefix and each bucket is deduplicated separately (see
+    opuspocus.tools.deduplicate). Both the hashing
+    (in the dataset chunks of HASH_CHUNK_LINES examples located using the prev_corpus_step line indices) and
+    the bucket deduplication are parallelized across the OPUSPOCUS_cpus processes.
+    The numbers of the kept and dropped examples are saved in the manifest.json (see DedupCorpusStep.dedup_stats).
+    """
+
+    dedup_key: str = field(default="pair", validator=validators.in_(DEDUP_KEYS))
+    across_datasets: bool = field(default=False, validator=validators.instance_of(bool))
+    prefix_bits: int = field(default=8, validator=[validators.ge(1), validators.le(16)])
+
+    _buckets_done_file = ".done"
+
+    def __attrs_post_init__(self) -> None:
+        """Check that the dedup_key side exists."""
+        if self.dedup_key == "tgt" and self.tgt_lang is None:
+            err_msg = f"{self.step_label}: dedup_key='tgt' requires a parallel corpus (tgt_lang is not set)."
+            raise ValueError(err_msg)
+
+    @property
+    def bucket_dir(self) -> Path:
+        """Location of the hash bucket files and the duplicate line numbers.
+
+        Unlike the tmp_dir, the complete buckets are kept when a failed step is resubmitted without the removal
+        of the finished command targets (similarly to the CorpusStep.shard_dir), so the datasets are not hashed
+        again. The directory gets deleted after a successful step completion.
+        """
+        return Path(self.step_dir, "dedup_buckets")
+
+    @property
+    def key_indices(self) -> List[int]:
+        """Indices of the example segments (in the order of the step languages) used for the comparison."""
+        if self.dedup_key == "src":
+            return [0]
+        if self.dedup_key == "tgt":
+            return [1]
+        return list(range(len(self.languages)))
+
+    @property
+    def n_workers(self) -> int:
+        """Number of the parallel processes (CPUs allocated to the running task)."""
+        return int(os.environ.get(RunnerResources.get_env_name("cpus"), "1"))
+
+    def register_categories(self) -> None:
+        """Copy the categories from the previous step."""
+        shutil.copy(self.prev_corpus_step.categories_path, self.categories_path)
+
+    def get_command_targets(self) -> List[Path]:
+        """One target file per each deduplicated dataset."""
+        return [self.dataset_path(dset, self.src_lang) for dset in self.dataset_list]
+
+    def dataset_input_fingerprints(self, dataset: str) -> List[str]:
+        """With across_datasets, the contents of the dataset also depend on all of the preceding datasets."""
+        if not self.across_datasets:
+            return super().dataset_input_fingerprints(dataset)
+        datasets = self.dataset_list[: self.dataset_list.index(dataset) + 1]
+        return [self.prev_corpus_step.dataset_fingerprints[dset] for dset in datasets]
+
+    def input_files(self, dataset: str) -> List[Path]:
+        """The prev_corpus_step files of a given dataset (in the order of the step languages)."""
+        return [self.prev_corpus_step.dataset_path(dataset, lang) for lang in self.languages]
+
+    def main_task_preprocess(self, runner: Optional["OpusPocusRunner"] = None) -> None:  # noqa: F821
+        """Find the duplicate examples before the subtasks (writing the deduplicated datasets) are submitted.
+
+        First, the examples of every dataset are hashed into the bucket files. Afterwards, each bucket is searched
+        for duplicates. Without across_datasets, the datasets kept from the previous run (see
+        CorpusStep.reinit_incremental) are skipped. The buckets of a resubmitted step are reused if they are complete
+        (see DedupCorpusStep.bucket_dir).
+        """
+        super().main_task_preprocess(runner)
+        done_path = Path(self.bucket_dir, self._buckets_done_file)
+        if done_path.exists():
+            return
+        if self.bucket_dir.exists():
+            shutil.rmtree(self.bucket_dir)
+        self.bucket_dir.mkdir(parents=True)
+
+        datasets = [
+            (idx, dset)
+            for idx, dset in enumerate(self.dataset_list)
+            if self.across_datasets or not file_exists(self.dataset_path(dset, self.src_lang))
+        ]
+        with ProcessPoolExecutor(max_workers=self.n_workers) as executor:
+            self.find_duplicates(executor, datasets)
+        done_path.touch()
+
+    def main_task_postprocess(self) -> None:
+        """Remove the hash buckets once the deduplicated datasets are written."""
+        super().main_task_postprocess()
+        if self.bucket_dir.exists():
+            shutil.rmtree(self.bucket_dir)
+
+    def clean_directories(self, *, remove_finished_command_targets: bool = True) -> None:
+        """The hash buckets are removed together with the finished command targets."""
+        super().clean_directories(remove_finished_command_targets=remove_finished_command_targets)
+        if remove_finished_command_targets and self.bucket_dir.exists():
+            shutil.rmtree(self.bucket_dir)
+
+    def find_duplicates(self, executor: ProcessPoolExecutor, datasets: List[Tuple[int, str]]) -> None:
+        """Hash the examples of the (index, name) datasets into the bucket files and save the duplicate line numbers.
+
+        The drop files are used by the subtasks to write the deduplicated datasets (see DedupCorpusStep.command).
+        The dataset chunks are located using the prev_corpus_step line indices.
+        """
+        futures = []
+        for idx, dset in datasets:
+            input_files = self.input_files(dset)
+            line_indices = [self.prev_corpus_step.get_line_index(file.name) for file in input_files]
+            n_lines = len(line_indices[0])
+            for chunk_idx, start in enumerate(range(0, n_lines, HASH_CHUNK_LINES)):
+                futures.append(
+                    executor.submit(
+                        partition_dataset_chunk,
+                        input_files,
+                        [int(line_index[start]) for line_index in line_indices],
+                        start,
+                        min(HASH_CHUNK_LINES, n_lines - start),
+                        self.key_indices,
+                        self.bucket_dir,
+                        idx,
+                        chunk_idx,
+                        self.prefix_bits,
+                    )
+                )
+        logger.info("[%s] Hashing %i dataset chunk(s) into the hash buckets...", self.step_label, len(futures))
+        for future in futures:
+            future.result()
+
+        logger.info("[%s] Searching %i hash bucket(s) for duplicates...", self.step_label, 2**self.prefix_bits)
+        futures = [
+            executor.submit(
+                find_bucket_duplicates,
+                self.bucket_dir,
+                bucket,
+                len(self.dataset_list),
+                across_datasets=self.across_datasets,
+            )
+            for bucket in range(2**self.prefix_bits)
+        ]
+        for future in futures:
+            future.result()
+
+    def command(self, target_file: Path) -> None:
+        """Write the dataset examples that are not marked as duplicates.
+
+        We infer the input files (source-side, target-side) using the target_file. The examples are copied
+        as raw bytes (without decoding).
+        """
+        dset_name, _ = self.parse_dataset_filename(target_file.name)
+        dataset_idx = self.dataset_list.index(dset_name)
+        input_files = self.input_files(dset_name)
+        n_lines = self.prev_corpus_step.dataset_line_count(input_files[0].name)
+        drop_mask = load_drop_mask(self.bucket_dir, dataset_idx, n_lines)
+
+        output_files = [self.dataset_path(dset_name, lang) for lang in self.languages]
+        with contextlib.ExitStack() as stack:
+            fhs = [stack.enter_context(open_file(file, "wb", self.compression_level)) for file in output_files]
+            for example in deduplicate(read_examples(input_files), drop_mask):
+                for segment, fh in zip(example, fhs):
+                    fh.write(segment)
+                    fh.write(b"\n")
+
+    def build_manifest(self, *, reuse_entries: bool = False) -> None:
+        """Additionally, save the number of the kept and dropped examples of each dataset."""
+        super().build_manifest(reuse_entries=reuse_entries)
+        manifest = self._load_json(self.manifest_path)
+        manifest["dedup"] = {}
+        for dset in self.dataset_list:
+            input_filename = self.prev_corpus_step.dataset_filename(dset, self.src_lang)
+            n_input = self.prev_corpus_step.dataset_line_count(input_filename)
+            n_kept = manifest["datasets"][dset][self.src_lang]["lines"]
+            manifest["dedup"][dset] = {"kept": n_kept, "dropped": n_input - n_kept}
+            logger.info("[%s] %s: kept %i, dropped %i example(s).", self.step_label, dset, n_kept, n_input - n_kept)
+        self._save_json(manifest, self.manifest_path)
+
+    @property
+    def dedup_stats(self) -> Dict[str, Dict[str, int]]:
+        """Numbers of the kept and dropped examples of each dataset (saved in the manifest.json)."""
+        return self.manifest["dedup"]
@@ -92,24 +92,12 @@ class EvaluateStep(OpusPocusStep):
 
         sys = [
             line.rstrip("\n")
-            for line in open_file(
-                Path(
-                    self.translated_step.output_dir,
-                    f"{dset}.{self.tgt_lang}.gz",
-                ),
-                "r",
-            ).readlines()
+            for line in open_file(self.translated_step.dataset_path(dset, self.tgt_lang), "r").readlines()
         ]
         # TODO: multi-reference support
         ref = [
             line.rstrip("\n")
-            for line in open_file(
-                Path(
-                    self.reference_step.output_dir,
-                    f"{dset}.{self.tgt_lang}.gz",
-                ),
-                "r",
-            ).readlines()
+            for line in open_file(self.reference_step.dataset_path(dset, self.tgt_lang), "r").readlines()
         ]
         with open_file(target_file, "w") as fh:
             print(metric.corpus_score(sys, [ref]), file=fh)
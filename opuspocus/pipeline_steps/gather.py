@@ -6,6 +6,7 @@ from attrs import define
 from opuspocus.pipeline_steps import register_step
 from opuspocus.pipeline_steps.corpus_step import CorpusStep
 from opuspocus.utils import concat_files
+from opuspocus.virtual_files import save_virtual_file
 
 
 @register_step("gather")
@@ -44,24 +45,36 @@ class GatherCorpusStep(CorpusStep):
         if self.tgt_lang is not None:
             langpair = f".{self.src_lang}-{self.tgt_lang}"
         return [
-            Path(self.output_dir, f"{category}{langpair}.{lang}.gz")
-            for category in self.categories
-            for lang in self.languages
+            self.dataset_path(f"{category}{langpair}", lang) for category in self.categories for lang in self.languages
+        ]
+
+    def dataset_category(self, dataset: str) -> str:
+        """Return the category gathered into a given dataset."""
+        if self.tgt_lang is not None:
+            return ".".join(dataset.split(".")[:-1])
+        return dataset
+
+    def dataset_input_fingerprints(self, dataset: str) -> List[str]:
+        """Fingerprints of all prev_corpus_step datasets of the gathered category."""
+        return [
+            self.prev_corpus_step.dataset_fingerprints[dset]
+            for dset in self.prev_corpus_step.category_mapping[self.dataset_category(dataset)]
         ]
 
     def command(self, target_file: Path) -> None:
         """Concatenate files that belong to the specified category.
 
         We infer the input file list based on the target_file name and the list of datasets that correspond to the
-        category_mapping used to create the target_file filename.
+        category_mapping used to create the target_file filename. With virtual_datasets, the target_file is
+        a virtual file referencing the input files instead.
         """
-        target_stem_split = target_file.stem.split(".")
-        category = ".".join(target_stem_split[:-1])
-        if self.tgt_lang is not None:
-            category = ".".join(target_stem_split[:-2])
-        lang = target_stem_split[-1]
+        dataset, lang = self.parse_dataset_filename(target_file.name)
+        category = self.dataset_category(dataset)
 
-        concat_files(
-            [Path(self.input_dir, f"{dset}.{lang}.gz") for dset in self.prev_corpus_step.category_mapping[category]],
-            target_file,
-        )
+        input_files = [
+            self.prev_corpus_step.dataset_path(dset, lang) for dset in self.prev_corpus_step.category_mapping[category]
+        ]
+        if self.virtual_datasets:
+            save_virtual_file(target_file, input_files)
+            return
+        concat_files(input_files, target_file, self.compression_level)
@@ -13,11 +13,7 @@ from opuspocus.pipeline_steps import register_step
 from opuspocus.pipeline_steps.corpus_step import CorpusStep
 from opuspocus.pipeline_steps.opuspocus_step import OpusPocusStep
 from opuspocus.runner_resources import RunnerResources
-from opuspocus.utils import (
-    concat_files,
-    decompress_file,
-    subprocess_wait,
-)
+from opuspocus.utils import concat_files, subprocess_wait
 
 logger = logging.getLogger(__name__)
 
@@ -93,13 +89,12 @@ class GenerateVocabStep(OpusPocusStep):
         model_prefix = f"{self.output_dir}/{target_file.stem}"
         n_cpus = int(os.environ[RunnerResources.get_env_name("cpus")])
 
-        train_concat_gz = Path(self.tmp_dir, "train_concat.gz")
-        train_concat = Path(self.tmp_dir, train_concat_gz.stem)
+        # spm_train requires a decompressed input
+        train_concat = Path(self.tmp_dir, "train_concat")
         concat_files(
-            [Path(self.input_dir, f"{dset}.{lang}.gz") for dset in self.datasets for lang in self.languages],
-            train_concat_gz,
+            [self.corpus_step.dataset_path(dset, lang) for dset in self.datasets for lang in self.languages],
+            train_concat,
         )
-        decompress_file(train_concat_gz, train_concat)
 
         # Train subword model
         # TODO: make this Unix non-exclusive
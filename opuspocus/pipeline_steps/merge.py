@@ -1,10 +1,11 @@
 from pathlib import Path
-from typing import List
+from typing import List, Tuple
 
 from attrs import Attribute, define, field, validators
 
 from opuspocus.pipeline_steps import register_step
 from opuspocus.pipeline_steps.corpus_step import CorpusStep
+from opuspocus.utils import link_file
 
 
 @register_step("merge")
@@ -25,6 +26,8 @@ class MergeCorpusStep(CorpusStep):
     other_corpus_label: str = field(validator=validators.instance_of(str))
     merge_categories: bool = field(default=False)
 
+    _fingerprint_input_steps = ("prev_corpus_step", "other_corpus_step")
+
     @other_corpus_step.validator
     def _inherited_from_corpus_step(self, attribute: Attribute, value: CorpusStep) -> None:
         # TODO(varisd): remove duplicate code (similar to corpus_step.py validator)
@@ -75,20 +78,30 @@ class MergeCorpusStep(CorpusStep):
         """One target_file per corpus linked from prev_corpus_step or other_corpus_step
         (with its after-merge naming).
         """
-        return [Path(self.output_dir, f"{dset}.{lang}.gz") for dset in self.dataset_list for lang in self.languages]
+        return [self.dataset_path(dset, lang) for dset in self.dataset_list for lang in self.languages]
+
+    def source_dataset(self, dataset: str) -> Tuple[CorpusStep, str]:
+        """Return the source step and the original name of a merged dataset."""
+        source_label = dataset.split(".")[0]
+        source_dataset = ".".join(dataset.split(".")[1:])
+        if source_label == self.prev_corpus_label:
+            return self.prev_corpus_step, source_dataset
+        if source_label == self.other_corpus_label:
+            return self.other_corpus_step, source_dataset
+        err_msg = f"Unknown corpus label ({source_label})."
+        raise ValueError(err_msg)
+
+    def dataset_input_fingerprints(self, dataset: str) -> List[str]:
+        """Fingerprint of the original dataset in its source step."""
+        source_step, source_dataset = self.source_dataset(dataset)
+        return [source_step.dataset_fingerprints[source_dataset]]
 
     def command(self, target_file: Path) -> None:
         """Create a target_file by hardlinking it to its original corpus file.
 
-        We infer the original corpus filename from the target_file.
+        We infer the original corpus filename from the target_file. The corpus file is re-compressed instead of
+        hardlinked if the source step uses a different compression.
         """
-        target_filename = target_file.stem + target_file.suffix
-        source_filename = ".".join(target_filename.split(".")[1:])
-        source_label = target_filename.split(".")[0]
-        if source_label == self.prev_corpus_label:
-            target_file.hardlink_to(Path(self.prev_corpus_step.output_dir, source_filename))
-        elif source_label == self.other_corpus_label:
-            target_file.hardlink_to(Path(self.other_corpus_step.output_dir, source_filename))
-        else:
-            err_msg = f"Unknown corpus label ({source_label})."
-            raise ValueError(err_msg)
+        dataset, lang = self.parse_dataset_filename(target_file.name)
+        source_step, source_dataset = self.source_dataset(dataset)
+        link_file(source_step.dataset_path(source_dataset, lang), target_file, self.compression_level)
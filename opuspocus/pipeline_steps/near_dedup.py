@@ -0,0 +1,107 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+from attrs import Attribute, define, field, validators
+
+from opuspocus.pipeline_steps import register_step
+from opuspocus.pipeline_steps.dedup import DedupCorpusStep
+from opuspocus.tools.deduplicate import (
+    HASH_CHUNK_LINES,
+    SHINGLE_TYPES,
+    MinHashLSH,
+    drop_near_duplicate_clusters,
+    find_bucket_near_duplicates,
+    partition_band_keys,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@register_step("near_dedup")
+@define(kw_only=True)
+class NearDedupCorpusStep(DedupCorpusStep):
+    """Class implementing the near-duplicate removal using MinHash LSH.
+
+    The examples (their `dedup_key` side) are represented by the MinHash signatures of their character or word
+    shingles (`shingle`, `shingle_size`), the digits are replaced by zeros first with `normalize_digits`.
+    The signatures of `num_perm` values are split into `bands` bands and the examples sharing all values of any band
+    are connected (see opuspocus.tools.deduplicate.MinHashLSH). The first example (in the order of the datasets
+    and lines) of each cluster of connected examples is kept, the rest is dropped. The default 16 bands of 8 rows
+    mostly connect the examples with Jaccard similarity of their shingle sets above approx. 0.7.
+
+    Similarly to the DedupCorpusStep, the band keys are partitioned into the bucket files and the buckets are
+    processed separately, both in parallel across the OPUSPOCUS_cpus processes. The complete band key buckets
+    (and the near-duplicate edges) are reused by a resubmitted failed step (see DedupCorpusStep.bucket_dir).
+    The datasets are processed in chunks of HASH_CHUNK_LINES examples, each chunk's signatures are computed
+    in vectorized batches.
+    """
+
+    shingle: str = field(default="char", validator=validators.in_(SHINGLE_TYPES))
+    shingle_size: int = field(default=5, validator=validators.gt(0))
+    num_perm: int = field(default=128, validator=validators.gt(0))
+    bands: int = field(default=16, validator=validators.gt(0))
+    seed: int = field(default=42, validator=validators.instance_of(int))
+    normalize_digits: bool = field(default=True, validator=validators.instance_of(bool))
+
+    @bands.validator
+    def _bands_divide_num_perm(self, attribute: Attribute, value: int) -> None:
+        if self.num_perm % value != 0:
+            err_msg = f"{attribute.name} ({value}) must divide num_perm ({self.num_perm})."
+            raise ValueError(err_msg)
+
+    @property
+    def minhash(self) -> MinHashLSH:
+        """The MinHash signature and LSH band key computation."""
+        return MinHashLSH(
+            shingle=self.shingle,
+            shingle_size=self.shingle_size,
+            num_perm=self.num_perm,
+            bands=self.bands,
+            seed=self.seed,
+            normalize_digits=self.normalize_digits,
+        )
+
+    def find_duplicates(self, executor: ProcessPoolExecutor, datasets: List[Tuple[int, str]]) -> None:
+        """Compute the LSH band keys of the (index, name) datasets and save the line numbers of the near-duplicates.
+
+        The dataset chunks are located using the prev_corpus_step line indices.
+        """
+        minhash = self.minhash
+        futures = []
+        for idx, dset in datasets:
+            input_files = self.input_files(dset)
+            line_indices = [self.prev_corpus_step.get_line_index(file.name) for file in input_files]
+            n_lines = len(line_indices[0])
+            for chunk_idx, start in enumerate(range(0, n_lines, HASH_CHUNK_LINES)):
+                futures.append(
+                    executor.submit(
+                        partition_band_keys,
+                        minhash,
+                        input_files,
+                        [int(line_index[start]) for line_index in line_indices],
+                        start,
+                        min(HASH_CHUNK_LINES, n_lines - start),
+                        self.key_indices,
+                        self.bucket_dir,
+                        idx,
+                        chunk_idx,
+                        self.prefix_bits,
+                    )
+                )
+        logger.info("[%s] Computing the signatures of %i dataset chunk(s)...", self.step_label, len(futures))
+        for future in futures:
+            future.result()
+
+        logger.info("[%s] Searching %i LSH bucket(s) for near-duplicates...", self.step_label, 2**self.prefix_bits)
+        futures = [
+            executor.submit(find_bucket_near_duplicates, self.bucket_dir, bucket, across_datasets=self.across_datasets)
+            for bucket in range(2**self.prefix_bits)
+        ]
+        for future in futures:
+            future.result()
+        n_lines = [
+            self.prev_corpus_step.dataset_line_count(self.prev_corpus_step.dataset_filename(dset, self.src_lang))
+            for dset in self.dataset_list
+        ]
+        drop_near_duplicate_clusters(self.bucket_dir, n_lines)
@@ -1,6 +1,7 @@
 import enum
 import json
 import logging
+import os
 import signal
 import sys
 import time
@@ -8,11 +9,11 @@ from pathlib import Path
 from typing import Any, Dict, List, Optional
 
 import yaml
-from attrs import asdict, define, field, fields, validators
+from attrs import asdict, converters, define, field, fields, validators
 from omegaconf import ListConfig
 
 from opuspocus.runner_resources import RunnerResources
-from opuspocus.utils import clean_dir, print_indented
+from opuspocus.utils import clean_dir, directory_sha256, json_digest, link_tree, print_indented
 
 logger = logging.getLogger(__name__)
 
@@ -32,7 +33,12 @@ class StepState(str, enum.Enum):
 
 @define(kw_only=True)
 class OpusPocusStep:
-    """Base class for OpusPocus pipeline steps."""
+    """Base class for OpusPocus pipeline steps.
+
+    With `cache_dir` (usually set globally in the pipeline config), the outputs of the finished steps are hardlinked
+    into a cache shared by multiple pipelines. Steps with the same cache_key are restored from the cache instead
+    of being executed (see OpusPocusStep.restore_from_cache).
+    """
 
     step: str = field(converter=str)
     step_label: str = field(converter=str)
@@ -42,11 +48,17 @@ class OpusPocusStep:
     runner_resources: RunnerResources = field(
         validator=validators.optional(validators.instance_of(RunnerResources)), default=None
     )
+    cache_dir: Optional[Path] = field(converter=converters.optional(Path), default=None, eq=False)
 
     _cmd_filename = "command.py"
     _dependency_filename = "step.dependencies"
     _state_filename = "step.state"
     _parameter_filename = "step.parameters"
+    _output_digest_filename = "output.sha256"
+    _cache_info_filename = "cache_info.json"
+
+    # Parameters that do not affect the step outputs (excluded from the cache_key)
+    cache_exclude = ("step_label", "pipeline_dir", "runner_resources", "cache_dir")
 
     @classmethod
     def build_step(cls: "OpusPocusStep", step: str, step_label: str, pipeline_dir: Path, **kwargs) -> "OpusPocusStep":  # noqa: ANN003
@@ -221,6 +233,7 @@ class OpusPocusStep:
         3. save the step parameters and dependency information
         4. create the step command
         5. set set.state to INITED
+        6. restore the step outputs from the cache_dir, if available (see OpusPocusStep.restore_from_cache)
         """
         if self.state is StepState.DONE:
             logger.info("[%s] Step is in %s state. Skipping...", self.step_label, self.state)
@@ -255,6 +268,34 @@ class OpusPocusStep:
         # initialize state
         logger.info("[%s] Step Initialized.", self.step_label)
         self.state = StepState.INITED
+        self.restore_from_cache()
+
+    def reinit_incremental(self) -> None:
+        """Re-initialize the step unless its results are still up to date.
+
+        A finished step is kept if it is up to date (see OpusPocusStep.is_up_to_date). Otherwise, the step is
+        re-initialized from scratch. The step dependencies are expected to be re-initialized first.
+        """
+        if self.has_state(StepState.DONE) and self.is_up_to_date:
+            logger.info("[%s] Step is up to date. Skipping...", self.step_label)
+            return
+        logger.info("[%s] Re-initializing...", self.step_label)
+        clean_dir(self.step_dir)
+        self.init_step()
+
+    @property
+    def is_up_to_date(self) -> bool:
+        """Whether the step parameters and dependencies did not change since the initialization and all
+        dependencies are finished.
+        """
+        for dep in self.dependencies.values():
+            if dep is not None and not dep.has_state(StepState.DONE):
+                return False
+        params = yaml.safe_load(yaml.dump(self.get_parameters_dict()))
+        deps = {k: v.step_label for k, v in self.dependencies.items() if v is not None}
+        return params == self.load_parameters(self.step_label, self.pipeline_dir) and deps == self.load_dependencies(
+            self.step_label, self.pipeline_dir
+        )
 
     def init_dependencies(self) -> None:
         """Recursively call the init_step method of the step dependencies.
@@ -354,7 +395,9 @@ class OpusPocusStep:
         that can be received during execution.
         """
         logging.basicConfig(level=logging.INFO)
-        self.main_task_preprocess()
+        if self.restore_from_cache():
+            return
+        self.main_task_preprocess(runner)
 
         # we keep track of the submitted subtasks
         task_info_list = []
@@ -420,7 +463,7 @@ class OpusPocusStep:
                 continue
 
             # skip finished target files
-            if target_file.exists():
+            if self.is_command_target_finished(target_file):
                 logger.info("[%s] File %s already finished. Skipping submission...", self.step_label, str(target_file))
                 continue
 
@@ -446,6 +489,116 @@ class OpusPocusStep:
 
         clean_dir(self.tmp_dir)  # cleanup
         self.state = StepState.DONE
+        self.save_to_cache()
+
+    def is_command_target_finished(self, target_file: Path) -> bool:
+        """Whether the target_file was created by a successfully finished subtask.
+
+        Finished targets are skipped when the step is (re)submitted.
+        """
+        return target_file.exists()
+
+    @property
+    def output_digest(self) -> str:
+        """Checksum of the output_dir contents of a finished step.
+
+        The checksum is computed only once and saved in the step directory.
+        """
+        assert self.has_state(StepState.DONE), f"{self.step_label} output digest requires a finished step."
+        digest_path = Path(self.step_dir, self._output_digest_filename)
+        if not digest_path.exists():
+            digest_path.write_text(directory_sha256(self.output_dir))
+        return digest_path.read_text().strip()
+
+    def cache_inputs(self) -> Dict[str, Any]:
+        """Checksums of the step inputs that are not provided by the step dependencies (e.g. external data files).
+
+        Used by the cache_key, the default implementation has no such inputs.
+        """
+        return {}
+
+    @property
+    def cache_key(self) -> Optional[str]:
+        """Key of the step outputs in the cache_dir, None if any step dependency is not finished yet.
+
+        The key is derived from the step class, its parameters (except the ones not affecting the step outputs)
+        and the content checksums of the outputs of its dependencies (see OpusPocusStep.output_digest), so it
+        is the same for identical steps of different pipelines.
+        """
+        deps = {}
+        for name, dep in self.dependencies.items():
+            if dep is None:
+                continue
+            if not dep.has_state(StepState.DONE):
+                return None
+            deps[name] = dep.output_digest
+        params = {k: v for k, v in self.get_parameters_dict().items() if k not in self.cache_exclude}
+        return json_digest(
+            {"step": self.step, "parameters": params, "dependencies": deps, "inputs": self.cache_inputs()}
+        )
+
+    @property
+    def is_cacheable(self) -> bool:
+        """Whether the output_dir contents can be reused by a different pipeline (see OpusPocusStep.save_to_cache)."""
+        return True
+
+    def restore_from_cache(self) -> bool:
+        """Hardlink the step outputs from the cache_dir and mark the step as finished, if the outputs are cached.
+
+        Returns:
+            Whether the outputs were restored from the cache.
+        """
+        if self.cache_dir is None or self.has_state(StepState.DONE):
+            return False
+        cache_key = self.cache_key
+        if cache_key is None:
+            return False
+        cached_output_dir = Path(self.cache_dir, cache_key, "output")
+        if not cached_output_dir.is_dir():
+            return False
+
+        logger.info("[%s] Restoring the step outputs from %s.", self.step_label, cached_output_dir)
+        clean_dir(self.output_dir)
+        link_tree(cached_output_dir, self.output_dir)
+        clean_dir(self.tmp_dir)
+        self.state = StepState.DONE
+        return True
+
+    def save_to_cache(self) -> None:
+        """Hardlink the outputs of a finished step into the cache_dir, so other pipelines can reuse them.
+
+        The entry is created in a temporary directory first and renamed afterwards, so the concurrently running
+        pipelines never see incomplete entries. Failures are only reported, the step outputs stay valid.
+        """
+        if self.cache_dir is None or not self.has_state(StepState.DONE):
+            return
+        cache_key = self.cache_key
+        if cache_key is None or Path(self.cache_dir, cache_key).exists():
+            return
+        if not self.is_cacheable:
+            logger.info("[%s] Step outputs cannot be cached. Skipping...", self.step_label)
+            return
+
+        tmp_path = Path(self.cache_dir, f".{cache_key}.{os.getpid()}.tmp")
+        try:
+            link_tree(self.output_dir, Path(tmp_path, "output"))
+            cache_info = {
+                "step": self.step,
+                "step_label": self.step_label,
+                "pipeline_dir": str(self.pipeline_dir),
+                "parameters": self.get_parameters_dict(),
+                "created": time.time(),
+            }
+            with Path(tmp_path, self._cache_info_filename).open("w") as fh:
+                json.dump(cache_info, fh, indent=2, default=str)
+            tmp_path.rename(Path(self.cache_dir, cache_key))
+            logger.info("[%s] Saved the step outputs to the cache (%s).", self.step_label, cache_key)
+        except OSError as err:
+            logger.warning("[%s] Failed to save the step outputs to the cache: %s", self.step_label, err)
+        finally:
+            if tmp_path.exists():
+                clean_dir(tmp_path)
+                tmp_path.rmdir()
 
     def command(self, target_file: Path) -> None:
         """A step-specific definition of execution steps required to create a give target_file.
@@ -455,19 +608,23 @@ class OpusPocusStep:
         """
         raise NotImplementedError()
 
-    def main_task_preprocess(self) -> None:
-        """(Optional) preprocessing called before subtask execution."""
+    def main_task_preprocess(self, runner: Optional["OpusPocusRunner"] = None) -> None:  # noqa: F821
+        """(Optional) preprocessing called before subtask execution.
+
+        Args:
+            runner (OpusPocusRunner): runner executing the step (e.g. to query the available parallelism)
+        """
         pass
 
     def main_task_postprocess(self) -> None:
         """Postprocessing called after all subtasks successfully finished.
 
-        By default, we do a sanity check (all target files exist).
+        By default, we do a sanity check (all target files exist, see OpusPocusStep.is_command_target_finished).
         In practice, we use this method after parallel execution of step code, e.g. translating smaller parts of a
         large corpus. After the execution the sharded output can be merged into a single output corpus.
         """
         for target_file in self.get_command_targets():
-            if not target_file.exists():
+            if not self.is_command_target_finished(target_file):
                 err_msg = (
                     f"Target file {target_file} does not exists after the step finished {self.step_label} executing."
                 )
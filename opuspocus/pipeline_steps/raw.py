@@ -1,13 +1,13 @@
-import gzip
 import logging
 import shutil
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, List
 
 from attrs import define, field
 
 from opuspocus.pipeline_steps import register_step
 from opuspocus.pipeline_steps.corpus_step import CorpusStep
+from opuspocus.utils import link_file
 
 logger = logging.getLogger(__name__)
 
@@ -60,34 +60,50 @@ class RawCorpusStep(CorpusStep):
                 categories_dict["mapping"][self._default_category].append(corpus_prefix)
             self.save_categories_dict(categories_dict)
 
+    def raw_corpus_path(self, dataset: str, lang: str) -> Path:
+        """Location of the raw corpus file in a given language."""
+        corpus_filename = f"{dataset}.{lang}"
+        if self.compressed:
+            corpus_filename += ".gz"
+        return Path(self.raw_data_dir, corpus_filename)
+
+    def dataset_input_fingerprints(self, dataset: str) -> List[str]:
+        """Checksums of the raw corpus files and the .filters.json file (if available)."""
+        input_files = [self.raw_corpus_path(dataset, lang) for lang in self.languages]
+        input_files.append(Path(self.raw_data_dir, f"{dataset}.filters.json"))
+        return [f"{file.name}:{self.file_checksum(file)}" for file in input_files if file.exists()]
+
+    def cache_inputs(self) -> Dict[str, Any]:
+        """The registered datasets and the checksums of their raw files."""
+        return {
+            "categories": self.categories_dict,
+            "datasets": {dset: self.dataset_input_fingerprints(dset) for dset in self.dataset_list},
+        }
+
+    def dataset_output_files(self, dataset: str) -> List[Path]:
+        """Include the copied .filters.json file."""
+        return [*super().dataset_output_files(dataset), Path(self.output_dir, f"{dataset}.filters.json")]
+
     def get_command_targets(self) -> List[Path]:
         """One target_file per dataset per language."""
-        return [Path(self.output_dir, f"{dset}.{lang}.gz") for dset in self.dataset_list for lang in self.languages]
+        return [self.dataset_path(dset, lang) for dset in self.dataset_list for lang in self.languages]
 
     def command(self, target_file: Path) -> None:
-        """Hardlink the corpus files and copy OpusCleaner's .filters.json files if available."""
-        # Hardlink compressed files
-        target_filename = target_file.stem + target_file.suffix
-        lang = target_file.stem.split(".")[-1]
+        """Hardlink the corpus files and copy OpusCleaner's .filters.json files if available.
+
+        The corpus files are re-compressed instead if the step compression differs from the raw corpus files.
+        """
+        dataset, lang = self.parse_dataset_filename(target_file.name)
 
         # Copy .filters.json files, if available
         # Only do this once (for src lang) in bilingual corpora
         if lang == self.src_lang:
-            filters_filename = ".".join(target_file.stem.split(".")[:-1] + ["filters.json"])
+            filters_filename = f"{dataset}.filters.json"
             filters_path = Path(self.raw_data_dir, filters_filename)
             if filters_path.exists():
                 shutil.copy(filters_path, Path(self.output_dir, filters_filename))
 
-        if self.compressed:
-            corpus_path = Path(self.raw_data_dir, target_filename)
-            if not corpus_path.exists():
-                raise FileNotFoundError(corpus_path)
-            target_file.hardlink_to(corpus_path.resolve())
-        else:
-            corpus_path = Path(self.raw_data_dir, target_file.stem)
-            if not corpus_path.exists():
-                raise FileNotFoundError(corpus_path)
-            with open(corpus_path) as f_in:  # noqa: PTH123, SIM117
-                with gzip.open(target_file, "wt") as f_out:
-                    for line in f_in:
-                        print(line, end="", file=f_out)
+        corpus_path = self.raw_corpus_path(dataset, lang)
+        if not corpus_path.exists():
+            raise FileNotFoundError(corpus_path)
+        link_file(corpus_path.resolve(), target_file, self.compression_level)
@@ -4,7 +4,7 @@ import os
 import shutil
 import subprocess
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 import yaml
 from attrs import Attribute, Factory, converters, define, field, validators
@@ -155,6 +155,12 @@ class TrainModelStep(OpusPocusStep):
         if remove_finished_command_targets and opustrainer_state_file.exists():
             opustrainer_state_file.unlink()
 
+    def main_task_preprocess(self, runner: Optional["OpusPocusRunner"] = None) -> None:  # noqa: ARG002, F821
+        """Check the training and validation corpora before the training subtask is submitted."""
+        train_datasets = [".".join(dset_path.stem.split(".")[:-1]) for dset_path in self.opustrainer_dataset_paths]
+        self.train_corpus_step.preflight_check(train_datasets)
+        self.valid_corpus_step.preflight_check([self.valid_dataset])
+
     def _generate_opustrainer_config(self) -> Dict[str, Any]:
         """Generate OpusTrainer config file base on the provided TrainModelStep parameters."""
         config = {"seed": self.seed, "stages": ["main"], "modifiers": self.train_modifiers, "num_fields": 2}
@@ -162,6 +168,8 @@ class TrainModelStep(OpusPocusStep):
         categories = self.train_categories
         if categories is None:
             categories = self.train_corpus_step.categories
+        # The TSV files are read by OpusTrainer and Marian, therefore, they are gzip-compressed regardless of the
+        # train_corpus_step compression
         config["datasets"] = {
             cat: str(Path(self.tmp_dir.name, str(self.train_corpus_step.category_mapping[cat][0]) + ".tsv.gz"))
             for cat in categories
@@ -313,14 +321,14 @@ class TrainModelStep(OpusPocusStep):
                 continue
             logger.info("Creating dataset %s...", dset_path)
             dset = ".".join(dset_path.stem.split(".")[:-1])
-            in_files = [Path(self.train_corpus_step.output_dir, f"{dset}.{lang}.gz") for lang in self.languages]
+            in_files = [self.train_corpus_step.dataset_path(dset, lang) for lang in self.languages]
             paste_files(in_files, dset_path)
 
         # Prepare valid dataset TSV file
         if not self.valid_dataset_path.exists():
             logger.info("Creating dataset %s...", self.valid_dataset_path)
             dset = ".".join(self.valid_dataset_path.stem.split(".")[:-2])
-            in_files = [Path(self.valid_corpus_step.output_dir, f"{dset}.{lang}.gz") for lang in self.languages]
+            in_files = [self.valid_corpus_step.dataset_path(dset, lang) for lang in self.languages]
             paste_files(in_files, self.valid_dataset_path)
 
         args = argparse.Namespace(
@@ -5,7 +5,7 @@ import signal
 import subprocess
 import sys
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
 from attrs import Attribute, define, field, validators
 
@@ -13,7 +13,7 @@ from opuspocus.pipeline_steps import register_step
 from opuspocus.pipeline_steps.corpus_step import CorpusStep
 from opuspocus.pipeline_steps.train_model import TrainModelStep
 from opuspocus.runner_resources import RunnerResources
-from opuspocus.utils import open_file, read_shard, save_filestream
+from opuspocus.utils import decompress_file, materialize_file, open_file, save_filestream
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +29,8 @@ class TranslateCorpusStep(CorpusStep):
     beam_size: int = field(default=4, validator=validators.gt(0))
     model_suffix: str = field(default="best-chrf")
 
+    _marian_input_codecs = ("gzip", "none")
+
     @marian_dir.validator
     def _path_exists(self, _: str, value: Path) -> None:
         if not value.exists():
@@ -53,24 +55,31 @@ class TranslateCorpusStep(CorpusStep):
     def register_categories(self) -> None:
         shutil.copy(self.prev_corpus_step.categories_path, self.categories_path)
 
-    def infer_input(self, tgt_file: Path) -> Path:
-        """Infer the input files (including sharing if enabled) given a target_file."""
-        tgt_filename_stem_split = tgt_file.stem.split(".")
+    def main_task_preprocess(self, runner: Optional["OpusPocusRunner"] = None) -> None:  # noqa: F821
+        """Check the input corpora before the translation subtasks are submitted."""
+        self.prev_corpus_step.preflight_check()
+        super().main_task_preprocess(runner)
 
-        lang_idx = -1  # non-sharded
-        if tgt_filename_stem_split[-2] == "gz":
-            lang_idx = -3  # sharded
+    def shard_input_filename(self, filename: str) -> str:
+        """Both the source and the translated dataset shards are created from the source-side input dataset."""
+        dataset, _ = self.parse_dataset_filename(filename)
+        return self.prev_corpus_step.dataset_filename(dataset, self.src_lang)
 
-        # Constuct the source-side filename
-        src_filename_stem_split = tgt_filename_stem_split
-        src_filename_stem_split[lang_idx] = self.src_lang
-        src_filename = ".".join([*src_filename_stem_split, "gz"])
-        src_file = Path(tgt_file.parent, src_filename)
+    def infer_input(self, tgt_file: Path) -> Path:
+        """Infer the input files (including sharing if enabled) given a target_file."""
+        sharded = tgt_file.parent == self.shard_dir
+        if sharded:
+            tgt_filename, shard_idx = self.parse_dataset_shard_path(tgt_file)
+            dataset, _ = self.parse_dataset_filename(tgt_filename)
+            src_file = self.dataset_shard_path(self.dataset_filename(dataset, self.src_lang), shard_idx)
+        else:
+            dataset, _ = self.parse_dataset_filename(tgt_file.name)
+            src_file = self.dataset_path(dataset, self.src_lang)
 
         if src_file.exists():
             return src_file
 
-        if tgt_filename_stem_split[-2] == "gz":
+        if sharded:
             # Write the relevant shard lines into the source-side file
 
             # TODO(varisd): right now, we create the source-side shards and the
@@ -78,20 +87,18 @@ class TranslateCorpusStep(CorpusStep):
             #   the command_postprocess. Ideally in the future, we would like
             #   to hardling the input source-side file instead.
 
-            shard_idx = int(tgt_filename_stem_split[-1])
-            input_filename = ".".join(src_filename_stem_split[:-1])
-            shard_lines = read_shard(
-                Path(self.input_dir, input_filename),
-                self.prev_corpus_step.line_index_dict[input_filename],
-                shard_idx * self.shard_size,
-                self.shard_size,
-            )
-            with open_file(src_file, "w") as fh:
+            # The shard is written into the tmp_dir first, so an interrupted subtask does not leave
+            # an incomplete source-side shard behind (the finished shards are kept for the resubmission)
+            shard_lines = self.read_shard_input(tgt_filename, shard_idx)
+            tmp_src_file = Path(self.tmp_dir, src_file.name)
+            with open_file(tmp_src_file, "w", self.compression_level) as fh:
                 for line in shard_lines:
                     print(line, end="", file=fh)
+            tmp_src_file.replace(src_file)
         else:
-            # Hardlink the source-side corpus
-            src_file.hardlink_to(Path(self.input_dir, src_filename))
+            # Hardlink the source-side corpus (Marian requires a real, i.e. not virtual, file)
+            input_file = self.prev_corpus_step.dataset_path(dataset, self.src_lang)
+            materialize_file(input_file, src_file, self.compression_level)
 
         return src_file
 
@@ -106,9 +113,11 @@ class TranslateCorpusStep(CorpusStep):
             return [
                 shard_file_path
                 for dset in self.dataset_list
-                for shard_file_path in self.infer_dataset_output_shard_path_list(f"{dset}.{self.tgt_lang}.gz")
+                for shard_file_path in self.infer_dataset_output_shard_path_list(
+                    self.dataset_filename(dset, self.tgt_lang)
+                )
             ]
-        return [Path(self.output_dir, f"{dset}.{self.tgt_lang}.gz") for dset in self.dataset_list]
+        return [self.dataset_path(dset, self.tgt_lang) for dset in self.dataset_list]
 
     def command(self, target_file: Path) -> None:
         """Invoke Marian's decode program to translate the input dataset.
@@ -123,6 +132,11 @@ class TranslateCorpusStep(CorpusStep):
 
         # Hardlink source file
         input_file = self.infer_input(target_file)
+        if self.compression not in self._marian_input_codecs:
+            # Marian can only read plain text or gzip-compressed input
+            marian_input_file = Path(self.tmp_dir, f"{target_file.name}.input")
+            decompress_file(input_file, marian_input_file)
+            input_file = marian_input_file
 
         # Prepare the command
         marian_path = Path(self.marian_dir, "build", "marian-decoder")
@@ -159,7 +173,7 @@ class TranslateCorpusStep(CorpusStep):
         signal.signal(signal.SIGUSR1, step_terminate_handler)
         signal.signal(signal.SIGTERM, step_terminate_handler)
 
-        save_filestream(input_stream=proc.stdout, output_file=target_file)
+        save_filestream(input_stream=proc.stdout, output_file=target_file, compresslevel=self.compression_level)
 
         # Check the return code
         rc = proc.poll()
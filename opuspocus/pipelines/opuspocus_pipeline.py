@@ -8,7 +8,7 @@ from attrs import define, field, validators
 from omegaconf import OmegaConf
 
 from opuspocus.config import PIPELINE_CONFIG_FILE, PipelineConfig
-from opuspocus.pipeline_steps import OpusPocusStep, StepState, build_step, list_step_parameters
+from opuspocus.pipeline_steps import CorpusStep, OpusPocusStep, StepState, build_step, list_step_parameters
 from opuspocus.pipelines.exceptions import PipelineInitError, PipelineStateError
 from opuspocus.utils import clean_dir, file_path
 
@@ -231,8 +231,13 @@ class OpusPocusPipeline:
         self.save_pipeline()
         logger.info("Pipeline (%s) initialized successfully.", self.pipeline_dir)
 
-    def reinit(self, *, ignore_finished: bool = False) -> None:
-        """Reinitialize the pipeline."""
+    def reinit(self, *, ignore_finished: bool = False, incremental: bool = False) -> None:
+        """Reinitialize the pipeline.
+
+        With incremental=True, the finished steps that are still up to date are kept and the corpus steps
+        keep the outputs of their unchanged datasets (see OpusPocusStep.reinit_incremental). The steps are
+        listed in the order of their creation, i.e. the dependencies are re-initialized first.
+        """
         if self.state in [PipelineState.RUNNING, PipelineState.SUBMITTED]:
             err_msg = f"Trying to re-initialize a pipeline in {self.state} state. Stop the pipeline execution first."
             raise ValueError(err_msg)
@@ -240,19 +245,32 @@ class OpusPocusPipeline:
         for v in self.steps:
             if v.state == StepState.DONE and ignore_finished:
                 continue
+            if incremental:
+                v.reinit_incremental()
+                continue
             clean_dir(v.step_dir)
             v.init_step()
 
         self.save_pipeline()
         logger.info("Pipeline (%s) re-initialized successfully.", self.pipeline_dir)
 
-    def print_status(self, steps: List[OpusPocusStep]) -> None:
-        """Print the list of pipeline steps with their current status and print the status of the pipeline."""
+    def print_status(self, steps: List[OpusPocusStep], *, verbose: bool = False) -> None:
+        """Print the list of pipeline steps with their current status and print the status of the pipeline.
+
+        With verbose=True, the number of datasets, examples (source-side lines) and uncompressed bytes of
+        the finished corpus steps are appended using their output manifests.
+        """
         header = f"{self.pipeline_dir.stem}{self.pipeline_dir.suffix}|{self.__class__.__name__}|{self.state.value!s}"
         print(header)  # noqa: T201
         print("-" * len(header))  # noqa: T201
         for s in steps:
-            print(f"{s.step_label}|{s.__class__.__name__}|{s.state.value!s}")  # noqa: T201
+            line = f"{s.step_label}|{s.__class__.__name__}|{s.state.value!s}"
+            if verbose and isinstance(s, CorpusStep) and s.state == StepState.DONE:
+                datasets = s.manifest["datasets"]
+                n_lines = sum(langs[s.src_lang]["lines"] for langs in datasets.values())
+                n_bytes = sum(e["bytes"] for langs in datasets.values() for e in langs.values())
+                line += f"|datasets={len(datasets)}|lines={n_lines}|bytes={n_bytes}"
+            print(line)  # noqa: T201
 
     def print_traceback(self, target_labels: Optional[List[str]] = None, *, full: bool = False) -> None:
         """Print the pipeline structure and status of the individual steps."""
@@ -1,4 +1,5 @@
 import logging
+import os
 import signal
 import subprocess
 import sys
@@ -10,6 +11,7 @@ from typing import List, Optional
 from attrs import define, field, validators
 from psutil import NoSuchProcess, Process, wait_procs
 
+from opuspocus.pipeline_steps import OpusPocusStep
 from opuspocus.runner_resources import RunnerResources
 from opuspocus.runners import OpusPocusRunner, TaskInfo, register_runner
 from opuspocus.utils import subprocess_wait
@@ -116,6 +118,12 @@ class BashRunner(OpusPocusRunner):
             subprocess_wait(proc)
         return task_info
 
+    def max_parallel_tasks(self, step: OpusPocusStep) -> int:
+        """Number of the subtasks that fit the available CPUs (1 if the tasks are executed serially)."""
+        if not self.run_tasks_in_parallel:
+            return 1
+        return max((os.cpu_count() or 1) // max(self.get_resources(step).cpus, 1), 1)
+
     def send_signal(self, task_info: BashTaskInfo, signal: int = signal.SIGTERM) -> None:
         """Send the signal to the process with ID from the task_info.
 
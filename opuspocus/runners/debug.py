@@ -3,7 +3,7 @@ import os
 from pathlib import Path
 from typing import List, Optional
 
-from opuspocus.pipeline_steps import StepState, load_step
+from opuspocus.pipeline_steps import OpusPocusStep, StepState, load_step
 from opuspocus.runner_resources import RunnerResources
 from opuspocus.runners import OpusPocusRunner, TaskInfo
 from opuspocus.utils import clean_dir
@@ -34,6 +34,10 @@ class DebugRunner(OpusPocusRunner):
             pipeline_dir=pipeline_dir,
         )
 
+    def max_parallel_tasks(self, step: OpusPocusStep) -> int:  # noqa: ARG002
+        """The subtasks are executed serially."""
+        return 1
+
     def submit_task(
         self,
         cmd_path: Path,
@@ -52,15 +56,17 @@ class DebugRunner(OpusPocusRunner):
         # Process a specific target file
         if target_file is not None:
             os.environ = task_resources.get_env_dict()  # noqa: B003
-            step.command(target_file)
+            step.run_subtask(target_file)
             return TaskInfo(file_path=target_file, id=-1)
 
+        if step.restore_from_cache():
+            return TaskInfo(file_path=target_file, id=-1)
         step.state = StepState.RUNNING
-        step.main_task_preprocess()
+        step.main_task_preprocess(self)
 
         # Recursively process all the target files
         for t_file in step.get_command_targets():
-            if t_file.exists():
+            if step.is_command_target_finished(t_file):
                 continue
             self.submit_task(
                 cmd_path=cmd_path,
@@ -71,5 +77,6 @@ class DebugRunner(OpusPocusRunner):
         step.main_task_postprocess()
         clean_dir(step.tmp_dir)
         step.state = StepState.DONE
+        step.save_to_cache()
 
         return TaskInfo(file_path=target_file, id=-1)
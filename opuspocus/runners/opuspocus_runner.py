@@ -202,6 +202,11 @@ class OpusPocusRunner:
         Afterwards, submit the step's main_task using the specific runner's submit_task method implementation and
         save the information about the main_task submission.
 
+        A step whose outputs are in the cache_dir is not submitted at all only if all its dependencies are already
+        finished (or restored from the cache themselves), because its cache_key depends on the contents of
+        the dependency outputs. Otherwise, the main_task is submitted and restores the outputs from the cache
+        when it starts (see OpusPocusStep.run_main_task).
+
         Args:
             step (OpusPocusStep): step to submit
             resubmit_finished_subtasks (bool): resubmit finished subtasks of a failed (partially done) task
@@ -242,6 +247,11 @@ class OpusPocusRunner:
             if dep_sub_info is not None:
                 dep_sub_info_list.append(dep_sub_info)
 
+        # The outputs can be restored from the cache if the dependencies are already finished
+        if step.restore_from_cache():
+            logger.info("[%s] Step %s was restored from the cache. Skipping...", self.runner, step.step_label)
+            return None
+
         # Submit the main step task which then is responsible of submitting its subtasks
         logger.info("[%s] Submitting '%s' main step task.", self.runner, step.step_label)
 
@@ -410,6 +420,13 @@ class OpusPocusRunner:
         with Path(step.step_dir, self._info_filename).open("r") as fh:
             return yaml.safe_load(fh)
 
+    def max_parallel_tasks(self, step: OpusPocusStep) -> Optional[int]:  # noqa: ARG002
+        """Maximum number of the step's subtasks that can run at the same time (None if unknown or unlimited).
+
+        Used, e.g., by the CorpusStep automatic sharding (shard_size="auto").
+        """
+        return None
+
     def get_resources(self, step: OpusPocusStep) -> RunnerResources:
         """Get default runner resources."""
         if step.runner_resources is not None:
@@ -36,6 +36,7 @@ class SlurmRunner(OpusPocusRunner):
 
     slurm_time: str = field(validator=validators.optional(validators.instance_of(str)), default=None)
     slurm_other_options: str = field(validator=validators.optional(validators.instance_of(str)), default=None)
+    slurm_max_parallel_tasks: int = field(validator=validators.optional(validators.gt(0)), default=None)
 
     @slurm_time.validator
     def _validate_time(self, attribute: Attribute, value: Optional[str]) -> None:
@@ -55,6 +56,13 @@ class SlurmRunner(OpusPocusRunner):
         OpusPocusRunner.add_runner_argument(
             parser, "slurm_other_options", type=str, default=None, help="Additional Slurm CLI options."
         )
+        OpusPocusRunner.add_runner_argument(
+            parser,
+            "slurm_max_parallel_tasks",
+            type=int,
+            default=None,
+            help="Maximum number of the step subtasks running at the same time (e.g. the per-user job limit).",
+        )
 
     def submit_task(
         self,
@@ -182,6 +190,10 @@ class SlurmRunner(OpusPocusRunner):
             )
             subprocess_wait(proc)
 
+    def max_parallel_tasks(self, step: OpusPocusStep) -> Optional[int]:  # noqa: ARG002
+        """The user-provided limit of the running jobs (unlimited if None)."""
+        return self.slurm_max_parallel_tasks
+
     def send_signal(self, task_info: SlurmTaskInfo, signal: int = signal.SIGTERM) -> None:
         """Send the signal to the Slurm job with the ID from the task_info.
 
@@ -1,121 +1,493 @@
 #!/usr/bin/env python3
 import argparse
+import collections
+import functools
+import hashlib
+import itertools
+import json
+import multiprocessing as mp
 import sys
+import zlib
 from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    TextIO,
+    Tuple,
+    Union,
+)
 
-from opuspocus.utils import open_file
+import numpy as np
+from attrs import define, field, validators
 
+from opuspocus.tools.deduplicate import ngram_hashes
+from opuspocus.utils import load_line_index, open_file
 
-class Counter:
-    seen = 0
-    kept = 0
-    removed = 0
+if TYPE_CHECKING:
+    from multiprocessing.pool import AsyncResult
+
+# "exact": remove the examples equal to a test example (on either side, see hash_example)
+# "ngram": remove the examples sharing at least ngram_threshold word n-grams with the test examples (on either side)
+DECONTAMINATION_MODES = ("exact", "ngram")
+
+# Number of examples processed at once (hashed together, sent to a worker process)
+BATCH_LINES = 2**14
+
+
+# Columns of the per-sample match counts (see ContaminationStats)
+KEPT = 0
+REMOVED = 1
 
 
 def hash_mono(line):  # noqa: ANN001, ANN201
     return line.strip().lower()
 
 
-def make_hashes(line):  # noqa: ANN001, ANN201
-    src, tgt = line.split("\t", 2)
+def hash_example(example: Tuple[str, ...], *, mono: bool) -> Tuple[str, Optional[str]]:
+    """Return the (source, target) hashes of a (monolingual or parallel) example."""
+    if mono:
+        return hash_mono(example[0]), None
     # maybe we want to translate(str.maketrans("", "", string.punctuation))
-    return hash_mono(src), hash_mono(tgt)
+    return hash_mono(example[0]), hash_mono(example[1])
 
 
-def main(args):  # noqa: ANN001, ANN201, PLR0912, PLR0915
-    src_test_samples = dict()  # noqa: C408
-    tgt_test_samples = dict()  # noqa: C408
-    removed = 0
-    retained = 0
+def hash_segments(segments: Iterable[str]) -> np.ndarray:
+    """Return the 64-bit hashes of the normalized segments (see hash_mono)."""
+    digests = bytearray()
+    for segment in segments:
+        digests += hashlib.blake2b(hash_mono(segment).encode("utf-8"), digest_size=8).digest()
+    return np.frombuffer(bytes(digests), dtype="<u8")
 
-    for test_file in args.test_files.split(","):
-        test_fh = open_file(Path(test_file), "r")
-        for line in test_fh:
-            if args.mono:
-                src = hash_mono(line)
-                tgt = "null"
-            else:
-                src, tgt = make_hashes(line)
 
-            src_test_samples[src] = Counter()
-            tgt_test_samples[tgt] = Counter()
+# Read-only test index of the running decontamination (see decontaminate), inherited copy-on-write by the forked
+# worker processes (or passed to the worker processes by _init_worker if fork is not available)
+_INDEX: Optional["ContaminationIndex"] = None
 
-    input_fh = sys.stdin
-    if args.input_file is not None:
-        input_fh = open_file(Path(args.input_file), "r")
-    output_fh = sys.stdout
-    if args.output_file is not None:
-        output_fh = open_file(Path(args.output_file), "w")
 
-    i = 1
-    for line in input_fh:
-        if args.mono:
-            src = hash_mono(line)
-            tgt = None
+@define(kw_only=True)
+class ContaminationIndex:
+    """Compact index of the test examples: a sorted array of the unique 64-bit hashes for each example side.
+
+    In the "exact" mode, the hashes of the normalized test segments (see hash_segments). In the "ngram" mode,
+    the hashes of the test segment n-grams of the ngram_order (see build_ngram_set). The position of a hash
+    in the array is the test sample id. The test sets containing each sample are stored in the CSR format:
+    the ids of the test sets (positions in test_sets) containing the sample i are
+    owners[side][owner_offsets[side][i]:owner_offsets[side][i + 1]].
+
+    The index is saved as a single binary file of the concatenated little-endian uint64 arrays with the metadata
+    (mode, ngram_order, test set names, array sizes) in a separate JSON file, so it can be memory-mapped
+    (read-only) by any number of processes (see ContaminationIndex.load).
+    """
+
+    mode: str = field(validator=validators.in_(DECONTAMINATION_MODES))
+    ngram_order: int = field(default=8, validator=validators.gt(0))
+    test_sets: List[str] = field(factory=list)
+    hashes: List[np.ndarray] = field(factory=list)
+    owner_offsets: List[np.ndarray] = field(factory=list)
+    owners: List[np.ndarray] = field(factory=list)
+
+    @classmethod
+    def build(
+        cls: "ContaminationIndex",
+        test_sets: Mapping[str, Iterable[Tuple[str, ...]]],
+        *,
+        mono: bool,
+        mode: str,
+        ngram_order: int,
+    ) -> "ContaminationIndex":
+        """Hash the examples of the named test sets."""
+        n_sides = 1 if mono else 2
+        set_hashes: List[List[np.ndarray]] = [[] for _ in range(n_sides)]
+        for test_set in test_sets.values():
+            test_examples = list(test_set)
+            for side in range(n_sides):
+                segments = (example[side] for example in test_examples)
+                if mode == "exact":
+                    set_hashes[side].append(np.unique(hash_segments(segments)))
+                else:
+                    set_hashes[side].append(build_ngram_set(segments, ngram_order))
+
+        index = cls(mode=mode, ngram_order=ngram_order, test_sets=list(test_sets))
+        for side_hashes in set_hashes:
+            set_ids = np.repeat(np.arange(len(side_hashes), dtype=np.uint64), [len(h) for h in side_hashes])
+            hashes, sample_ids = np.unique(
+                np.concatenate([np.zeros(0, dtype=np.uint64), *side_hashes]), return_inverse=True
+            )
+            # The hashes of each test set are unique, so the (sample, test set) pairs are unique as well
+            order = np.lexsort((set_ids, sample_ids))
+            index.hashes.append(hashes)
+            index.owner_offsets.append(np.concatenate([[0], np.cumsum(np.bincount(sample_ids, minlength=len(hashes)))]))
+            index.owners.append(set_ids[order])
+        return index
+
+    @staticmethod
+    def metadata_path(index_file: Path) -> Path:
+        """Location of the index metadata."""
+        return Path(f"{index_file}.json")
+
+    def save(self, index_file: Path) -> None:
+        """Save the index (see ContaminationIndex.load)."""
+        arrays = [*self.hashes, *self.owner_offsets, *self.owners]
+        with index_file.open("wb") as fh:
+            for array in arrays:
+                array.astype("<u8").tofile(fh)
+        metadata = {
+            "mode": self.mode,
+            "ngram_order": self.ngram_order,
+            "test_sets": self.test_sets,
+            "sizes": [len(array) for array in arrays],
+        }
+        with self.metadata_path(index_file).open("w") as fh:
+            json.dump(metadata, fh, indent=2)
+
+    @classmethod
+    def load(cls: "ContaminationIndex", index_file: Path) -> "ContaminationIndex":
+        """Memory-map an index previously saved by ContaminationIndex.save."""
+        with cls.metadata_path(index_file).open("r") as fh:
+            metadata = json.load(fh)
+        data = load_line_index(index_file)
+        bounds = np.cumsum([0, *metadata["sizes"]])
+        arrays = [data[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+        n_sides = len(arrays) // 3
+        return cls(
+            mode=metadata["mode"],
+            ngram_order=metadata["ngram_order"],
+            test_sets=metadata["test_sets"],
+            hashes=arrays[:n_sides],
+            owner_offsets=arrays[n_sides : 2 * n_sides],
+            owners=arrays[2 * n_sides :],
+        )
+
+    @property
+    def n_sides(self) -> int:
+        """Number of the indexed example sides (1 for the monolingual data)."""
+        return len(self.hashes)
+
+    def lookup(self, side: int, hashes: np.ndarray) -> np.ndarray:
+        """Return the test sample ids of the segment hashes of a given side (-1 for the segments not in the index)."""
+        keys = self.hashes[side]
+        if not len(keys):
+            return np.full(len(hashes), -1, dtype=np.int64)
+        ids = np.minimum(np.searchsorted(keys, hashes), len(keys) - 1)
+        return np.where(keys[ids] == hashes, ids, -1)
+
+    def test_set_counts(self, side: int, sample_counts: np.ndarray) -> np.ndarray:
+        """Sum the per-sample counts (first axis) of a given side over the test sets containing the samples."""
+        offsets = self.owner_offsets[side].astype(np.int64)
+        pair_samples = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        result = np.zeros((len(self.test_sets), *sample_counts.shape[1:]), dtype=sample_counts.dtype)
+        np.add.at(result, self.owners[side].astype(np.int64), sample_counts[pair_samples])
+        return result
+
+
+@define(kw_only=True)
+class BatchStats:
+    """Statistics of a processed batch of examples, merged by the main process in the order of the batches."""
+
+    seen: int = 0
+    removed: int = 0
+    retained: int = 0
+    # Per-side (test sample ids, outcomes) of the matches between the example segments and the test samples,
+    # the outcome is KEPT or REMOVED (the outcome of the matched example)
+    matches: List[Tuple[np.ndarray, np.ndarray]] = field(factory=list)
+
+
+@define(kw_only=True)
+class ContaminationStats:
+    """Decontamination statistics of a dataset.
+
+    The matches of the test samples are counted in the arrays indexed by the test sample id (see
+    ContaminationIndex), sample_counts[side][i] contains the number of matching kept and removed examples
+    (columns KEPT and REMOVED).
+    """
+
+    index: ContaminationIndex = field(repr=False)
+    seen: int = 0
+    removed: int = 0
+    retained: int = 0
+    sample_counts: List[np.ndarray] = field()
+
+    @sample_counts.default
+    def _default_sample_counts(self) -> List[np.ndarray]:
+        return [np.zeros((len(hashes), 2), dtype=np.int64) for hashes in self.index.hashes]
+
+    def merge(self, stats: BatchStats) -> None:
+        """Add the statistics of a processed batch."""
+        self.seen += stats.seen
+        self.removed += stats.removed
+        self.retained += stats.retained
+        for counts, (sample_ids, outcomes) in zip(self.sample_counts, stats.matches):
+            np.add.at(counts, (sample_ids, outcomes), 1)
+
+    def report(self) -> Dict[str, Any]:
+        """Return the JSON-serializable report of the kept/removed examples and the leaked test sets.
+
+        For each test set and side, "samples" is the number of the test samples (segments or n-grams in the ngram
+        mode), "matched" the number of the test samples matched by at least one training example, "kept" and
+        "removed" the numbers of the matches of the kept and removed training examples.
+        """
+        report = {
+            "mode": self.index.mode,
+            "examples": self.seen,
+            "kept": self.seen - self.removed,
+            "removed": self.removed,
+            "retained_below_min_length": self.retained,
+            "test_sets": {name: {} for name in self.index.test_sets},
+        }
+        if self.index.mode == "ngram":
+            report["ngram_order"] = self.index.ngram_order
+        for side_idx, (side, counts) in enumerate(zip(["src", "tgt"], self.sample_counts)):
+            matched = (counts.sum(axis=1) > 0).astype(np.int64)
+            ones = np.ones(len(counts), dtype=np.int64)
+            per_set = self.index.test_set_counts(side_idx, np.column_stack([ones, matched, counts]))
+            for name, (n_samples, n_matched, n_kept, n_removed) in zip(self.index.test_sets, per_set.tolist()):
+                report["test_sets"][name][side] = {
+                    "samples": n_samples,
+                    "matched": n_matched,
+                    "kept": n_kept,
+                    "removed": n_removed,
+                }
+        return report
+
+    def print_summary(self, file: TextIO = sys.stderr) -> None:
+        """Print the summary of the statistics (the per-side statistics are printed only in the "exact" mode)."""
+        i = self.seen
+        overlap = f" ({self.index.ngram_order}-gram overlap)" if self.index.mode == "ngram" else ""
+        print(
+            f"Removed {self.removed:,} lines out of {i:,}{overlap}. Retained {self.retained:,} below length threshold",
+            file=file,
+        )
+        if self.index.mode != "exact":
+            return
+
+        for side, counts in zip(["Src", "Trg"], self.sample_counts):
+            n_samples = max(len(counts), 1)
+            for label, column in [("Seen", None), ("Removed", REMOVED), ("Kept", KEPT)]:
+                values = counts.sum(axis=1) if column is None else counts[:, column]
+                print(label, file=file)
+                print(f"{side} total: {int(values.sum())}/{i}", file=file)
+                print(f"{side} was: {np.count_nonzero(values) / n_samples:%}", file=file)
+
+
+def filter_batch(
+    batch: List[Tuple[str, ...]],
+    min_length: int,
+    *,
+    ngram_threshold: int,
+) -> Tuple[List[bool], BatchStats]:
+    """Decide which examples of a batch are kept using the test index of the running decontamination.
+
+    An example is removed if either of its sides matches a test example side, unless the example is shorter than
+    min_length characters on average.
+
+    Return:
+        The kept example mask and the batch statistics.
+    """
+    n_sides = _INDEX.n_sides
+    matches = []  # per-side (example ids, test sample ids)
+    contaminated = np.zeros(len(batch), dtype=bool)
+    for side in range(n_sides):
+        segments = [example[side] for example in batch]
+        if _INDEX.mode == "ngram":
+            example_ids, sample_ids = shared_ngrams(segments, _INDEX.hashes[side], _INDEX.ngram_order)
+            contaminated |= np.bincount(example_ids, minlength=len(batch)) >= ngram_threshold
         else:
-            src, tgt = make_hashes(line)
-
-        # Seen
-        src_seen, tgt_seen = False, False
-        if src in src_test_samples:
-            src_test_samples[src].seen += 1
-            src_seen = True
-        if not args.mono and tgt in tgt_test_samples:
-            tgt_test_samples[tgt].seen += 1
-            tgt_seen = True
-
-        # Remove sentences which are present on either side of the devsets but
-        # only if the average length is greater than min_length
-        if src_seen or tgt_seen:
-            if args.mono:  # noqa: SIM108
-                limit = len(src) * 2
-            else:
-                limit = len(src) + len(tgt)
-
-            if limit > 2 * args.min_length:
-                if src in src_test_samples:
-                    src_test_samples[src].removed += 1
-                if not args.mono and tgt in tgt_test_samples:
-                    tgt_test_samples[tgt].removed += 1
-                removed += 1
-                continue
-            else:  # noqa: RET507
-                if src in src_test_samples:
-                    src_test_samples[src].kept += 1
-                if not args.mono and tgt in tgt_test_samples:
-                    tgt_test_samples[tgt].kept += 1
-                retained += 1
-        i += 1
-
-        # We never stripped the original newline
-        print(line, end="", file=output_fh)
-
-    print(  # noqa: T201
-        f"Removed {removed:,} lines out of {i:,}. Retained {retained:,} below length threshold",
-        file=sys.stderr,
+            sample_ids = _INDEX.lookup(side, hash_segments(segments))
+            (example_ids,) = np.nonzero(sample_ids >= 0)
+            sample_ids = sample_ids[example_ids]
+            contaminated[example_ids] = True
+        matches.append((example_ids, sample_ids))
+
+    # Remove sentences which are present on either side of the devsets but
+    # only if the average length is greater than min_length
+    removed = np.zeros(len(batch), dtype=bool)
+    for i in np.nonzero(contaminated)[0]:
+        lengths = [len(hash_mono(segment)) for segment in batch[i][:n_sides]]
+        limit = lengths[0] * 2 if n_sides == 1 else sum(lengths)
+        removed[i] = limit > 2 * min_length
+
+    stats = BatchStats(
+        seen=len(batch),
+        removed=int(removed.sum()),
+        retained=int(contaminated.sum() - removed.sum()),
+        matches=[(sample_ids, np.where(removed[example_ids], REMOVED, KEPT)) for example_ids, sample_ids in matches],
     )
+    return (~removed).tolist(), stats
+
+
+def _init_worker(index: ContaminationIndex) -> None:
+    global _INDEX  # noqa: PLW0603
+    _INDEX = index
+
+
+def _filter_batches(
+    batches: Iterator[List[Tuple[str, ...]]], process_batch: Callable, n_workers: int
+) -> Iterator[Tuple[List[Tuple[str, ...]], Tuple[List[bool], BatchStats]]]:
+    """Process the batches (in parallel with n_workers > 1), yield the batches and their results in order.
+
+    At most 2 * n_workers batches are processed at the same time, so the memory usage stays bounded.
+    """
+    if n_workers <= 1:
+        for batch in batches:
+            yield batch, process_batch(batch)
+        return
+
+    if "fork" in mp.get_all_start_methods():
+        pool = mp.get_context("fork").Pool(n_workers)
+    else:
+        pool = mp.Pool(n_workers, initializer=_init_worker, initargs=(_INDEX,))
+    with pool:
+        pending: Deque[Tuple[List[Tuple[str, ...]], AsyncResult]] = collections.deque()
+        for batch in batches:
+            pending.append((batch, pool.apply_async(process_batch, (batch,))))
+            if len(pending) >= 2 * n_workers:
+                done_batch, result = pending.popleft()
+                yield done_batch, result.get()
+        while pending:
+            done_batch, result = pending.popleft()
+            yield done_batch, result.get()
+
+
+def decontaminate(
+    examples: Iterable[Tuple[str, ...]],
+    test_examples: Union[ContaminationIndex, Iterable[Tuple[str, ...]]],
+    min_length: int,
+    *,
+    mono: bool = False,
+    mode: str = "exact",
+    ngram_order: int = 8,
+    ngram_threshold: int = 1,
+    n_workers: int = 1,
+    report_file: Optional[Path] = None,
+) -> Iterator[Tuple[str, ...]]:
+    """Yield the examples that are not present in the test examples.
+
+    Examples are tuples of (source, target) segments (only source for the monolingual data) without the trailing
+    newlines. An example is removed if either of its sides matches a test example side, unless the example is
+    shorter than min_length characters on average. The statistics are printed to stderr after the examples are
+    consumed and saved as a JSON report to the report_file (see ContaminationStats.report).
+
+    In the "ngram" mode, the sides match if they share at least ngram_threshold word n-grams of the ngram_order
+    (see count_shared_ngrams), so the lightly reformatted test examples are also removed.
+
+    The test_examples are hashed into a ContaminationIndex first (as a single test set), unless a prebuilt index
+    is passed instead (its mode and ngram_order are used). With n_workers > 1, the examples are processed
+    in batches of BATCH_LINES by the worker processes sharing the (read-only) index, the kept examples are yielded
+    in the original order.
+    """
+    global _INDEX  # noqa: PLW0603
+    if isinstance(test_examples, ContaminationIndex):
+        index = test_examples
+    elif mode not in DECONTAMINATION_MODES:
+        err_msg = f"Unknown decontamination mode {mode} (available: {', '.join(DECONTAMINATION_MODES)})."
+        raise ValueError(err_msg)
+    else:
+        index = ContaminationIndex.build({"test": test_examples}, mono=mono, mode=mode, ngram_order=ngram_order)
+    if index.n_sides != (1 if mono else 2):
+        err_msg = f"The test index contains {index.n_sides} example side(s), mono={mono} examples were expected."
+        raise ValueError(err_msg)
+    _INDEX = index
+
+    examples = iter(examples)
+    batches = iter(lambda: list(itertools.islice(examples, BATCH_LINES)), [])
+    process_batch = functools.partial(filter_batch, min_length=min_length, ngram_threshold=ngram_threshold)
+    stats = ContaminationStats(index=index)
+    try:
+        for batch, (keep, batch_stats) in _filter_batches(batches, process_batch, n_workers):
+            stats.merge(batch_stats)
+            yield from itertools.compress(batch, keep)
+    finally:
+        _INDEX = None
+    stats.print_summary()
+    if report_file is not None:
+        with report_file.open("w") as fh:
+            json.dump(stats.report(), fh, indent=2)
+
+
+def tokenize(segment: str) -> np.ndarray:
+    """Return the hashes of the (lowercased, whitespace-separated) words of a segment."""
+    return np.array([zlib.crc32(word) for word in segment.lower().encode("utf-8").split()], dtype=np.uint64)
+
+
+def segment_ngram_hashes(segments: Sequence[str], ngram_order: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the n-gram hashes of a batch of segments and the index of the segment of each n-gram."""
+    hashes, counts = ngram_hashes([tokenize(segment) for segment in segments], ngram_order)
+    return hashes, np.repeat(np.arange(len(segments)), counts)
 
-    for side, samples in [("Src", src_test_samples), ("Trg", tgt_test_samples)]:
-        total_seen = sum(v.seen for v in samples.values())
-        was_seen = sum(1 if v.seen > 0 else 0 for v in samples.values())
 
-        print("Seen", file=sys.stderr)  # noqa: T201
-        print(f"{side} total: {total_seen}/{i}", file=sys.stderr)  # noqa: T201
-        print(f"{side} was: {was_seen/len(samples):%}", file=sys.stderr)  # noqa: T201
+def build_ngram_set(segments: Iterable[str], ngram_order: int) -> np.ndarray:
+    """Hash the n-grams of the segments into a compact set (sorted array of the unique 64-bit hashes)."""
+    batches = [np.zeros(0, dtype=np.uint64)]
+    while True:
+        batch = list(itertools.islice(segments, BATCH_LINES))
+        if not batch:
+            break
+        batches.append(np.unique(segment_ngram_hashes(batch, ngram_order)[0]))
+    return np.unique(np.concatenate(batches))
 
-        total_removed = sum(v.removed for v in samples.values())
-        was_removed = sum(1 if v.removed > 0 else 0 for v in samples.values())
 
-        print("Removed", file=sys.stderr)  # noqa: T201
-        print(f"{side} total: {total_removed}/{i}", file=sys.stderr)  # noqa: T201
-        print(f"{side} was: {was_removed/len(samples):%}", file=sys.stderr)  # noqa: T201
+def shared_ngrams(segments: Sequence[str], ngram_set: np.ndarray, ngram_order: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the (segment index, n-gram set position) pairs of the distinct n-grams shared by the segments."""
+    hashes, segment_ids = segment_ngram_hashes(segments, ngram_order)
+    if not len(ngram_set):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(ngram_set, hashes), len(ngram_set) - 1)
+    shared = ngram_set[positions] == hashes
+    pairs = np.unique(np.stack([segment_ids[shared], positions[shared]]), axis=1)
+    return pairs[0], pairs[1]
 
-        total_kept = sum(v.kept for v in samples.values())
-        was_kept = sum(1 if v.kept > 0 else 0 for v in samples.values())
 
-        print("Kept", file=sys.stderr)  # noqa: T201
-        print(f"{side} total: {total_kept}/{i}", file=sys.stderr)  # noqa: T201
-        print(f"{side} was: {was_kept/len(samples):%}", file=sys.stderr)  # noqa: T201
+def count_shared_ngrams(segments: Sequence[str], ngram_set: np.ndarray, ngram_order: int) -> np.ndarray:
+    """Return the number of distinct n-grams of each segment present in the n-gram set."""
+    return np.bincount(shared_ngrams(segments, ngram_set, ngram_order)[0], minlength=len(segments))
+
+
+def read_tsv_examples(lines: Iterable[str]) -> Iterator[Tuple[str, ...]]:
+    """Convert the tab-separated lines into example tuples."""
+    for line in lines:
+        yield tuple(line.rstrip("\n").split("\t"))
+
+
+def main(args):  # noqa: ANN001, ANN201
+    def read_test_examples(test_file: Path) -> Iterator[Tuple[str, ...]]:
+        with open_file(test_file, "r") as test_fh:
+            yield from read_tsv_examples(test_fh)
+
+    test_sets = {test_file: read_test_examples(Path(test_file)) for test_file in args.test_files.split(",")}
+    index = ContaminationIndex.build(test_sets, mono=args.mono, mode=args.mode, ngram_order=args.ngram_order)
+
+    input_fh = sys.stdin
+    if args.input_file is not None:
+        input_fh = open_file(Path(args.input_file), "r")
+    output_fh = sys.stdout
+    if args.output_file is not None:
+        output_fh = open_file(Path(args.output_file), "w")
+
+    for example in decontaminate(
+        read_tsv_examples(input_fh),
+        index,
+        args.min_length,
+        mono=args.mono,
+        ngram_threshold=args.ngram_threshold,
+        n_workers=args.workers,
+        report_file=None if args.report_file is None else Path(args.report_file),
+    ):
+        print("\t".join(example), file=output_fh)
+
+    # The compressed output is finalized only after closing the file
+    if args.input_file is not None:
+        input_fh.close()
+    if args.output_file is not None:
+        output_fh.close()
 
 
 def parse_args():  # noqa: ANN201
@@ -125,4 +497,13 @@ def parse_args():  # noqa: ANN201
     parser.add_argument("--test-files", type=str, required=True, help="Comma-separated list of files.")
     parser.add_argument("--min-length", type=int, default=0, help="TODO")
     parser.add_argument("--mono", action="store_true", help="TODO")
+    parser.add_argument(
+        "--mode", type=str, choices=DECONTAMINATION_MODES, default="exact", help="Test example matching mode."
+    )
+    parser.add_argument("--ngram-order", type=int, default=8, help="Word n-gram order (ngram mode).")
+    parser.add_argument(
+        "--ngram-threshold", type=int, default=1, help="Minimum number of shared n-grams to remove an example."
+    )
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes.")
+    parser.add_argument("--report-file", type=str, default=None, help="JSON report of the leaked test sets.")
     return parser.parse_args()
@@ -0,0 +1,414 @@
+import hashlib
+import itertools
+import zlib
+from pathlib import Path
+from typing import Iterator, List, Sequence, Tuple
+
+import numpy as np
+from attrs import Attribute, define, field, validators
+
+from opuspocus.utils import open_file, open_file_at
+
+# Hash bucket records: 64-bit example hash and the example line number within its dataset
+RECORD_DTYPE = np.dtype([("hash", "<u8"), ("line", "<u8")])
+
+# Number of examples hashed before they are distributed into the bucket files
+HASH_CHUNK_LINES = 2**20
+
+
+def bucket_file(bucket_dir: Path, bucket: int, dataset_idx: int, chunk_idx: int = 0) -> Path:
+    """Hash records of a given dataset (chunk) falling into a given bucket."""
+    return Path(bucket_dir, f"{bucket:05d}.{dataset_idx}.{chunk_idx}.bin")
+
+
+def drop_file(bucket_dir: Path, bucket: int, dataset_idx: int) -> Path:
+    """Line numbers of the duplicate examples of a given dataset found in a given bucket."""
+    return Path(bucket_dir, f"{bucket:05d}.{dataset_idx}.drop")
+
+
+def read_examples(files: Sequence[Path]) -> Iterator[List[bytes]]:
+    """Yield the aligned lines (without the trailing newlines) of the (parallel) corpus files as raw bytes."""
+    fhs = [open_file(file, "rb") for file in files]
+    try:
+        for i, lines in enumerate(itertools.zip_longest(*fhs)):
+            if None in lines:
+                err_msg = (
+                    f"Parallel corpus files {', '.join(str(file) for file in files)} have a different number "
+                    f"of lines (mismatch at line {i + 1})."
+                )
+                raise ValueError(err_msg)
+            yield [line.rstrip(b"\n") for line in lines]
+    finally:
+        for fh in fhs:
+            fh.close()
+
+
+def hash_examples(examples: Iterator[List[bytes]], key_indices: Sequence[int]) -> Iterator[np.ndarray]:
+    """Yield chunks of the 64-bit hashes of the example keys (the selected example segments)."""
+    while True:
+        digests = bytearray()
+        for example in itertools.islice(examples, HASH_CHUNK_LINES):
+            key = b"\n".join(example[idx] for idx in key_indices)
+            digests += hashlib.blake2b(key, digest_size=8).digest()
+        if not digests:
+            return
+        yield np.frombuffer(bytes(digests), dtype="<u8")
+
+
+def partition_dataset_chunk(
+    files: Sequence[Path],
+    offsets: Sequence[int],
+    first_line: int,
+    n_lines: int,
+    key_indices: Sequence[int],
+    bucket_dir: Path,
+    dataset_idx: int,
+    chunk_idx: int,
+    prefix_bits: int,
+) -> None:
+    """Hash a range of the dataset examples and append the hash records to the bucket files given by the hash prefix.
+
+    The range starts at the given byte offsets of the files (and the first_line line number). Each chunk
+    of the dataset writes its own bucket files, so the chunks can be processed in parallel.
+    """
+    line = first_line
+    for hashes in hash_examples(read_example_range(files, offsets, n_lines), key_indices):
+        records = np.empty(len(hashes), dtype=RECORD_DTYPE)
+        records["hash"] = hashes
+        records["line"] = np.arange(line, line + len(hashes), dtype=np.uint64)
+        line += len(hashes)
+
+        append_to_buckets(records, bucket_dir, dataset_idx, chunk_idx, prefix_bits)
+
+
+def append_to_buckets(
+    records: np.ndarray, bucket_dir: Path, dataset_idx: int, chunk_idx: int, prefix_bits: int
+) -> None:
+    """Append the hash records to the bucket files given by the prefix_bits hash prefix (keeping their order)."""
+    buckets = records["hash"] >> np.uint64(64 - prefix_bits)
+    records = records[np.argsort(buckets, kind="stable")]
+    bounds = np.cumsum(np.bincount(buckets.astype(np.int64), minlength=2**prefix_bits))
+    for bucket, (start, end) in enumerate(zip([0, *bounds[:-1]], bounds)):
+        if start == end:
+            continue
+        with bucket_file(bucket_dir, bucket, dataset_idx, chunk_idx).open("ab") as fh:
+            records[start:end].tofile(fh)
+
+
+def find_bucket_duplicates(bucket_dir: Path, bucket: int, n_datasets: int, *, across_datasets: bool) -> None:
+    """Find the duplicate examples within a single hash bucket and save their line numbers into the drop files.
+
+    The first occurrence of each example is kept. With across_datasets, an example is also removed if it occurs
+    in any of the preceding datasets (in the order of the dataset indices).
+    """
+    records, dataset_ids = [], []
+    for dataset_idx in range(n_datasets):
+        for file in bucket_dir.glob(f"{bucket:05d}.{dataset_idx}.*.bin"):
+            records.append(np.fromfile(file, dtype=RECORD_DTYPE))
+            dataset_ids.append(np.full(len(records[-1]), dataset_idx, dtype=np.int64))
+    if not records:
+        return
+    hashes = np.concatenate([rec["hash"] for rec in records])
+    lines = np.concatenate([rec["line"] for rec in records])
+    datasets = np.concatenate(dataset_ids)
+
+    # Sort by the hashes, the first occurrence (in the order of the datasets and lines) of each hash comes first
+    order = np.lexsort((lines, datasets, hashes)) if across_datasets else np.lexsort((lines, hashes, datasets))
+    hashes, lines, datasets = hashes[order], lines[order], datasets[order]
+    duplicate = np.zeros(len(hashes), dtype=bool)
+    duplicate[1:] = hashes[1:] == hashes[:-1]
+    if not across_datasets:
+        duplicate[1:] &= datasets[1:] == datasets[:-1]
+
+    for dataset_idx in range(n_datasets):
+        dropped = lines[duplicate & (datasets == dataset_idx)]
+        if len(dropped):
+            dropped.astype("<u8").tofile(drop_file(bucket_dir, bucket, dataset_idx))
+
+
+def load_drop_mask(bucket_dir: Path, dataset_idx: int, n_lines: int) -> bytes:
+    """Return the bit mask (one bit per line, little bit order) of the duplicate examples of a dataset."""
+    mask = np.zeros((n_lines + 7) // 8, dtype=np.uint8)
+    for file in sorted(bucket_dir.glob(f"*.{dataset_idx}.drop")):
+        dropped = np.fromfile(file, dtype="<u8")
+        np.bitwise_or.at(mask, dropped >> np.uint64(3), np.left_shift(1, dropped & np.uint64(7)).astype(np.uint8))
+    return mask.tobytes()
+
+
+def deduplicate(examples: Iterator[List[bytes]], drop_mask: bytes) -> Iterator[List[bytes]]:
+    """Yield the examples that are not marked in the drop mask (see load_drop_mask)."""
+    for i, example in enumerate(examples):
+        if not drop_mask[i >> 3] >> (i & 7) & 1:
+            yield example
+
+
+# Near-duplicate detection (MinHash LSH)
+SHINGLE_TYPES = ("char", "word")
+
+# Maximum number of shingles whose permuted hashes are held in memory at once
+MINHASH_BATCH_SHINGLES = 2**14
+
+# Number of examples whose signatures are computed before they are distributed into the bucket files
+LSH_BATCH_EXAMPLES = 2**16
+
+# Edges between the near-duplicate examples (global example ids, see example_id)
+EDGE_DTYPE = np.dtype([("src", "<u8"), ("dst", "<u8")])
+
+# Global example id: dataset index in the high bits, line number in the low bits
+EXAMPLE_LINE_BITS = 40
+
+_FNV_PRIME = np.uint64(0x100000001B3)
+_DIGITS_TO_ZERO = bytes.maketrans(b"123456789", b"000000000")
+
+
+def _mix64(values: np.ndarray) -> np.ndarray:
+    """SplitMix64 finalizer, spreads the entropy of the uint64 hashes over all bits (including the prefix)."""
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def example_id(dataset_idx: int, lines: np.ndarray) -> np.ndarray:
+    """Global ids of the dataset examples ordered by the dataset index and the line number."""
+    return (np.uint64(dataset_idx) << np.uint64(EXAMPLE_LINE_BITS)) | lines.astype(np.uint64)
+
+
+def split_example_id(ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Inverse of example_id, return the dataset indices and the line numbers."""
+    return ids >> np.uint64(EXAMPLE_LINE_BITS), ids & np.uint64(2**EXAMPLE_LINE_BITS - 1)
+
+
+def ngram_hashes(tokens: Sequence[np.ndarray], order: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the 64-bit hashes of the token n-grams of all sequences and the number of n-grams of each sequence.
+
+    The sequences shorter than order consist of a single n-gram (the whole sequence). The tokens (uint64 codes)
+    of all sequences are concatenated (separated by order padding tokens), so the rolling n-gram hashes
+    of the whole batch are computed at once.
+    """
+    pad = np.zeros(order, dtype=np.uint64)
+    lengths = np.array([len(tok) for tok in tokens], dtype=np.int64)
+    counts = np.maximum(lengths - order + 1, 1)
+    flat = np.concatenate([part for tok in tokens for part in (tok, pad)]) if len(tokens) else pad
+
+    starts = np.concatenate([[0], np.cumsum(lengths + order)[:-1]]).astype(np.int64)
+    positions = np.repeat(starts - np.concatenate([[0], np.cumsum(counts)[:-1]]), counts)
+    positions += np.arange(counts.sum(), dtype=np.int64)
+    hashes = np.zeros(len(positions), dtype=np.uint64)
+    for offset in range(order):
+        hashes = hashes * _FNV_PRIME + flat[positions + offset]
+    return _mix64(hashes), counts
+
+
+@define(kw_only=True)
+class MinHashLSH:
+    """MinHash signatures of the example shingles and their LSH band keys.
+
+    The shingles are the character or word n-grams (`shingle`, `shingle_size`) of an example, examples shorter
+    than shingle_size consist of a single shingle. With `normalize_digits`, all digits are replaced by zeros first,
+    so the examples differing only in numbers or dates have identical signatures.
+
+    The signatures consist of num_perm minimal values of the shingle hashes permuted by the multiply-shift hash
+    functions. The signatures are split into `bands` bands, two examples are near-duplicate candidates if all rows
+    of any of their bands are equal.
+    """
+
+    shingle: str = field(default="char", validator=validators.in_(SHINGLE_TYPES))
+    shingle_size: int = field(default=5, validator=validators.gt(0))
+    num_perm: int = field(default=128, validator=validators.gt(0))
+    bands: int = field(default=16, validator=validators.gt(0))
+    seed: int = field(default=42)
+    normalize_digits: bool = field(default=True)
+
+    _perm_a: np.ndarray = field(init=False, eq=False, repr=False)
+    _perm_b: np.ndarray = field(init=False, eq=False, repr=False)
+
+    @bands.validator
+    def _bands_divide_num_perm(self, attribute: Attribute, value: int) -> None:
+        if self.num_perm % value != 0:
+            err_msg = f"{attribute.name} ({value}) must divide num_perm ({self.num_perm})."
+            raise ValueError(err_msg)
+
+    def __attrs_post_init__(self) -> None:
+        rng = np.random.default_rng(self.seed)
+        self._perm_a = rng.integers(1, 2**63, size=self.num_perm, dtype=np.uint64) | np.uint64(1)
+        self._perm_b = rng.integers(0, 2**63, size=self.num_perm, dtype=np.uint64)
+
+    def tokenize(self, text: bytes) -> np.ndarray:
+        """Return the uint64 codes of the example tokens (unicode code points or word hashes)."""
+        if self.normalize_digits:
+            text = text.translate(_DIGITS_TO_ZERO)
+        if self.shingle == "char":
+            return np.frombuffer(text.decode("utf-8", "replace").encode("utf-32-le"), dtype="<u4").astype(np.uint64)
+        return np.array([zlib.crc32(word) for word in text.split()], dtype=np.uint64)
+
+    def shingle_hashes(self, texts: Sequence[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the 32-bit hashes of the shingles of all examples and the number of shingles of each example."""
+        hashes, counts = ngram_hashes([self.tokenize(text) for text in texts], self.shingle_size)
+        return hashes >> np.uint64(32), counts
+
+    def signatures(self, texts: Sequence[bytes]) -> np.ndarray:
+        """Return the (n_examples, num_perm) uint32 MinHash signatures.
+
+        The permuted hashes are computed in vectorized batches of approx. MINHASH_BATCH_SHINGLES shingles.
+        """
+        hashes, counts = self.shingle_hashes(texts)
+        ends = np.cumsum(counts)
+        signatures = np.empty((len(counts), self.num_perm), dtype=np.uint32)
+        first = 0
+        while first < len(counts):
+            start = ends[first] - counts[first]
+            last = max(int(np.searchsorted(ends, start + MINHASH_BATCH_SHINGLES, side="right")), first + 1)
+            batch = hashes[start : ends[last - 1]]
+            permuted = (batch[:, None] * self._perm_a[None, :] + self._perm_b[None, :]) >> np.uint64(32)
+            offsets = (ends[first:last] - counts[first:last]) - start
+            signatures[first:last] = np.minimum.reduceat(permuted, offsets, axis=0)
+            first = last
+        return signatures
+
+    def band_keys(self, signatures: np.ndarray) -> np.ndarray:
+        """Return the (n_examples, bands) uint64 hashes of the signature bands (unique for each band index)."""
+        rows = self.num_perm // self.bands
+        bands = signatures.reshape(len(signatures), self.bands, rows).astype(np.uint64)
+        keys = np.broadcast_to(np.arange(self.bands, dtype=np.uint64), bands.shape[:2]).copy()
+        for row in range(rows):
+            keys = keys * _FNV_PRIME + bands[:, :, row]
+        return _mix64(keys)
+
+
+def read_example_range(files: Sequence[Path], offsets: Sequence[int], n_lines: int) -> Iterator[List[bytes]]:
+    """Yield n_lines aligned examples of the (parallel) corpus files starting at the given byte offsets."""
+    fhs = [open_file_at(file, offset, "rb") for file, offset in zip(files, offsets)]
+    try:
+        for _ in range(n_lines):
+            yield [fh.readline().rstrip(b"\n") for fh in fhs]
+    finally:
+        for fh in fhs:
+            fh.close()
+
+
+def partition_band_keys(
+    minhash: MinHashLSH,
+    files: Sequence[Path],
+    offsets: Sequence[int],
+    first_line: int,
+    n_lines: int,
+    key_indices: Sequence[int],
+    bucket_dir: Path,
+    dataset_idx: int,
+    chunk_idx: int,
+    prefix_bits: int,
+) -> None:
+    """Compute the LSH band keys of a range of the dataset examples and append them to the bucket files.
+
+    Every (band key, example id) record is stored in the bucket given by the band key prefix. Each chunk of the
+    dataset writes its own bucket files, so the chunks can be processed in parallel.
+    """
+    examples = read_example_range(files, offsets, n_lines)
+    line = first_line
+    while True:
+        examples_batch = itertools.islice(examples, LSH_BATCH_EXAMPLES)
+        texts = [b"\n".join(example[idx] for idx in key_indices) for example in examples_batch]
+        if not texts:
+            return
+        keys = minhash.band_keys(minhash.signatures(texts))
+        records = np.empty(keys.size, dtype=RECORD_DTYPE)
+        records["hash"] = keys.ravel()
+        records["line"] = np.repeat(example_id(dataset_idx, np.arange(line, line + len(texts))), minhash.bands)
+        line += len(texts)
+
+        append_to_buckets(records, bucket_dir, dataset_idx, chunk_idx, prefix_bits)
+
+
+def find_bucket_near_duplicates(bucket_dir: Path, bucket: int, *, across_datasets: bool) -> None:
+    """Connect the examples sharing a band key within a single bucket and save the edges into the bucket edge file.
+
+    Each example of a group sharing a band key is connected to the first example (the smallest example id)
+    of the group. Without across_datasets, only the examples of the same dataset are connected.
+    """
+    files = sorted(bucket_dir.glob(f"{bucket:05d}.*.bin"))
+    if not files:
+        return
+    records = np.concatenate([np.fromfile(file, dtype=RECORD_DTYPE) for file in files])
+    keys, ids = records["hash"], records["line"]
+    datasets, _ = split_example_id(ids)
+    order = np.lexsort((ids, keys)) if across_datasets else np.lexsort((ids, keys, datasets))
+    keys, ids, datasets = keys[order], ids[order], datasets[order]
+
+    new_group = np.ones(len(keys), dtype=bool)
+    new_group[1:] = keys[1:] != keys[:-1]
+    if not across_datasets:
+        new_group[1:] |= datasets[1:] != datasets[:-1]
+    group_first = ids[np.flatnonzero(new_group)][np.cumsum(new_group) - 1]
+    edges = np.empty(int((~new_group).sum()), dtype=EDGE_DTYPE)
+    edges["src"], edges["dst"] = group_first[~new_group], ids[~new_group]
+    if len(edges):
+        edges.tofile(Path(bucket_dir, f"{bucket:05d}.edges"))
+
+
+def _find_roots(parent: np.ndarray, nodes: np.ndarray) -> np.ndarray:
+    """Return the union-find roots of the nodes (following the parent pointers)."""
+    roots = parent[nodes]
+    while True:
+        next_roots = parent[roots]
+        if np.array_equal(next_roots, roots):
+            return roots
+        roots = next_roots
+
+
+def _union_edges(parent: np.ndarray, src: np.ndarray, dst: np.ndarray) -> None:
+    """Merge the union-find components connected by the edges, the larger root is linked to the smaller one.
+
+    The conflicting links of the same root are resolved over the iterations (each root's parent only decreases),
+    so every component ends up rooted at its smallest node.
+    """
+    edge_nodes = np.concatenate([src, dst])
+    while True:
+        src_roots, dst_roots = _find_roots(parent, src), _find_roots(parent, dst)
+        differ = src_roots != dst_roots
+        if not differ.any():
+            break
+        src, dst = src[differ], dst[differ]
+        src_roots, dst_roots = src_roots[differ], dst_roots[differ]
+        np.minimum.at(parent, np.maximum(src_roots, dst_roots), np.minimum(src_roots, dst_roots))
+    # Path compression, the following buckets find the roots of these nodes directly
+    parent[edge_nodes] = _find_roots(parent, edge_nodes)
+
+
+def drop_near_duplicate_clusters(bucket_dir: Path, n_lines: Sequence[int]) -> None:
+    """Find the clusters (connected components) of the near-duplicate examples and save the drop files.
+
+    All but the first example (the smallest example id) of each cluster are dropped. The clusters are found
+    by a union-find over the examples of all datasets (with n_lines examples each), its parent array
+    is a memory-mapped file in the bucket_dir. The edge files are processed one bucket at a time, so only
+    the edges of a single bucket are held in memory.
+    """
+    files = sorted(bucket_dir.glob("*.edges"))
+    if not files:
+        return
+    dataset_starts = np.concatenate([[0], np.cumsum(n_lines)]).astype(np.int64)
+
+    def node_index(ids: np.ndarray) -> np.ndarray:
+        datasets, lines = split_example_id(ids)
+        return dataset_starts[datasets.astype(np.int64)] + lines.astype(np.int64)
+
+    parent_path = Path(bucket_dir, "clusters.parent.npy")
+    parent = np.lib.format.open_memmap(parent_path, mode="w+", dtype=np.int64, shape=(int(dataset_starts[-1]),))
+    for start in range(0, len(parent), HASH_CHUNK_LINES):
+        parent[start : start + HASH_CHUNK_LINES] = np.arange(start, min(start + HASH_CHUNK_LINES, len(parent)))
+    for file in files:
+        edges = np.fromfile(file, dtype=EDGE_DTYPE)
+        _union_edges(parent, node_index(edges["src"]), node_index(edges["dst"]))
+
+    # The roots are the first examples of the clusters, all the other cluster members point to a smaller example
+    for dataset_idx, (first, last) in enumerate(zip(dataset_starts[:-1], dataset_starts[1:])):
+        dropped = [np.empty(0, dtype=np.int64)]
+        for start in range(first, last, HASH_CHUNK_LINES):
+            end = min(start + HASH_CHUNK_LINES, last)
+            dropped.append(np.flatnonzero(parent[start:end] != np.arange(start, end)) + (start - first))
+        lines = np.concatenate(dropped)
+        if len(lines):
+            lines.astype("<u8").tofile(Path(bucket_dir, f"clusters.{dataset_idx}.drop"))
+    del parent
+    parent_path.unlink()
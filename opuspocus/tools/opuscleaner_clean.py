@@ -0,0 +1,534 @@
+import collections
+import contextlib
+import itertools
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from queue import SimpleQueue
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from attrs import define, field
+
+from opuspocus.utils import file_sha256, json_digest, open_file
+
+try:
+    from opuscleaner import logging as opuscleaner_logging
+    from opuscleaner.clean import Pipeline, ProcessPool, print_lines
+    from opuscleaner.config import FILTER_PATH
+    from opuscleaner.filters import Filter, FilterPipeline, list_filters, set_global_filters
+    from pydantic import parse_obj_as
+except ImportError:
+    Pipeline = None
+
+# Number of lines processed by a single run of the filter pipeline in a worker process
+BATCH_LINES = 2**16
+
+# Filters that need to see the whole dataset at once (e.g. bifixer pipes its output into bifixer_dedupe.py),
+# the filters containing "dedup" in their name are considered the same way (see needs_whole_file)
+WHOLE_FILE_FILTERS = ("bifixer",)
+
+# Filter pipeline of the worker process (see _init_worker)
+_PIPELINE: Optional["Pipeline"] = None
+
+# Single-filter pipelines of the worker process collecting the filter decisions (see _init_decision_worker)
+_FILTER_PIPELINES: List["Pipeline"] = []
+
+
+def is_available() -> bool:
+    """Check whether the OpusCleaner Python package is installed."""
+    return Pipeline is not None
+
+
+def check_available() -> None:
+    """Raise an error if the OpusCleaner Python package is not installed."""
+    if not is_available():
+        err_msg = "The OpusCleaner Python package is not available. Install it using `pip install opuscleaner`."
+        raise ImportError(err_msg)
+
+
+def pipeline_languages(filters_file: Path) -> List[str]:
+    """Return the languages of the pipeline input files (the order of the columns processed by the filters)."""
+    with filters_file.open("r") as fh:
+        return [filename.rsplit(".", 2)[1] for filename in json.load(fh)["files"]]
+
+
+def pipeline_filters(filters_file: Path) -> List[str]:
+    """Return the names of the filters in the .filters.json pipeline (in the order of their application)."""
+    with filters_file.open("r") as fh:
+        return [step["filter"] for step in json.load(fh)["filters"]]
+
+
+def is_whole_file_filter(name: str, whole_file_filters: Sequence[str] = WHOLE_FILE_FILTERS) -> bool:
+    """Check whether the filter cannot process the dataset in independent parts."""
+    return name in whole_file_filters or "dedup" in name.lower()
+
+
+def needs_whole_file(filters_file: Path, whole_file_filters: Sequence[str] = WHOLE_FILE_FILTERS) -> bool:
+    """Check whether the pipeline contains a filter that cannot process the dataset in independent parts."""
+    return any(is_whole_file_filter(name, whole_file_filters) for name in pipeline_filters(filters_file))
+
+
+def filter_definitions(filter_path: Optional[str] = None) -> Dict[str, "Filter"]:
+    """Return the filter definitions found in the filter_path (the OpusCleaner FILTER_PATH by default)."""
+    check_available()
+    return {definition.name: definition for definition in list_filters(filter_path or FILTER_PATH)}
+
+
+def filter_versions(names: Iterable[str], filter_path: Optional[str] = None) -> Dict[str, str]:
+    """Return the checksums of the definitions of the named filters found in the filter_path.
+
+    The checksum also covers the files of the filter's basedir referenced by its command (e.g. ./max_length.py),
+    so it changes when the filter implementation is updated.
+    """
+    definitions = filter_definitions(filter_path)
+    versions = {}
+    for name in names:
+        if name not in definitions:
+            continue
+        definition = definitions[name]
+        scripts = {
+            token: file_sha256(Path(definition.basedir, token))
+            for token in sorted(set(re.findall(r"[\w./-]+", definition.command)))
+            if not token.startswith("/") and Path(definition.basedir, token).is_file()
+        }
+        versions[name] = json_digest({"definition": definition.dict(exclude={"basedir"}), "scripts": scripts})
+    return versions
+
+
+def load_pipeline(
+    filters_file: Path, filter_path: Optional[str] = None, filter_range: Optional[Tuple[int, int]] = None
+) -> "Pipeline":
+    """Load the filter definitions (from the OpusCleaner FILTER_PATH by default) and the .filters.json pipeline.
+
+    With filter_range, only the (start, end) slice of the pipeline filters is loaded.
+    """
+    filters = filter_definitions(filter_path)
+    # The FilterPipeline validation looks the filters up in the global filter list
+    set_global_filters(filters.values())
+    with filters_file.open("r") as fh:
+        pipeline = json.load(fh)
+    if filter_range is not None:
+        pipeline["filters"] = pipeline["filters"][slice(*filter_range)]
+    return Pipeline(filters, pipeline_languages(filters_file), parse_obj_as(FilterPipeline, pipeline))
+
+
+def _init_worker(filters_file: Path, filter_path: Optional[str], filter_range: Optional[Tuple[int, int]]) -> None:
+    global _PIPELINE  # noqa: PLW0603
+    _PIPELINE = load_pipeline(filters_file, filter_path, filter_range)
+
+
+def _init_decision_worker(filters_file: Path, filter_path: Optional[str], filter_range: Tuple[int, int]) -> None:
+    global _FILTER_PIPELINES  # noqa: PLW0603
+    _FILTER_PIPELINES = [load_pipeline(filters_file, filter_path, (k, k + 1)) for k in range(*filter_range)]
+
+
+def clean_batch(batch: bytes) -> bytes:
+    """Run the filter pipeline of the worker process over a batch of tab-separated lines."""
+    return _run_pipeline(_PIPELINE, batch)
+
+
+def clean_batch_decisions(batch: bytes) -> Tuple[bytes, List[np.ndarray]]:
+    """Run the filters of the worker process one by one over a batch, return the output and the filter decisions.
+
+    The decisions of the k-th filter are the keep mask over the batch lines after the first k + 1 filters, derived
+    by matching the filter output to its input lines (see _filter_decisions). Once a filter modifies the lines,
+    the rest of the filters process its output and only the decisions of the preceding filters are returned.
+    """
+    input_lines = batch.splitlines(keepends=True)
+    kept = np.arange(len(input_lines))
+    decisions = []
+    output = batch
+    for k, pipeline in enumerate(_FILTER_PIPELINES):
+        stage_lines = [input_lines[idx] for idx in kept]
+        output = _run_pipeline(pipeline, output)
+        matched = _filter_decisions(pipeline, stage_lines, output.splitlines(keepends=True))
+        if matched is None:
+            for rest in _FILTER_PIPELINES[k + 1 :]:
+                output = _run_pipeline(rest, output)
+            return output, decisions
+        kept = kept[matched]
+        mask = np.zeros(len(input_lines), dtype=bool)
+        mask[kept] = True
+        decisions.append(mask)
+    return output, decisions
+
+
+def _filter_decisions(
+    pipeline: "Pipeline", input_lines: Sequence[bytes], output_lines: Sequence[bytes]
+) -> Optional[np.ndarray]:
+    """Return the mask of the input lines kept intact by the filter, None if the filter modified any line.
+
+    The output matched to the input lines can also result from a rewrite of a line into a copy of a following line
+    (e.g. by a normalization), so the match is confirmed by running the filter over the unmatched lines:
+    a (line-by-line) filter keeping the lines intact drops all of them.
+    """
+    matched = _match_lines(input_lines, output_lines)
+    if matched is None:
+        return None
+    dropped = b"".join(line for line, keep in zip(input_lines, matched) if not keep)
+    if dropped and _run_pipeline(pipeline, dropped):
+        return None
+    return matched
+
+
+def _match_lines(input_lines: Sequence[bytes], output_lines: Sequence[bytes]) -> Optional[np.ndarray]:
+    """Return the mask of the input lines kept in the output, None if the output is not a subsequence of the input."""
+    mask = np.zeros(len(input_lines), dtype=bool)
+    idx = 0
+    for line in output_lines:
+        while idx < len(input_lines) and input_lines[idx] != line:
+            idx += 1
+        if idx == len(input_lines):
+            return None
+        mask[idx] = True
+        idx += 1
+    return mask
+
+
+def _run_pipeline(pipeline: "Pipeline", batch: bytes) -> bytes:
+    """Run the filter pipeline over a batch of tab-separated lines.
+
+    The filters (shell commands) read and write temporary files, their stderr is forwarded to the stderr.
+    The OpusCleaner process management requires an (untraced) logging context.
+    """
+    print_queue: SimpleQueue = SimpleQueue()
+    print_thread = threading.Thread(target=print_lines, args=[print_queue, sys.stderr.buffer])
+    print_thread.start()
+    try:
+        with opuscleaner_logging.Context(), opuscleaner_logging.span("clean_batch"), contextlib.ExitStack() as stack:
+            input_fh = stack.enter_context(tempfile.TemporaryFile())
+            output_fh = stack.enter_context(tempfile.TemporaryFile())
+            input_fh.write(batch)
+            input_fh.seek(0)
+            with ProcessPool(print_queue) as pool:
+                pipeline.run(pool, input_fh, output_fh)
+            output_fh.seek(0)
+            return output_fh.read()
+    finally:
+        print_queue.put(None)
+        print_thread.join()
+
+
+def _split_batch(batch: bytes, n_columns: int) -> Iterator[List[bytes]]:
+    for line in batch.splitlines():
+        columns = line.split(b"\t")
+        if len(columns) != n_columns:
+            err_msg = f"OpusCleaner produced a line with {len(columns)} column(s) instead of {n_columns}: {line!r}"
+            raise ValueError(err_msg)
+        yield columns
+
+
+def clean_stream(
+    examples: Iterable[Sequence[bytes]],
+    filters_file: Path,
+    *,
+    filter_path: Optional[str] = None,
+    filter_range: Optional[Tuple[int, int]] = None,
+) -> Iterator[List[bytes]]:
+    """Yield the examples cleaned by a single run of the filter pipeline (or its filter_range slice).
+
+    The examples are streamed through the pipeline processes started by the current process (the input is written
+    by a separate thread), so the filters see the whole dataset without it being held in memory.
+    """
+    pipeline = load_pipeline(filters_file, filter_path, filter_range)
+    if not pipeline.steps:
+        yield from (list(example) for example in examples)
+        return
+
+    n_columns = len(pipeline_languages(filters_file))
+    input_r, input_w = os.pipe()
+    output_r, output_w = os.pipe()
+    feed_errors: List[BaseException] = []
+
+    def feed() -> None:
+        try:
+            with open(input_w, "wb") as fh:  # noqa: PTH123
+                for example in examples:
+                    fh.write(b"\t".join(example) + b"\n")
+        except BrokenPipeError:
+            # The pipeline stopped reading its input, the pool reports the failed filter
+            pass
+        except BaseException as e:  # noqa: BLE001
+            feed_errors.append(e)
+
+    feed_thread = threading.Thread(target=feed)
+    print_queue: SimpleQueue = SimpleQueue()
+    print_thread = threading.Thread(target=print_lines, args=[print_queue, sys.stderr.buffer])
+    print_thread.start()
+    feed_thread.start()
+    try:
+        with opuscleaner_logging.Context(), opuscleaner_logging.span("clean_stream"), contextlib.ExitStack() as stack:
+            # Pipeline.run closes the input, it is also closed here in case the run fails (unblocking the feeder)
+            input_fh = stack.enter_context(open(input_r, "rb"))  # noqa: PTH123
+            output_fh = stack.enter_context(open(output_r, "rb"))  # noqa: PTH123
+            with ProcessPool(print_queue) as pool:
+                with open(output_w, "wb") as pipeline_output:  # noqa: PTH123
+                    pipeline.run(pool, input_fh, pipeline_output)
+                for line in output_fh:
+                    yield from _split_batch(line, n_columns)
+    finally:
+        feed_thread.join()
+        print_queue.put(None)
+        print_thread.join()
+    if feed_errors:
+        raise feed_errors[0]
+
+
+def clean_examples(
+    examples: Iterable[Sequence[bytes]],
+    filters_file: Path,
+    *,
+    n_workers: int = 1,
+    filter_path: Optional[str] = None,
+    whole_file: bool = False,
+    filter_range: Optional[Tuple[int, int]] = None,
+) -> Iterator[List[bytes]]:
+    """Yield the examples (segments in the order of the pipeline files) cleaned by the OpusCleaner filter pipeline.
+
+    Each of the n_workers worker processes loads the filter pipeline (or its filter_range slice, see load_pipeline)
+    once and runs it over the batches of BATCH_LINES examples (see _map_batches). With whole_file, the examples
+    are streamed through a single pipeline run instead (see needs_whole_file and clean_stream).
+    """
+    check_available()
+    if whole_file:
+        yield from clean_stream(examples, filters_file, filter_path=filter_path, filter_range=filter_range)
+        return
+
+    n_columns = len(pipeline_languages(filters_file))
+    initargs = (filters_file, filter_path, filter_range)
+    for output in _map_batches(examples, clean_batch, n_workers=n_workers, initializer=_init_worker, initargs=initargs):
+        yield from _split_batch(output, n_columns)
+
+
+def clean_batches(
+    examples: Iterable[Sequence[bytes]],
+    filters_file: Path,
+    *,
+    n_workers: int = 1,
+    filter_path: Optional[str] = None,
+    filter_range: Optional[Tuple[int, int]] = None,
+) -> Iterator[Tuple[List[List[bytes]], List[np.ndarray]]]:
+    """Yield the cleaned examples of each batch of BATCH_LINES examples together with the filter decisions.
+
+    The filters (of the filter_range slice of the pipeline) are run one by one over each batch by the n_workers
+    worker processes, see clean_batch_decisions.
+    """
+    check_available()
+    n_columns = len(pipeline_languages(filters_file))
+    if filter_range is None:
+        filter_range = (0, len(pipeline_filters(filters_file)))
+    initargs = (filters_file, filter_path, filter_range)
+    for output, decisions in _map_batches(
+        examples, clean_batch_decisions, n_workers=n_workers, initializer=_init_decision_worker, initargs=initargs
+    ):
+        yield list(_split_batch(output, n_columns)), decisions
+
+
+def _map_batches(
+    examples: Iterable[Sequence[bytes]],
+    task: Callable[[bytes], Any],
+    *,
+    n_workers: int,
+    initializer: Callable[..., None],
+    initargs: Tuple,
+) -> Iterator[Any]:
+    """Yield the results of the task run by the worker processes over the batches of BATCH_LINES examples.
+
+    At most 2 * n_workers batches are processed at the same time and the results are yielded in the original order.
+    """
+    examples = iter(examples)
+    batches = iter(
+        lambda: b"".join(b"\t".join(example) + b"\n" for example in itertools.islice(examples, BATCH_LINES)), b""
+    )
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=initializer, initargs=initargs) as executor:
+        pending: Deque[Future] = collections.deque()
+        try:
+            for batch in batches:
+                pending.append(executor.submit(task, batch))
+                if len(pending) >= 2 * n_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def write_examples(
+    examples: Iterable[Sequence[bytes]], output_files: Sequence[Path], compresslevel: Optional[int] = None
+) -> None:
+    """Write the example segments into the respective output files (one line per example)."""
+    with contextlib.ExitStack() as stack:
+        fhs = [stack.enter_context(open_file(file, "wb", compresslevel)) for file in output_files]
+        for example in examples:
+            for segment, fh in zip(example, fhs):
+                fh.write(segment)
+                fh.write(b"\n")
+
+
+def clean_corpus(
+    examples: Iterable[Sequence[bytes]],
+    output_files: Sequence[Path],
+    filters_file: Path,
+    *,
+    n_workers: int = 1,
+    compresslevel: Optional[int] = None,
+    filter_path: Optional[str] = None,
+    whole_file: bool = False,
+) -> None:
+    """Clean the (parallel) corpus examples using the filter pipeline and write the per-language output files.
+
+    The example segments and the output files are in the order of the pipeline files (see pipeline_languages).
+    """
+    write_examples(
+        clean_examples(examples, filters_file, n_workers=n_workers, filter_path=filter_path, whole_file=whole_file),
+        output_files,
+        compresslevel,
+    )
+
+
+@define(kw_only=True)
+class FilterDecisionCache:
+    """Cache of the per-line keep/drop decisions of the filter pipeline prefixes.
+
+    The decisions of the first k filters of a pipeline are stored as a bitmap over the input lines (bit set
+    for the kept lines) in the cache_dir. The bitmap is keyed by the checksum of the input, of the configuration
+    of the k filters and of their definitions (see FilterDecisionCache.prefix_keys), so a rerun of a modified
+    or extended pipeline only runs the filters following the longest cached prefix.
+
+    The uncached filters are run one by one over each batch of the input and their decisions are derived by matching
+    their output to their input lines (see clean_batch_decisions and _filter_decisions). Only the filters keeping
+    the lines intact can be cached this way: the output of a filter modifying the lines (e.g. a normalization)
+    is processed by the rest of the pipeline without caching. The filters starting with the first whole-file filter
+    (see needs_whole_file) are streamed through a single pipeline run without caching.
+    """
+
+    cache_dir: Path = field(converter=Path)
+
+    @staticmethod
+    def prefix_keys(filters_file: Path, input_key: Any, filter_path: Optional[str] = None) -> List[str]:  # noqa: ANN401
+        """Return the cache keys of the pipeline prefixes (the first k filters for each k = 1..n) given the input key.
+
+        The input_key must identify the input examples (e.g. the checksums of the input files and the line range).
+        """
+        with filters_file.open("r") as fh:
+            steps = json.load(fh)["filters"]
+        languages = pipeline_languages(filters_file)
+        versions = filter_versions({step["filter"] for step in steps}, filter_path)
+        return [
+            json_digest(
+                {
+                    "input": input_key,
+                    "languages": languages,
+                    "filter_path": filter_path,
+                    "filters": steps[: k + 1],
+                    "versions": [versions.get(step["filter"]) for step in steps[: k + 1]],
+                }
+            )
+            for k in range(len(steps))
+        ]
+
+    def bitmap_path(self, key: str) -> Path:
+        """Full path to the decision bitmap of a given cache key."""
+        return Path(self.cache_dir, key[:2], f"{key}.bits")
+
+    def load(self, key: str, n_lines: int) -> Optional[np.ndarray]:
+        """Return the boolean keep mask of the n_lines input lines, None if it is not cached."""
+        path = self.bitmap_path(key)
+        if not path.exists():
+            return None
+        return np.unpackbits(np.fromfile(path, dtype=np.uint8), count=n_lines).astype(bool)
+
+    def save(self, key: str, mask: np.ndarray) -> None:
+        """Save the keep mask as a bitmap (atomically, the cache can be shared by concurrently running steps)."""
+        path = self.bitmap_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        np.packbits(mask).tofile(tmp_path)
+        tmp_path.replace(path)
+
+    def cached_prefix(self, keys: Sequence[str], n_lines: int) -> Tuple[int, np.ndarray]:
+        """Return the length of the longest cached pipeline prefix (given the prefix keys) and its keep mask."""
+        for k in reversed(range(len(keys))):
+            mask = self.load(keys[k], n_lines)
+            if mask is not None:
+                return k + 1, mask
+        return 0, np.ones(n_lines, dtype=bool)
+
+    def clean_examples(
+        self,
+        read_input: Callable[[], Iterable[Sequence[bytes]]],
+        n_lines: int,
+        filters_file: Path,
+        input_key: Any,  # noqa: ANN401
+        *,
+        n_workers: int = 1,
+        filter_path: Optional[str] = None,
+        whole_file_filters: Sequence[str] = WHOLE_FILE_FILTERS,
+    ) -> Tuple[int, Iterator[List[bytes]]]:
+        """Return the number of the filters with reused cached decisions and an iterator over the cleaned examples.
+
+        The read_input function must return a new iterator over the n_lines input examples on each call.
+        The decisions of the uncached filters are saved once all examples are cleaned.
+        """
+        names = pipeline_filters(filters_file)
+        n_cacheable = next(
+            (k for k, name in enumerate(names) if is_whole_file_filter(name, whole_file_filters)), len(names)
+        )
+        keys = self.prefix_keys(filters_file, input_key, filter_path)[:n_cacheable]
+        n_cached, mask = self.cached_prefix(keys, n_lines)
+
+        examples = itertools.compress(read_input(), mask)
+        if n_cached < n_cacheable:
+            examples = self._clean_and_save(
+                examples, mask, keys, n_cached, filters_file, n_workers=n_workers, filter_path=filter_path
+            )
+        else:
+            examples = (list(example) for example in examples)
+        if n_cacheable < len(names):
+            examples = clean_examples(
+                examples,
+                filters_file,
+                filter_path=filter_path,
+                whole_file=True,
+                filter_range=(n_cacheable, len(names)),
+            )
+        return n_cached, examples
+
+    def _clean_and_save(
+        self,
+        examples: Iterable[Sequence[bytes]],
+        mask: np.ndarray,
+        keys: Sequence[str],
+        start: int,
+        filters_file: Path,
+        *,
+        n_workers: int,
+        filter_path: Optional[str],
+    ) -> Iterator[List[bytes]]:
+        """Yield the examples (kept by the mask) cleaned by the filters keys[start:], then save their decisions.
+
+        The decisions of a filter are only saved if the filter and the preceding ones kept the lines of all batches
+        intact (see clean_batch_decisions).
+        """
+        decisions: List[List[np.ndarray]] = [[] for _ in keys[start:]]
+        batches = clean_batches(
+            examples, filters_file, n_workers=n_workers, filter_path=filter_path, filter_range=(start, len(keys))
+        )
+        for cleaned, batch_decisions in batches:
+            for filter_decisions, batch_mask in zip(decisions, batch_decisions):
+                filter_decisions.append(batch_mask)
+            del decisions[len(batch_decisions) :]
+            yield from cleaned
+
+        positions = np.flatnonzero(mask)
+        for key, filter_decisions in zip(keys[start:], decisions):
+            filter_mask = np.zeros(len(mask), dtype=bool)
+            filter_mask[positions] = np.concatenate([np.zeros(0, dtype=bool), *filter_decisions])
+            self.save(key, filter_mask)
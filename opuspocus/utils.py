@@ -1,41 +1,162 @@
-import gzip
+import codecs
+import collections
+import contextlib
+import hashlib
+import io
+import json
 import logging
+import os
+import shutil
 import subprocess
 import time
 from pathlib import Path
-from typing import Any, List, TextIO
+from typing import IO, Any, Iterator, List, Optional, Tuple
 
+import numpy as np
 from omegaconf import DictConfig, OmegaConf
 
+from opuspocus.compression import (
+    BGZF_EOF,
+    READ_CHUNK_SIZE,
+    GzipCodec,
+    bgzf_index_path,
+    get_codec_by_path,
+    load_block_index,
+    save_block_index,
+)
+from opuspocus.virtual_files import (
+    is_virtual_file,
+    load_virtual_parts,
+    open_virtual_file,
+    save_virtual_file,
+    virtual_file_is_seekable,
+    virtual_file_path,
+    virtual_file_size,
+)
+
 logger = logging.getLogger(__name__)
 
+COPY_CHUNK_SIZE = 2**30
+
+# UTF-8 continuation bytes (10xxxxxx) after masking with UTF8_CONTINUATION_MASK
+UTF8_CONTINUATION_MASK = 0xC0
+UTF8_CONTINUATION_BITS = 0x80
+
+_WHITESPACE_BYTES = np.array([ord(c) for c in " \t\n\v\f\r"], dtype=np.uint8)
+
+
+def open_file(file: Path, mode: str, compresslevel: Optional[int] = None) -> IO:
+    """Return a correct file handle based on the file suffix.
+
+    The compression codec is determined by the file suffix (.gz, .zst, .lz4, no compression otherwise).
+    The .gz files are written in the BGZF format (blocked gzip) which is readable by any gzip reader but also
+    enables fast random access to the file contents (see open_file_at).
 
-def open_file(file: Path, mode: str) -> TextIO:
-    """Return a correct file handle based on the file suffix."""
-    assert mode in ("r", "w")
-    if file.suffix == ".gz":
-        return gzip.open(file, f"{mode}t")
-    return file.open(f"{mode}t")
+    Text handles only treat "\\n" as the line separator, so the lines match the ones seen by the binary readers
+    (e.g. file_line_index) and by the external tools (Marian, OpusCleaner).
 
+    Virtual files (see opuspocus.virtual_files) are read as a single stream of their concatenated parts.
 
-def file_line_index(file: Path) -> List[int]:
-    """Return a list of beginning of line indices for a given file."""
-    offsets = []
+    Args:
+        file (Path): file location
+        mode (str): one of "r", "w", "rb", "wb"
+        compresslevel (int): compression level of the written file (codec default if None)
+    """
+    assert mode in ("r", "w", "rb", "wb")
+    codec = get_codec_by_path(file)
+    if mode.startswith("w"):
+        fh = codec.open_writer(file, compresslevel)
+    elif is_virtual_file(file):
+        fh = open_virtual_file(file)
+    else:
+        fh = codec.open_reader(file)
+    if mode.endswith("b"):
+        return fh
+    return io.TextIOWrapper(fh, newline="\n")
+
+
+def open_file_at(file: Path, offset: int, mode: str = "r") -> IO:
+    """Open a file for reading, starting at the given (uncompressed) byte offset.
+
+    Seeking in the BGZF-compressed files only requires decompression of a single block. Files compressed by the
+    other codecs are decompressed from the beginning.
+    """
+    assert mode in ("r", "rb")
+    if is_virtual_file(file):
+        fh = open_virtual_file(file, offset)
+    else:
+        fh = get_codec_by_path(file).open_reader_at(file, offset)
+    if mode.endswith("b"):
+        return fh
+    return io.TextIOWrapper(fh, newline="\n")
+
+
+def file_line_index(file: Path, hasher: Optional[Any] = None, *, check_utf8: bool = False) -> np.ndarray:  # noqa: ANN401
+    """Return an array of beginning of line byte offsets for a given file.
+
+    The file is read in binary mode in large chunks and the line beginnings are located using NumPy, therefore,
+    no line decoding is required. If a hashlib hasher is provided, it is updated with the (uncompressed) file
+    contents during the same pass. With check_utf8=True, the contents are also incrementally decoded and
+    a UnicodeDecodeError is raised at the first invalid UTF-8 sequence.
+    """
+    offsets = [np.zeros(1, dtype=np.uint64)]
     offset = 0
-    for line in open_file(file, "r"):
-        offsets.append(offset)
-        # Correctly measure the length of string with unicode characters
-        offset += len(bytes(line, "utf-8"))
+    decoder = codecs.getincrementaldecoder("utf-8")() if check_utf8 else None
+    with open_file(file, "rb") as fh:
+        while True:
+            chunk = fh.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            if hasher is not None:
+                hasher.update(chunk)
+            if decoder is not None:
+                _decode_utf8_chunk(decoder, chunk, offset, file)
+            newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord("\n"))
+            offsets.append(newlines.astype(np.uint64) + np.uint64(offset + 1))
+            offset += len(chunk)
+    if decoder is not None:
+        _decode_utf8_chunk(decoder, b"", offset, file, final=True)
+    if offset == 0:
+        return np.zeros(0, dtype=np.uint64)
+    offsets = np.concatenate(offsets)
+    # The last newline does not indicate the beginning of a new line
+    if offsets[-1] == offset:
+        offsets = offsets[:-1]
     return offsets
 
 
-def read_shard(file: Path, file_line_index: List[int], start: int, shard_size: int) -> List[str]:
+def _decode_utf8_chunk(
+    decoder: codecs.IncrementalDecoder, chunk: bytes, offset: int, file: Path, *, final: bool = False
+) -> None:
+    """Decode the next chunk of a file, reporting the file and the (uncompressed) byte offset of invalid data."""
+    # The decoded data start with the incomplete sequence left over from the previous chunk
+    pending = len(decoder.getstate()[0])
+    try:
+        decoder.decode(chunk, final)
+    except UnicodeDecodeError as err:
+        err.reason = f"{err.reason} (file {file}, byte offset {offset - pending + err.start})"
+        raise
+
+
+def save_line_index(line_index: np.ndarray, index_file: Path) -> None:
+    """Save the line index as a packed little-endian uint64 binary file."""
+    line_index.astype("<u8").tofile(index_file)
+
+
+def load_line_index(index_file: Path) -> np.ndarray:
+    """Memory-map a line index previously saved by save_line_index."""
+    if index_file.stat().st_size == 0:
+        # NumPy cannot memory-map empty files
+        return np.zeros(0, dtype=np.uint64)
+    return np.memmap(index_file, dtype="<u8", mode="r")
+
+
+def read_shard(file: Path, file_line_index: np.ndarray, start: int, shard_size: int) -> List[str]:
     """Read a subset of lines in a file using the line_index."""
     assert shard_size > 0
     assert start >= 0
     lines = []
-    with open_file(file, "r") as fh:
-        fh.seek(file_line_index[start])
+    with open_file_at(file, int(file_line_index[start]), "r") as fh:
         for line in fh:
             lines.append(line)
             shard_size -= 1
@@ -44,71 +165,477 @@ def read_shard(file: Path, file_line_index: List[int], start: int, shard_size: i
     return lines
 
 
+def file_byte_spans(file: Path, n_spans: int, size: Optional[int] = None) -> List[Tuple[int, int]]:
+    """Split a file into (at most) n_spans contiguous (start, end) uncompressed byte ranges of a similar size.
+
+    The span boundaries are aligned to the line beginnings. In the seekable files (plain text, BGZF), only
+    the data around each boundary are read, other files are decompressed in a single pass. No line index is
+    required.
+
+    Args:
+        file (Path): file location
+        n_spans (int): requested number of spans
+        size (int): uncompressed size of the file (computed if None)
+    """
+    assert n_spans > 0
+    if size is None:
+        size = virtual_file_size(file) if is_virtual_file(file) else get_codec_by_path(file).tail(file)[0]
+    if size == 0:
+        return []
+    # The boundary is the beginning of the first line starting at or after the target offset
+    targets = [size * i // n_spans for i in range(1, n_spans)]
+    boundaries = [0]
+    if virtual_file_is_seekable(file) if is_virtual_file(file) else get_codec_by_path(file).is_seekable(file):
+        for target in targets:
+            if target <= boundaries[-1]:
+                continue
+            with open_file_at(file, target - 1, "rb") as fh:
+                boundaries.append(_next_line_offset(fh, target - 1, size))
+    else:
+        pending = collections.deque(targets)
+        offset = 0
+        with open_file(file, "rb") as fh:
+            while pending:
+                chunk = fh.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                while pending and pending[0] - 1 < offset + len(chunk):
+                    pos = chunk.find(b"\n", max(pending[0] - 1 - offset, 0))
+                    if pos == -1:
+                        break
+                    boundaries.append(offset + pos + 1)
+                    while pending and pending[0] <= boundaries[-1]:
+                        pending.popleft()
+                offset += len(chunk)
+    boundaries = sorted({b for b in boundaries if b < size})
+    return list(zip(boundaries, boundaries[1:] + [size]))
+
+
+def file_weighted_spans(
+    file: Path, n_spans: int, weight: str = "chars", size: Optional[int] = None
+) -> List[Tuple[int, int]]:
+    """Split a file into (at most) n_spans contiguous line-aligned byte ranges with a similar total line weight.
+
+    The line weight is either the number of characters ("chars") or the approximate number of tokens, i.e.
+    whitespace-separated words ("tokens"). The file is read in a single pass and the weights are computed
+    using NumPy without decoding the lines.
+
+    To bound the memory usage, only the first line beginning in every size / (64 * n_spans) bytes is considered
+    as a span boundary (if size is provided).
+
+    Args:
+        file (Path): file location
+        n_spans (int): requested number of spans
+        weight (str): line weight, "chars" or "tokens"
+        size (int): uncompressed size of the file (every line beginning is a candidate boundary if None)
+    """
+    assert n_spans > 0
+    assert weight in ("chars", "tokens")
+    stride = 1 if size is None else max(size // (n_spans * 64), 1)
+    last_bucket = 0
+
+    # Candidate boundaries (line beginnings) and the total weight of the preceding lines
+    offsets, weights = [0], [0]
+    offset, total = 0, 0
+    prev_is_space = True
+    with open_file(file, "rb") as fh:
+        while True:
+            chunk = fh.read(READ_CHUNK_SIZE // 4)
+            if not chunk:
+                break
+            data = np.frombuffer(chunk, dtype=np.uint8)
+            is_newline = data == ord("\n")
+            if weight == "chars":
+                # Count the UTF-8 leading bytes, i.e. skip the continuation bytes
+                byte_weights = ((data & UTF8_CONTINUATION_MASK) != UTF8_CONTINUATION_BITS) & ~is_newline
+            else:
+                # Count the beginnings of the whitespace-separated tokens
+                is_space = np.isin(data, _WHITESPACE_BYTES)
+                byte_weights = ~is_space
+                byte_weights[0] &= prev_is_space
+                byte_weights[1:] &= is_space[:-1]
+                prev_is_space = bool(is_space[-1])
+            cum_weights = np.cumsum(byte_weights, dtype=np.uint64)
+
+            line_ends = np.flatnonzero(is_newline)
+            buckets = (line_ends + offset + 1) // stride
+            is_candidate = np.diff(buckets, prepend=last_bucket) != 0
+            if len(buckets):
+                last_bucket = int(buckets[-1])
+            line_ends = line_ends[is_candidate]
+            offsets.extend((line_ends + offset + 1).tolist())
+            weights.extend((cum_weights[line_ends] + np.uint64(total)).tolist())
+
+            total += int(cum_weights[-1])
+            offset += len(chunk)
+    if offset == 0:
+        return []
+    offsets.append(offset)
+    weights.append(total)
+
+    targets = [total * i / n_spans for i in range(1, n_spans)]
+    indices = np.searchsorted(np.array(weights, dtype=np.float64), targets, side="left")
+    boundaries = sorted({0} | {offsets[i] for i in indices.tolist()} - {offset})
+    return list(zip(boundaries, boundaries[1:] + [offset]))
+
+
+def _next_line_offset(fh: IO, offset: int, size: int) -> int:
+    """Return the offset following the first newline at or after the current (offset) position of fh."""
+    while True:
+        chunk = fh.read(READ_CHUNK_SIZE // 64)
+        if not chunk:
+            return size
+        pos = chunk.find(b"\n")
+        if pos != -1:
+            return offset + pos + 1
+        offset += len(chunk)
+
+
+def read_byte_range(file: Path, start: int, end: int) -> List[str]:
+    """Read the lines within the (start, end) uncompressed byte range of a file (see file_byte_spans)."""
+    assert 0 <= start <= end
+    with open_file_at(file, start, "rb") as fh:
+        data = fh.read(end - start)
+    if len(data) != end - start:
+        err_msg = f"Byte range ({start}, {end}) is beyond the end of {file}."
+        raise ValueError(err_msg)
+    return io.StringIO(data.decode("utf-8"), newline="\n").readlines()
+
+
 def decompress_file(input_file: Path, output_file: Path) -> None:
     """Decompress a file."""
-    with gzip.open(input_file, "rt") as in_fh, output_file.open("w") as out_fh:
-        for line in in_fh:
-            print(line, end="", file=out_fh)
+    with open_file(input_file, "rb") as in_fh, output_file.open("wb") as out_fh:
+        shutil.copyfileobj(in_fh, out_fh, READ_CHUNK_SIZE)
+
+
+def _copy_file_contents(in_fh: IO, out_fh: IO) -> None:
+    """Copy the remaining contents of in_fh to out_fh, using an in-kernel copy when available."""
+    if hasattr(os, "copy_file_range"):
+        try:
+            while os.copy_file_range(in_fh.fileno(), out_fh.fileno(), COPY_CHUNK_SIZE):
+                pass
+            return  # noqa: TRY300
+        except OSError:
+            logger.debug("os.copy_file_range failed, falling back to shutil.copyfileobj.")
+    shutil.copyfileobj(in_fh, out_fh, READ_CHUNK_SIZE)
 
 
-def concat_files(input_files: List[Path], output_file: Path) -> None:
-    """Concatenate files from a given list."""
-    with open_file(output_file, "w") as out_fh:
+def concat_files(input_files: List[Path], output_file: Path, compresslevel: Optional[int] = None) -> None:
+    """Concatenate files from a given list.
+
+    When the input files and the output file share the compression codec, the raw (compressed) bytes are copied
+    (concatenated gzip members or zstd/lz4 frames still form a valid file). A newline is added after the inputs
+    that do not end with one. When the codecs differ (or some inputs are virtual files), the inputs are decompressed
+    and re-compressed.
+    """
+    codec = get_codec_by_path(output_file)
+    if all(get_codec_by_path(file) is codec and not is_virtual_file(file) for file in input_files):
+        _concat_files_raw(input_files, output_file)
+        return
+
+    with open_file(output_file, "wb", compresslevel) as out_fh:
+        for input_file in input_files:
+            tail = b""
+            with open_file(input_file, "rb") as in_fh:
+                while True:
+                    chunk = in_fh.read(READ_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    out_fh.write(chunk)
+                    tail = chunk[-1:]
+            if tail not in (b"", b"\n"):
+                out_fh.write(b"\n")
+
+
+def _concat_files_raw(input_files: List[Path], output_file: Path) -> None:
+    """Byte-level concatenation of the files sharing the same compression codec.
+
+    For the gzip output, we also create the block index of the output file by merging the input block indices.
+    The inputs without a block index are represented by a single index entry pointing at their beginning.
+    """
+    codec = get_codec_by_path(output_file)
+    is_bgzf = isinstance(codec, GzipCodec)
+    newline = codec.compress(b"\n")
+    coffsets, uoffsets = [np.zeros(0, dtype=np.uint64)], [np.zeros(0, dtype=np.uint64)]
+    coffset, uoffset = 0, 0
+    with output_file.open("wb", buffering=0) as out_fh:
         for input_file in input_files:
-            with open_file(input_file, "r") as in_fh:
-                for line in in_fh:
-                    print(line, end="", file=out_fh)
+            size, tail = codec.tail(input_file)
+            if size == 0:
+                continue
+            if is_bgzf:
+                block_index = load_block_index(input_file)
+                if block_index is None:
+                    block_index = (np.zeros(1, dtype=np.uint64), np.zeros(1, dtype=np.uint64))
+                coffsets.append(block_index[0] + np.uint64(coffset))
+                uoffsets.append(block_index[1] + np.uint64(uoffset))
+
+            with input_file.open("rb", buffering=0) as in_fh:
+                _copy_file_contents(in_fh, out_fh)
+            coffset += input_file.stat().st_size
+            uoffset += size
+
+            if tail != b"\n":
+                logger.debug("File %s does not end with a newline. Adding newline.", input_file)
+                if is_bgzf:
+                    coffsets.append(np.array([coffset], dtype=np.uint64))
+                    uoffsets.append(np.array([uoffset], dtype=np.uint64))
+                out_fh.write(newline)
+                coffset += len(newline)
+                uoffset += 1
+        if is_bgzf:
+            out_fh.write(BGZF_EOF)
+
+    if is_bgzf:
+        if uoffset == 0:
+            coffsets, uoffsets = [np.zeros(1, dtype=np.uint64)], [np.zeros(1, dtype=np.uint64)]
+        save_block_index(output_file, (np.concatenate(coffsets), np.concatenate(uoffsets)))
+
+
+def link_file(input_file: Path, output_file: Path, compresslevel: Optional[int] = None) -> None:
+    """Hardlink the input file to the output file location.
+
+    If the file suffixes indicate different compression codecs, the input file is re-compressed instead.
+    The BGZF block index is hardlinked together with the gzip files. A virtual input file is linked by creating
+    a virtual output file with the same parts (use materialize_file if a real file is required).
+    """
+    if get_codec_by_path(input_file) is not get_codec_by_path(output_file):
+        concat_files([input_file], output_file, compresslevel)
+        return
+    if is_virtual_file(input_file):
+        save_virtual_file(output_file, [input_file])
+        return
+    output_file.hardlink_to(input_file.resolve())
+    index_file = bgzf_index_path(input_file)
+    if isinstance(get_codec_by_path(input_file), GzipCodec) and index_file.exists():
+        bgzf_index_path(output_file).hardlink_to(index_file.resolve())
+
+
+def materialize_file(file: Path, output_file: Optional[Path] = None, compresslevel: Optional[int] = None) -> Path:
+    """Make the contents of a (possibly virtual) file available as a real file, e.g. for an external tool.
+
+    Without the output_file, a virtual file is replaced by a real file at the same location and a real file is
+    left untouched. Otherwise, the output_file is created (a real input file is only hardlinked, see link_file).
+    Whole member files sharing the output compression codec are concatenated without re-compression.
+
+    Args:
+        file (Path): location of the (virtual) file
+        output_file (Path): location of the created real file (same as file if None)
+        compresslevel (int): compression level of the re-compressed data
+
+    Returns:
+        Location of the real file.
+    """
+    if not is_virtual_file(file):
+        if output_file is not None and output_file != file:
+            link_file(file, output_file, compresslevel)
+            return output_file
+        return file
+    if output_file is None:
+        output_file = file
+
+    # Write into a temporary file with the same suffix first, so the virtual file stays valid if interrupted
+    tmp_file = output_file.with_name(f".tmp.{output_file.name}")
+    parts = load_virtual_parts(file)
+    codec = get_codec_by_path(output_file)
+    member_files = [Path(part["file"]) for part in parts]
+    if all(part["whole"] and get_codec_by_path(member) is codec for part, member in zip(parts, member_files)):
+        _concat_files_raw(member_files, tmp_file)
+    else:
+        with open_virtual_file(file) as in_fh, open_file(tmp_file, "wb", compresslevel) as out_fh:
+            shutil.copyfileobj(in_fh, out_fh, READ_CHUNK_SIZE)
+
+    tmp_file.replace(output_file)
+    tmp_index = bgzf_index_path(tmp_file)
+    if tmp_index.exists():
+        tmp_index.replace(bgzf_index_path(output_file))
+    if output_file == file:
+        virtual_file_path(file).unlink()
+    return output_file
+
+
+def _read_blocks(fh: IO) -> Iterator[bytes]:
+    """Read a binary file handle in large chunks, yielding blocks of complete lines.
+
+    Each yielded block ends with a newline (a newline is added to the unterminated last line of the file).
+    """
+    remainder = b""
+    while True:
+        chunk = fh.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        end = chunk.rfind(b"\n") + 1
+        if end == 0:
+            remainder += chunk
+            continue
+        yield remainder + chunk[:end]
+        remainder = chunk[end:]
+    if remainder:
+        yield remainder + b"\n"
+
+
+def _read_line_blocks(fh: IO) -> Iterator[List[bytes]]:
+    """Read a binary file handle in large chunks, yielding the lists of complete lines (without the newlines)."""
+    for block in _read_blocks(fh):
+        yield block[:-1].split(b"\n")
+
+
+def _check_column_count(rows: List[list], n_columns: int, first_line: int, source: str) -> None:
+    """Raise an error pointing at the first row with an unexpected number of columns (if any)."""
+    for i, row in enumerate(rows):
+        if len(row) != n_columns:
+            err_msg = f"Line {first_line + i} of {source} has {len(row)} columns (expected {n_columns})."
+            raise ValueError(err_msg)
+
+
+def _paste_lines(columns: List[List[bytes]], sep: bytes) -> bytes:
+    """Join the aligned lines of the columns into a block of delimiter-separated rows.
+
+    The cells are joined by newlines in a single call and the newlines inside the rows are replaced by the
+    (single-byte) delimiter using NumPy, avoiding a per-row join.
+    """
+    n_columns = len(columns)
+    cells = [b""] * (len(columns[0]) * n_columns + 1)
+    for i, column in enumerate(columns):
+        cells[i:-1:n_columns] = column
+    block = bytearray(b"\n".join(cells))
+    if n_columns > 1:
+        buffer = np.frombuffer(block, dtype=np.uint8)
+        newlines = np.flatnonzero(buffer == ord("\n")).reshape(-1, n_columns)
+        buffer[newlines[:, :-1]] = ord(sep)
+    return block
+
+
+def _cut_block(block: bytes, n_columns: int, sep: bytes) -> Optional[List[List[bytes]]]:
+    """Split a block of lines into columns without processing the individual lines.
+
+    Returns None if any line of the block does not contain exactly n_columns columns.
+    """
+    buffer = np.frombuffer(block, dtype=np.uint8)
+    separators = buffer[(buffer == ord(sep)) | (buffer == ord("\n"))]
+    if len(separators) % n_columns != 0:
+        return None
+    separators = separators.reshape(-1, n_columns)
+    if not (np.all(separators[:, -1] == ord("\n")) and np.all(separators[:, :-1] == ord(sep))):
+        return None
+    cells = block.replace(sep, b"\n").split(b"\n")
+    n_cells = len(separators) * n_columns
+    return [cells[i:n_cells:n_columns] for i in range(n_columns)]
 
 
 def paste_files(
     input_files: List[Path],
     output_file: Path,
     delimiter: str = "\t",
+    compresslevel: Optional[int] = None,
 ) -> None:
-    """A simplified Unix paste command."""
-    with open_file(output_file, "w") as out_fh:
-        in_fhs = [open_file(input_file, "r") for input_file in input_files]
-        for lines in zip(*in_fhs):
-            lines = [line.rstrip("\n") for line in lines]  # noqa: PLW2901
-            print(delimiter.join(lines), end="\n", file=out_fh)
+    """A simplified Unix paste command.
+
+    The input files are read in large binary blocks and the aligned lines are joined and written one block
+    at a time.
+
+    Raises:
+        ValueError: if the input files have a different number of lines or if they contain the delimiter
+            (the output would have a wrong number of columns)
+    """
+    sep = delimiter.encode("utf-8")
+    n_inputs = len(input_files)
+    with contextlib.ExitStack() as stack:
+        readers = [_read_line_blocks(stack.enter_context(open_file(file, "rb"))) for file in input_files]
+        out_fh = stack.enter_context(open_file(output_file, "wb", compresslevel))
+
+        pending = [[] for _ in input_files]
+        n_lines = 0
+        while True:
+            for i, reader in enumerate(readers):
+                if not pending[i]:
+                    pending[i] = next(reader, [])
+            n_rows = min(len(lines) for lines in pending)
+            if n_rows == 0:
+                break
+
+            columns = [lines[:n_rows] for lines in pending]
+            if len(sep) == 1:
+                block = _paste_lines(columns, sep)
+                if block.count(sep) != n_rows * (n_inputs - 1):
+                    rows = [sep.join(row).split(sep) for row in zip(*columns)]
+                    _check_column_count(rows, n_inputs, n_lines + 1, str(output_file))
+            else:
+                rows = [sep.join(row) for row in zip(*columns)]
+                _check_column_count([row.split(sep) for row in rows], n_inputs, n_lines + 1, str(output_file))
+                block = b"\n".join([*rows, b""])
+            out_fh.write(block)
+
+            pending = [lines[n_rows:] for lines in pending]
+            n_lines += n_rows
+
+        if any(pending):
+            line_counts = [
+                n_lines + len(lines) + sum(len(block) for block in reader) for lines, reader in zip(pending, readers)
+            ]
+            counts_str = ", ".join(f"{file} ({count})" for file, count in zip(input_files, line_counts))
+            err_msg = f"Pasted files have a different number of lines: {counts_str}."
+            raise ValueError(err_msg)
 
 
 def cut_file(
     input_file: Path,
     output_files: List[Path],
     delimiter: str = "\t",
+    compresslevel: Optional[int] = None,
 ) -> None:
     """A simplified Unix cut command."""
-    cut_filestream(
-        input_stream=open_file(input_file, "r"),
-        output_files=output_files,
-        delimiter=delimiter,
-    )
+    with open_file(input_file, "rb") as in_fh:
+        cut_filestream(
+            input_stream=in_fh,
+            output_files=output_files,
+            delimiter=delimiter,
+            compresslevel=compresslevel,
+        )
 
 
 def cut_filestream(
     input_stream,  # noqa: ANN001
     output_files: List[Path],
     delimiter: str = "\t",
+    compresslevel: Optional[int] = None,
 ) -> None:
-    """A simplified Unix cut for processing filestreams."""
-    out_fhs = [open_file(output_file, "w") for output_file in output_files]
-    for line in input_stream:
-        for i, (col, fh) in enumerate(zip(line.split(delimiter), out_fhs)):
-            if i == len(out_fhs) - 1:
-                print(col, end="", file=fh)
-            else:
-                print(col, file=fh)
+    """A simplified Unix cut for processing filestreams.
+
+    The stream is read in large binary blocks, each block is split into columns and the columns are written
+    into the respective output files at once. Each line must contain exactly one column per output file.
+
+    Raises:
+        ValueError: if a line has a different number of columns than the number of the output files
+    """
+    if isinstance(input_stream, io.TextIOBase):
+        input_stream = input_stream.buffer
+    sep = delimiter.encode("utf-8")
+    n_columns = len(output_files)
+    with contextlib.ExitStack() as stack:
+        # The compressed output (e.g. zstd frames) is only finalized when the file handles are closed
+        out_fhs = [stack.enter_context(open_file(output_file, "wb", compresslevel)) for output_file in output_files]
+        n_lines = 0
+        for block in _read_blocks(input_stream):
+            columns = _cut_block(block, n_columns, sep) if len(sep) == 1 else None
+            if columns is None:
+                rows = [line.split(sep) for line in block[:-1].split(b"\n")]
+                _check_column_count(rows, n_columns, n_lines + 1, str(getattr(input_stream, "name", "the stream")))
+                columns = list(zip(*rows))
+            for fh, column in zip(out_fhs, columns):
+                fh.writelines([b"\n".join(column), b"\n"])
+            n_lines += len(columns[0])
 
 
 def save_filestream(
     input_stream,  # noqa: ANN001
     output_file: Path,
+    compresslevel: Optional[int] = None,
 ) -> None:
     """Save a filestream to a file."""
-    out_fh = open_file(output_file, "w")
-    for line in input_stream:
-        print(line, end="", file=out_fh)
+    with open_file(output_file, "w", compresslevel) as out_fh:
+        for line in input_stream:
+            print(line, end="", file=out_fh)
 
 
 def clean_dir(directory: Path, exclude: str = None) -> None:  # noqa: RUF013
@@ -132,10 +659,64 @@ def clean_dir(directory: Path, exclude: str = None) -> None:  # noqa: RUF013
             logger.error("Failed to delete %s. Reason: %s", file_path, err)  # noqa: TRY400
 
 
+def file_sha256(file: Path) -> str:
+    """Return the SHA-256 checksum of the file as stored on the disk (without decompression)."""
+    sha256 = hashlib.sha256()
+    with file.open("rb") as fh:
+        for chunk in iter(lambda: fh.read(READ_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def directory_sha256(directory: Path) -> str:
+    """Return the SHA-256 checksum of the directory contents (relative file paths and file checksums)."""
+    sha256 = hashlib.sha256()
+    for file in sorted(path for path in directory.rglob("*") if path.is_file()):
+        sha256.update(f"{file.relative_to(directory).as_posix()}\0{file_sha256(file)}\n".encode())
+    return sha256.hexdigest()
+
+
+def json_digest(obj: Any) -> str:  # noqa: ANN401
+    """Return the SHA-256 checksum of the (canonical) JSON serialization of an object."""
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def link_tree(src_dir: Path, dst_dir: Path) -> None:
+    """Recreate the file tree of the src_dir at the dst_dir location.
+
+    The files are hardlinked, or copied if they cannot be hardlinked (e.g. the directories are located
+    on different filesystems).
+    """
+    dst_dir.mkdir(parents=True, exist_ok=True)
+    for path in sorted(src_dir.rglob("*")):
+        dst_path = Path(dst_dir, path.relative_to(src_dir))
+        if path.is_dir():
+            dst_path.mkdir(exist_ok=True)
+            continue
+        try:
+            dst_path.hardlink_to(path)
+        except OSError:
+            shutil.copy2(path, dst_path)
+
+
 def count_lines(file_path: Path) -> int:
-    """Return the number of lines in a text file."""
-    with open_file(file_path, "r") as fh:
-        return len(fh.readlines())
+    """Return the number of lines in a text file.
+
+    The file is read in binary chunks, so the lines are neither decoded nor kept in memory. The last line
+    is counted even if it is not terminated by a newline.
+    """
+    n_lines = 0
+    last_byte = b"\n"
+    with open_file(file_path, "rb") as fh:
+        while True:
+            chunk = fh.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            n_lines += chunk.count(b"\n")
+            last_byte = chunk[-1:]
+    if last_byte != b"\n":
+        n_lines += 1
+    return n_lines
 
 
 def subprocess_wait(proc: subprocess.Popen) -> None:
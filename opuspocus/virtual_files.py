@@ -0,0 +1,216 @@
+import io
+import json
+from pathlib import Path
+from typing import List, Sequence, Tuple, Union
+
+from typing_extensions import TypedDict
+
+from opuspocus.compression import get_codec_by_path
+
+# A virtual file is represented by a JSON manifest stored next to the (non-existent) file location
+VIRTUAL_FILE_SUFFIX = ".parts.json"
+VIRTUAL_FILE_VERSION = 1
+
+
+class VirtualPart(TypedDict):
+    file: str
+    start: int
+    end: int
+    newline: bool
+    whole: bool
+    file_bytes: int
+
+
+def virtual_file_path(file: Path) -> Path:
+    """Location of the manifest of a virtual file."""
+    return file.with_name(f"{file.name}{VIRTUAL_FILE_SUFFIX}")
+
+
+def is_virtual_file(file: Path) -> bool:
+    """Whether the file is virtual, i.e. only its manifest exists (a real file always takes precedence)."""
+    return not file.exists() and virtual_file_path(file).exists()
+
+
+def file_exists(file: Path) -> bool:
+    """Whether the file exists either as a real or a virtual file."""
+    return file.exists() or virtual_file_path(file).exists()
+
+
+def stored_file_size(file: Path) -> int:
+    """Size of the file on the disk (size of the manifest of a virtual file)."""
+    if is_virtual_file(file):
+        return virtual_file_path(file).stat().st_size
+    return file.stat().st_size
+
+
+def check_virtual_file(file: Path) -> None:
+    """Raise an error if any member file of a virtual file was modified or removed since the file creation."""
+    for part in load_virtual_parts(file):
+        member_file = Path(part["file"])
+        if not member_file.exists() or member_file.stat().st_size != part["file_bytes"]:
+            err_msg = f"Member file {member_file} of the virtual file {file} was modified or removed."
+            raise FileNotFoundError(err_msg)
+
+
+def save_virtual_file(file: Path, members: Sequence[Union[Path, Tuple[Path, int, int]]]) -> None:
+    """Create a virtual file with the contents of the concatenated member files.
+
+    Similarly to concat_files, a newline is added after the whole member files that do not end with one.
+    A member can also be a (file, start, end) uncompressed byte range, which is expected to be line-aligned
+    (see file_byte_spans). Virtual member files are replaced by their own parts, therefore, every part refers
+    to a real file.
+
+    The members must not be modified or removed while the virtual file is in use (their sizes are checked when
+    the virtual file is opened). The members located in the directory of the virtual file (or its subdirectories)
+    are referenced by relative paths, so the directory can be moved or hardlinked elsewhere as a whole. The other
+    members are referenced by their absolute paths.
+
+    Args:
+        file (Path): location of the virtual file (its manifest is stored at virtual_file_path(file))
+        members (list): the member files or their byte ranges
+    """
+    parts: List[VirtualPart] = []
+    for member in members:
+        if isinstance(member, tuple):
+            member_file, start, end = Path(member[0]), member[1], member[2]
+            if is_virtual_file(member_file):
+                err_msg = f"Byte ranges of a virtual file ({member_file}) cannot be a part of a virtual file."
+                raise ValueError(err_msg)
+            newline, whole = False, False
+        else:
+            member_file = Path(member)
+            if is_virtual_file(member_file):
+                parts.extend(load_virtual_parts(member_file))
+                continue
+            start, (end, tail) = 0, get_codec_by_path(member_file).tail(member_file)
+            newline, whole = tail not in (b"", b"\n"), True
+        if start == end and not newline:
+            continue
+        parts.append(
+            {
+                "file": str(member_file.resolve()),
+                "start": start,
+                "end": end,
+                "newline": newline,
+                "whole": whole,
+                "file_bytes": member_file.stat().st_size,
+            }
+        )
+
+    base_dir = file.parent.resolve()
+    for part in parts:
+        member_file = Path(part["file"])
+        if member_file.is_relative_to(base_dir):
+            part["file"] = member_file.relative_to(base_dir).as_posix()
+
+    if file.exists():
+        file.unlink()
+    manifest_path = virtual_file_path(file)
+    tmp_path = manifest_path.with_name(f".{manifest_path.name}.tmp")
+    with tmp_path.open("w") as fh:
+        json.dump({"version": VIRTUAL_FILE_VERSION, "parts": parts}, fh, indent=2)
+    tmp_path.replace(manifest_path)
+
+
+def load_virtual_parts(file: Path) -> List[VirtualPart]:
+    """Return the list of parts of a virtual file (with the absolute paths of the member files)."""
+    with virtual_file_path(file).open("r") as fh:
+        manifest = json.load(fh)
+    if manifest["version"] != VIRTUAL_FILE_VERSION:
+        err_msg = f"Unsupported version of the virtual file {file} ({manifest['version']})."
+        raise ValueError(err_msg)
+    base_dir = file.parent.resolve()
+    for part in manifest["parts"]:
+        part["file"] = str(Path(base_dir, part["file"]))
+    return manifest["parts"]
+
+
+def is_relocatable_virtual_file(file: Path) -> bool:
+    """Whether all members of a virtual file are referenced relative to its directory (see save_virtual_file)."""
+    base_dir = file.parent.resolve()
+    return all(Path(part["file"]).is_relative_to(base_dir) for part in load_virtual_parts(file))
+
+
+def virtual_file_size(file: Path) -> int:
+    """Return the (uncompressed) size of a virtual file."""
+    return sum(part["end"] - part["start"] + part["newline"] for part in load_virtual_parts(file))
+
+
+def virtual_file_is_seekable(file: Path) -> bool:
+    """Whether any offset of a virtual file can be reached without decompressing the preceding parts."""
+    member_files = [Path(part["file"]) for part in load_virtual_parts(file)]
+    return all(get_codec_by_path(member_file).is_seekable(member_file) for member_file in member_files)
+
+
+class VirtualFileReader(io.RawIOBase):
+    """Read the contents of a virtual file as a single continuous stream.
+
+    Only the part containing the starting offset is (partially) decompressed to reach the offset, and only if
+    its member file is not seekable (see Codec.open_reader_at).
+    """
+
+    def __init__(self, file: Path, offset: int = 0) -> None:
+        super().__init__()
+        self.name = str(file)
+        check_virtual_file(file)
+        self._parts = load_virtual_parts(file)
+
+        self._idx = 0
+        while self._idx < len(self._parts):
+            part_size = self._parts[self._idx]["end"] - self._parts[self._idx]["start"]
+            part_size += self._parts[self._idx]["newline"]
+            if offset < part_size:
+                break
+            offset -= part_size
+            self._idx += 1
+        if self._idx == len(self._parts) and offset > 0:
+            err_msg = f"Offset {offset} is beyond the end of {file}."
+            raise ValueError(err_msg)
+        self._skip = offset
+        self._fh = None
+        self._remaining = 0
+        self._newline = False
+
+    def readable(self) -> bool:
+        return True
+
+    def _open_part(self) -> None:
+        part = self._parts[self._idx]
+        member_file = Path(part["file"])
+        skip = min(self._skip, part["end"] - part["start"])
+        self._fh = get_codec_by_path(member_file).open_reader_at(member_file, part["start"] + skip)
+        self._remaining = part["end"] - part["start"] - skip
+        self._newline = part["newline"]
+        self._skip = 0
+
+    def readinto(self, buffer: bytearray) -> int:
+        while self._idx < len(self._parts):
+            if self._fh is None:
+                self._open_part()
+            if self._remaining > 0:
+                n_bytes = self._fh.readinto(memoryview(buffer)[: min(len(buffer), self._remaining)])
+                if not n_bytes:
+                    member_file = self._parts[self._idx]["file"]
+                    err_msg = f"Member file {member_file} of the virtual file {self.name} is truncated."
+                    raise EOFError(err_msg)
+                self._remaining -= n_bytes
+                return n_bytes
+            if self._newline:
+                buffer[0] = ord("\n")
+                self._newline = False
+                return 1
+            self._fh.close()
+            self._fh = None
+            self._idx += 1
+        return 0
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        super().close()
+
+
+def open_virtual_file(file: Path, offset: int = 0) -> io.BufferedReader:
+    """Open a virtual file for binary reading (starting at the given uncompressed offset)."""
+    return io.BufferedReader(VirtualFileReader(file, offset))
@@ -28,7 +28,7 @@ def init_pipeline(pipeline: OpusPocusPipeline, config: PipelineConfig) -> OpusPo
     elif pipeline.state == PipelineState.INIT_INCOMPLETE:
         logger.info("An existing pipeline's initialization is incomplete. Finishing initialization...")
         pipeline.init()
-    elif config.cli_options.reinit or config.cli_options.reinit_failed:
+    elif config.cli_options.reinit or config.cli_options.reinit_failed or config.cli_options.reinit_incremental:
         logger.info("Re-initializing the pipeline...")
         if pipeline.state in [PipelineState.RUNNING, PipelineState.SUBMITTED]:
             logger.info("Stopping the previous run...")
@@ -36,8 +36,10 @@ def init_pipeline(pipeline: OpusPocusPipeline, config: PipelineConfig) -> OpusPo
             prev_runner.stop_pipeline(pipeline)
             while pipeline.state in [PipelineState.RUNNING, PipelineState.SUBMITTED]:
                 time.sleep(WAIT_TIME)  # wait for state change
-        pipeline.reinit(ignore_finished=config.cli_options.reinit_failed)
-        assert pipeline.state == PipelineState.INITED
+        pipeline.reinit(
+            ignore_finished=config.cli_options.reinit_failed, incremental=config.cli_options.reinit_incremental
+        )
+        assert pipeline.state in [PipelineState.INITED, PipelineState.PARTIALLY_DONE, PipelineState.DONE]
     return pipeline
 
 
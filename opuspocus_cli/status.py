@@ -17,7 +17,7 @@ def main(args: DictConfig) -> int:
     """Command that prints the current status of each pipeline step."""
     config = PipelineConfig.load_from_directory(args.pipeline.pipeline_dir, args)
     pipeline = load_pipeline(config)
-    pipeline.print_status(pipeline.steps)
+    pipeline.print_status(pipeline.steps, verbose=args.cli_options.verbose)
     return 0
 
 
@@ -0,0 +1,298 @@
+import json
+import shutil
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pytest
+
+from opuspocus.pipeline_steps import StepState, build_step
+from opuspocus.pipeline_steps.corpus_step import ParallelCorpus
+from opuspocus.runner_resources import RunnerResources
+from opuspocus.runners.debug import DebugRunner
+from opuspocus.tools import opuscleaner_clean
+from opuspocus.tools.opuscleaner_clean import FilterDecisionCache
+
+MAX_LENGTH = 4
+
+
+def write_filters(raw_step, extra_filters=()):
+    """Create the .filters.json files (removing the long examples) of the raw step datasets."""
+    for dset in raw_step.dataset_list:
+        pipeline = {
+            "version": 1,
+            "files": [f"{dset}.{lang}.gz" for lang in raw_step.languages],
+            "filters": [
+                {
+                    "filter": "max_length",
+                    "parameters": {"MAXLENGTH": str(MAX_LENGTH), "MINLENGTH": "1"},
+                    "language": None,
+                },
+                *extra_filters,
+            ],
+        }
+        with Path(raw_step.output_dir, f"{dset}.filters.json").open("w") as fh:
+            json.dump(pipeline, fh)
+
+
+@pytest.fixture()
+def raw_step_with_filters(train_data_parallel_tiny_raw_step_inited):
+    """Execute the raw step and create the .filters.json files."""
+    raw_step = train_data_parallel_tiny_raw_step_inited
+    DebugRunner("debug", raw_step.pipeline_dir).submit_step(raw_step)
+    write_filters(raw_step)
+    return raw_step
+
+
+def expected_examples(raw_step, dset):
+    """The raw step examples kept by the max_length filter."""
+    examples = list(ParallelCorpus.from_step(raw_step, dset))
+    expected = [ex for ex in examples if all(1 <= len(segment.split()) <= MAX_LENGTH for segment in ex)]
+    assert 0 < len(expected) < len(examples)
+    return expected
+
+
+@pytest.mark.parametrize("n_cpus", [1, 2])
+def test_clean_step_python_backend(n_cpus, raw_step_with_filters, monkeypatch):
+    """The examples are cleaned in batches by the worker processes, the order of the examples is kept."""
+    pytest.importorskip("opuscleaner.clean")
+    monkeypatch.setenv(RunnerResources.get_env_name("cpus"), str(n_cpus))
+    monkeypatch.setattr("opuspocus.tools.opuscleaner_clean.BATCH_LINES", 2)
+    step = build_step(
+        step="clean",
+        step_label=f"clean.{n_cpus}.test",
+        pipeline_dir=raw_step_with_filters.pipeline_dir,
+        **{"prev_corpus_step": raw_step_with_filters, "backend": "python"},
+    )
+    step.init_step()
+    DebugRunner("debug", step.pipeline_dir).submit_step(step)
+    assert step.state == StepState.DONE
+
+    for dset in step.dataset_list:
+        assert list(ParallelCorpus.from_step(step, dset)) == expected_examples(raw_step_with_filters, dset)
+
+
+@pytest.mark.parametrize(("backend", "shard_mode"), [("python", "lines"), ("python", "bytes"), ("subprocess", "lines")])
+def test_clean_step_sharded(backend, shard_mode, raw_step_with_filters):
+    """The dataset shards are cleaned by separate subtasks and merged into the same output as without sharding."""
+    if backend == "python":
+        pytest.importorskip("opuscleaner.clean")
+    elif shutil.which("opuscleaner-clean") is None:
+        pytest.skip("opuscleaner-clean is not available")
+    step = build_step(
+        step="clean",
+        step_label=f"clean.{backend}.{shard_mode}.test",
+        pipeline_dir=raw_step_with_filters.pipeline_dir,
+        **{
+            "prev_corpus_step": raw_step_with_filters,
+            "backend": backend,
+            "shard_size": 2,
+            "shard_mode": shard_mode,
+        },
+    )
+    step.init_step()
+    targets = step.get_command_targets()
+    assert len(targets) > len(step.dataset_list)
+    assert all(target.parent == step.shard_dir for target in targets)
+    DebugRunner("debug", step.pipeline_dir).submit_step(step)
+    assert step.state == StepState.DONE
+
+    for dset in step.dataset_list:
+        assert list(ParallelCorpus.from_step(step, dset)) == expected_examples(raw_step_with_filters, dset)
+
+
+@pytest.mark.parametrize("filter_name", ["bifixer", "custom_dedup"])
+def test_clean_step_whole_file_filters_unsharded(filter_name, train_data_parallel_tiny_raw_step_inited):
+    """The datasets whose pipeline contains a whole-file filter are processed by a single subtask."""
+    raw_step = train_data_parallel_tiny_raw_step_inited
+    DebugRunner("debug", raw_step.pipeline_dir).submit_step(raw_step)
+    write_filters(raw_step, [{"filter": filter_name, "parameters": {}, "language": None}])
+    step = build_step(
+        step="clean",
+        step_label=f"clean.{filter_name}.test",
+        pipeline_dir=raw_step.pipeline_dir,
+        **{"prev_corpus_step": raw_step, "shard_size": 2},
+    )
+    step.init_step()
+    assert all(step.needs_whole_file(dset) for dset in step.dataset_list)
+    assert step.get_command_targets() == [step.dataset_path(dset, step.src_lang) for dset in step.dataset_list]
+
+
+def test_clean_examples_whole_file(tmp_path, monkeypatch):
+    """The whole-file filters see all examples at once, the duplicates across the batches are removed."""
+    pytest.importorskip("opuscleaner.clean")
+    monkeypatch.setattr("opuspocus.tools.opuscleaner_clean.BATCH_LINES", 2)
+    filter_dir = Path(tmp_path, "filters")
+    filter_dir.mkdir()
+    with Path(filter_dir, "awk_dedup.json").open("w") as fh:
+        definition = {"type": "bilingual", "description": "Dedup", "command": "awk '!seen[$0]++'", "parameters": {}}
+        json.dump(definition, fh)
+    filters_file = Path(tmp_path, "test.filters.json")
+    with filters_file.open("w") as fh:
+        pipeline = {
+            "version": 1,
+            "files": ["test.en.gz", "test.fr.gz"],
+            "filters": [{"filter": "awk_dedup", "parameters": {}, "language": None}],
+        }
+        json.dump(pipeline, fh)
+
+    examples = [[b"a", b"x"], [b"b", b"y"], [b"a", b"x"], [b"c", b"z"], [b"b", b"y"]]
+    filter_path = str(Path(filter_dir, "*.json"))
+    cleaned = opuscleaner_clean.clean_examples(examples, filters_file, filter_path=filter_path, whole_file=True)
+    assert list(cleaned) == [[b"a", b"x"], [b"b", b"y"], [b"c", b"z"]]
+
+
+@pytest.fixture()
+def filter_ranges(monkeypatch):
+    """Record the filter ranges run with the filter decisions (see opuscleaner_clean.clean_batches)."""
+    ranges = []
+    clean_batches = opuscleaner_clean.clean_batches
+
+    def clean_batches_logged(
+        examples: Iterable[Sequence[bytes]],
+        filters_file: Path,
+        *,
+        n_workers: int,
+        filter_path: Optional[str],
+        filter_range: Tuple[int, int],
+    ) -> Iterator[Tuple[List[List[bytes]], List[np.ndarray]]]:
+        ranges.append(filter_range)
+        return clean_batches(
+            examples, filters_file, n_workers=n_workers, filter_path=filter_path, filter_range=filter_range
+        )
+
+    monkeypatch.setattr("opuspocus.tools.opuscleaner_clean.clean_batches", clean_batches_logged)
+    return ranges
+
+
+@pytest.mark.parametrize("n_cpus", [1, 2])
+def test_clean_step_filter_cache(n_cpus, raw_step_with_filters, filter_ranges, tmp_path, monkeypatch):
+    """The rerun with an extended pipeline only runs the new filter."""
+    pytest.importorskip("opuscleaner.clean")
+    monkeypatch.setenv(RunnerResources.get_env_name("cpus"), str(n_cpus))
+    step_args = {"prev_corpus_step": raw_step_with_filters, "filter_cache_dir": tmp_path, "shard_size": 2}
+    step = build_step(
+        step="clean", step_label="clean.cache.test", pipeline_dir=raw_step_with_filters.pipeline_dir, **step_args
+    )
+    step.init_step()
+    DebugRunner("debug", step.pipeline_dir).submit_step(step)
+    assert step.state == StepState.DONE
+    assert list(tmp_path.rglob("*.bits"))
+    assert filter_ranges
+    assert all(filter_range == (0, 1) for filter_range in filter_ranges)
+
+    shorter_length = MAX_LENGTH - 1
+    shorter = {"filter": "max_length", "parameters": {"MAXLENGTH": str(shorter_length), "MINLENGTH": "1"}}
+    write_filters(raw_step_with_filters, [{**shorter, "language": None}])
+    filter_ranges.clear()
+    step = build_step(
+        step="clean", step_label="clean.cache.rerun.test", pipeline_dir=raw_step_with_filters.pipeline_dir, **step_args
+    )
+    step.init_step()
+    DebugRunner("debug", step.pipeline_dir).submit_step(step)
+    assert step.state == StepState.DONE
+    assert filter_ranges
+    assert all(filter_range == (1, 2) for filter_range in filter_ranges)
+    for dset in step.dataset_list:
+        expected = expected_examples(raw_step_with_filters, dset)
+        expected = [ex for ex in expected if all(len(segment.split()) <= shorter_length for segment in ex)]
+        assert list(ParallelCorpus.from_step(step, dset)) == expected
+
+
+def test_clean_step_filter_cache_opt_in(raw_step_with_filters):
+    """The filter decisions are only cached with the filter_cache_dir set."""
+    step = build_step(
+        step="clean",
+        step_label="clean.nocache.test",
+        pipeline_dir=raw_step_with_filters.pipeline_dir,
+        **{"prev_corpus_step": raw_step_with_filters, "cache_dir": Path(raw_step_with_filters.pipeline_dir, "cache")},
+    )
+    assert step.filter_decision_cache is None
+
+
+def test_filter_versions(tmp_path):
+    """The filter version changes with the filter definition and with the scripts called by its command."""
+    pytest.importorskip("opuscleaner.filters")
+    script = Path(tmp_path, "noop.py")
+    script.write_text("print('noop')\n")
+    definition = {"type": "bilingual", "description": "Noop", "command": "./noop.py $ARG", "parameters": {}}
+    with Path(tmp_path, "noop.json").open("w") as fh:
+        json.dump(definition, fh)
+    filter_path = str(Path(tmp_path, "*.json"))
+
+    version = opuscleaner_clean.filter_versions(["noop"], filter_path)["noop"]
+    assert opuscleaner_clean.filter_versions(["noop", "missing"], filter_path) == {"noop": version}
+    script.write_text("print('modified')\n")
+    assert opuscleaner_clean.filter_versions(["noop"], filter_path)["noop"] != version
+
+
+# Filters of the mocked OpusCleaner pipeline (see test_filter_decision_cache)
+MAX_SHORT_LENGTH = 2
+MOCK_FILTERS = {
+    "short": lambda ex: ex if len(ex[0].split()) <= MAX_SHORT_LENGTH else None,
+    "nonempty": lambda ex: ex if all(ex) else None,
+    "upper": lambda ex: [segment.upper() for segment in ex],
+    # Rewrites an example into a copy of a following one, which it drops
+    "merge": lambda ex: {b"c": [b"d", b"z"], b"d": None}.get(ex[0], ex),
+}
+
+
+def mock_load_pipeline(filters_file: Path, _filter_path: Optional[str], filter_range: Tuple[int, int]) -> List[str]:
+    """Load the names of the filter_range filters instead of the OpusCleaner pipeline."""
+    return opuscleaner_clean.pipeline_filters(filters_file)[slice(*filter_range)]
+
+
+def mock_run_pipeline(pipeline: List[str], batch: bytes) -> bytes:
+    """Run the MOCK_FILTERS named by the pipeline over the batch."""
+    output = []
+    for line in batch.splitlines():
+        example = line.split(b"\t")
+        for name in pipeline:
+            example = MOCK_FILTERS[name](example)
+            if example is None:
+                break
+        else:
+            output.append(b"\t".join(example) + b"\n")
+    return b"".join(output)
+
+
+def mock_filter_versions(names: Iterable[str], _filter_path: Optional[str]) -> Dict[str, str]:
+    """Use the filter names as their versions."""
+    return {name: name for name in names}
+
+
+def test_filter_decision_cache(filter_ranges, tmp_path, monkeypatch):
+    """The decisions of the longest cached pipeline prefix are reused, the lines modified by a filter are not cached."""
+    monkeypatch.setattr("opuspocus.tools.opuscleaner_clean.check_available", lambda: None)
+    monkeypatch.setattr("opuspocus.tools.opuscleaner_clean.load_pipeline", mock_load_pipeline)
+    monkeypatch.setattr("opuspocus.tools.opuscleaner_clean._run_pipeline", mock_run_pipeline)
+    monkeypatch.setattr("opuspocus.tools.opuscleaner_clean.filter_versions", mock_filter_versions)
+    monkeypatch.setattr("opuspocus.tools.opuscleaner_clean.BATCH_LINES", 2)
+    examples = [[b"a b", b"x"], [b"a b c", b"y"], [b"c", b""], [b"d", b"z"]]
+    cache = FilterDecisionCache(cache_dir=Path(tmp_path, "cache"))
+    filters_file = Path(tmp_path, "test.filters.json")
+
+    def run(names: List[str]) -> Tuple[int, List[List[bytes]]]:
+        with filters_file.open("w") as fh:
+            pipeline = {"version": 1, "files": ["test.en.gz", "test.fr.gz"], "filters": [{"filter": n} for n in names]}
+            json.dump(pipeline, fh)
+        filter_ranges.clear()
+        n_cached, cleaned = cache.clean_examples(lambda: iter(examples), len(examples), filters_file, "test")
+        return n_cached, list(cleaned)
+
+    assert run(["short", "nonempty"]) == (0, [[b"a b", b"x"], [b"d", b"z"]])
+    assert filter_ranges == [(0, 2)]
+    assert run(["short", "nonempty"]) == (2, [[b"a b", b"x"], [b"d", b"z"]])
+    assert filter_ranges == []
+    assert run(["short", "nonempty", "upper"]) == (2, [[b"A B", b"X"], [b"D", b"Z"]])
+    assert filter_ranges == [(2, 3)]
+    # "upper" modifies the lines, the following filters are run over its output without caching
+    assert run(["short", "upper", "nonempty"]) == (1, [[b"A B", b"X"], [b"D", b"Z"]])
+    assert filter_ranges == [(1, 3)]
+    assert run(["short", "upper", "nonempty"]) == (1, [[b"A B", b"X"], [b"D", b"Z"]])
+    assert filter_ranges == [(1, 3)]
+    # The output of "merge" is a subsequence of its input, but the line "c" was modified, not dropped
+    assert run(["merge", "short"]) == (0, [[b"a b", b"x"], [b"d", b"z"]])
+    assert filter_ranges == [(0, 2)]
+    assert run(["merge", "short"]) == (0, [[b"a b", b"x"], [b"d", b"z"]])
+    assert filter_ranges == [(0, 2)]
@@ -1,3 +1,5 @@
+import hashlib
+import shutil
 from pathlib import Path
 from typing import List
 
@@ -6,9 +8,15 @@ from attrs import define, field
 
 from opuspocus import pipeline_steps
 from opuspocus.pipeline_steps import StepState, build_step, register_step
-from opuspocus.pipeline_steps.corpus_step import CorpusStep
+from opuspocus.pipeline_steps.corpus_step import (
+    CorpusStep,
+    CorpusValidationError,
+    ParallelCorpus,
+    ParallelCorpusWriter,
+)
 from opuspocus.runners.debug import DebugRunner
-from opuspocus.utils import count_lines, open_file, read_shard
+from opuspocus.utils import count_lines, open_file
+from opuspocus.virtual_files import is_virtual_file, virtual_file_path
 
 # TODO(varisd): test categories.json load/save
 # TODO(varisd): stuff related to the abstract methods (e.g. creating
@@ -63,23 +71,15 @@ class FooCorpusStep(CorpusStep):
 
     def command(self, target_file: Path) -> None:
         """Process command, either normally or using the file shards."""
-        target_filename_stem_split = target_file.stem.split(".")
-        if target_filename_stem_split[-2] == "gz":
+        if target_file.parent == self.shard_dir:
             assert self.prev_corpus_step is not None
-            with open_file(target_file, "w") as fh:
-                idx = int(target_filename_stem_split[-1])
-                input_filename = ".".join(target_filename_stem_split[:-1])
-                shard_lines = read_shard(
-                    Path(self.input_dir, input_filename),
-                    self.prev_corpus_step.line_index_dict[input_filename],
-                    idx * self.shard_size,
-                    self.shard_size,
-                )
-                for line in shard_lines:
+            with open_file(target_file, "w", self.compression_level) as fh:
+                filename, idx = self.parse_dataset_shard_path(target_file)
+                for line in self.read_shard_input(filename, idx):
                     print(line, end="", file=fh)
         else:
             assert self.dataset_files is not None
-            lang = target_filename_stem_split[-1]
+            _, lang = self.parse_dataset_filename(target_file.name)
             src_files = self.dataset_files
             if lang == src_files[0].stem.split(".")[-1]:
                 target_file.hardlink_to(src_files[0])
@@ -313,3 +313,506 @@ def test_dataset_filename_list_len(corpus_step_done):
     n_langs = len(corpus_step_done.languages)
     list_length = len(corpus_step_done.dataset_filename_list)
     assert n_dsets * n_langs == list_length
+
+
+def test_corpus_step_done_line_index(corpus_step_done):
+    """Test whether the line index files were created and are correct."""
+    for f_name in corpus_step_done.dataset_filename_list:
+        assert corpus_step_done.line_index_path(f_name).exists()
+        file_path = Path(corpus_step_done.output_dir, f_name)
+        assert len(corpus_step_done.line_index_dict[f_name]) == count_lines(file_path)
+
+
+def test_corpus_step_done_manifest(corpus_step_done):
+    """Test whether the manifest describes the output dataset files."""
+    assert corpus_step_done.manifest_path.exists()
+    manifest = corpus_step_done.manifest
+    assert sorted(manifest["datasets"]) == sorted(corpus_step_done.dataset_list)
+    for f_name in corpus_step_done.dataset_filename_list:
+        file_path = Path(corpus_step_done.output_dir, f_name)
+        entry = corpus_step_done.dataset_manifest_entry(f_name)
+        with open_file(file_path, "rb") as fh:
+            content = fh.read()
+        assert entry["file"] == f_name
+        assert entry["lines"] == corpus_step_done.dataset_line_count(f_name) == count_lines(file_path)
+        assert entry["bytes"] == len(content)
+        assert entry["file_bytes"] == file_path.stat().st_size
+        assert entry["compression"] == corpus_step_done.compression
+        assert entry["sha256"] == hashlib.sha256(content).hexdigest()
+
+
+def test_corpus_step_manifest_created_on_access(corpus_step_done):
+    """The manifest of a finished step is created if missing."""
+    corpus_step_done.manifest_path.unlink()
+    corpus_step_done._json_cache.clear()  # noqa: SLF001
+    assert sorted(corpus_step_done.manifest["datasets"]) == sorted(corpus_step_done.dataset_list)
+    assert corpus_step_done.manifest_path.exists()
+
+
+def _rewrite_dataset_file(step: CorpusStep, filename: str, content: bytes) -> Path:
+    """Replace the dataset file (possibly a hardlink to the test data) with the given contents."""
+    file_path = Path(step.output_dir, filename)
+    file_path.unlink()
+    with open_file(file_path, "wb") as fh:
+        fh.write(content)
+    return file_path
+
+
+def test_corpus_step_validation_line_parity(corpus_step_done):
+    """Bilingual dataset files with a different number of lines must be reported."""
+    if len(corpus_step_done.languages) == N_LANGUAGES_MONO:
+        pytest.skip("Line parity only applies to bilingual corpora.")
+    f_name = corpus_step_done.dataset_filename_list[-1]
+    with open_file(Path(corpus_step_done.output_dir, f_name), "rb") as fh:
+        lines = fh.readlines()
+    _rewrite_dataset_file(corpus_step_done, f_name, b"".join(lines[:-1]))
+    with pytest.raises(CorpusValidationError, match="different number of lines"):
+        corpus_step_done.build_manifest()
+
+
+def test_corpus_step_validation_truncated(corpus_step_done):
+    """Truncated compressed dataset files must be reported."""
+    f_name = corpus_step_done.dataset_filename_list[0]
+    file_path = Path(corpus_step_done.output_dir, f_name)
+    content = file_path.read_bytes()
+    file_path.unlink()
+    file_path.write_bytes(content[:-5])
+    with pytest.raises(CorpusValidationError, match="truncated or corrupted"):
+        corpus_step_done.build_manifest()
+
+
+def test_corpus_step_validation_utf8(corpus_step_done):
+    """Invalid UTF-8 is only reported with validate_utf8 enabled."""
+    for f_name in corpus_step_done.dataset_filename_list:
+        _rewrite_dataset_file(corpus_step_done, f_name, b"a\n\xc3(\n")
+    corpus_step_done.build_manifest()
+    corpus_step_done.validate_utf8 = True
+    with pytest.raises(CorpusValidationError, match="byte offset 2"):
+        corpus_step_done.build_manifest()
+
+
+def test_corpus_step_preflight_check(corpus_step_done):
+    """The preflight check detects the dataset files modified after the step finished."""
+    corpus_step_done.preflight_check()
+    corpus_step_done.preflight_check(corpus_step_done.dataset_list)
+    with pytest.raises(CorpusValidationError, match="not listed"):
+        corpus_step_done.preflight_check(["unknown.dataset"])
+    _rewrite_dataset_file(corpus_step_done, corpus_step_done.dataset_filename_list[0], b"a\n")
+    with pytest.raises(CorpusValidationError, match="was modified"):
+        corpus_step_done.preflight_check()
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip", "zstd", "lz4"])
+def test_corpus_step_compression(compression, foo_corpus_step_inited):
+    """Test a (sharded) step with a different compression codec than its prev_corpus_step."""
+    if compression in ("zstd", "lz4"):
+        pytest.importorskip({"zstd": "zstandard", "lz4": "lz4"}[compression])
+    runner = DebugRunner("debug", foo_corpus_step_inited.pipeline_dir)
+    runner.submit_step(foo_corpus_step_inited)
+
+    step = build_step(
+        step="foo_corpus",
+        step_label=f"{compression}.test",
+        pipeline_dir=foo_corpus_step_inited.pipeline_dir,
+        **{
+            "dataset_files": None,
+            "src_lang": foo_corpus_step_inited.src_lang,
+            "tgt_lang": foo_corpus_step_inited.tgt_lang,
+            "prev_corpus_step": foo_corpus_step_inited,
+            "shard_size": 3,
+            "compression": compression,
+            "compression_level": None if compression == "none" else 1,
+        },
+    )
+    step.init_step()
+    runner.submit_step(step)
+    assert step.state == StepState.DONE
+
+    for dset in step.dataset_list:
+        for lang in step.languages:
+            assert step.dataset_filename(dset, lang) in step.dataset_filename_list
+            assert step.parse_dataset_filename(step.dataset_filename(dset, lang)) == (dset, lang)
+            with open_file(step.dataset_path(dset, lang), "r") as fh_hyp, open_file(
+                foo_corpus_step_inited.dataset_path(dset, lang), "r"
+            ) as fh_ref:
+                assert fh_hyp.readlines() == fh_ref.readlines()
+
+
+@pytest.mark.parametrize("shard_mode", ["bytes", "chars", "tokens"])
+@pytest.mark.parametrize("shard_size", [1, 2, 1000])
+def test_corpus_step_byte_shards(shard_mode, shard_size, foo_corpus_step_inited):
+    """Byte-range shards (planned in the main task preprocessing) must reproduce the input datasets."""
+    runner = DebugRunner("debug", foo_corpus_step_inited.pipeline_dir)
+    runner.submit_step(foo_corpus_step_inited)
+
+    step = build_step(
+        step="foo_corpus",
+        step_label="bytes.test",
+        pipeline_dir=foo_corpus_step_inited.pipeline_dir,
+        **{
+            "dataset_files": None,
+            "prev_corpus_step": foo_corpus_step_inited,
+            "shard_size": shard_size,
+            "shard_mode": shard_mode,
+        },
+    )
+    step.init_step()
+    runner.submit_step(step)
+    assert step.state == StepState.DONE
+    assert step.shard_plan_path.exists()
+
+    for f_name in step.dataset_filename_list:
+        spans = step.shard_plan["datasets"][f_name]
+        assert 1 <= len(spans) <= foo_corpus_step_inited.dataset_line_count(f_name)
+        assert len(step.infer_dataset_output_shard_path_list(f_name)) == len(spans)
+        with open_file(Path(step.output_dir, f_name), "r") as fh_hyp, open_file(
+            Path(foo_corpus_step_inited.output_dir, f_name), "r"
+        ) as fh_ref:
+            assert fh_hyp.readlines() == fh_ref.readlines()
+
+
+@pytest.mark.parametrize("shard_mode", ["lines", "bytes"])
+def test_corpus_step_auto_shards(shard_mode, foo_corpus_step_inited):
+    """Automatically sized shards must reproduce the input datasets and record the step throughput."""
+    runner = DebugRunner("debug", foo_corpus_step_inited.pipeline_dir)
+    runner.submit_step(foo_corpus_step_inited)
+
+    step = build_step(
+        step="foo_corpus",
+        step_label="auto.test",
+        pipeline_dir=foo_corpus_step_inited.pipeline_dir,
+        **{
+            "dataset_files": None,
+            "prev_corpus_step": foo_corpus_step_inited,
+            "shard_size": "auto",
+            "shard_mode": shard_mode,
+        },
+    )
+    step.init_step()
+    runner.submit_step(step)
+    assert step.state == StepState.DONE
+
+    for f_name in step.dataset_filename_list:
+        assert len(step.shard_plan["datasets"][f_name]) == 1
+        with open_file(Path(step.output_dir, f_name), "r") as fh_hyp, open_file(
+            Path(foo_corpus_step_inited.output_dir, f_name), "r"
+        ) as fh_ref:
+            assert fh_hyp.readlines() == fh_ref.readlines()
+    assert step.shard_throughput is not None
+
+
+def test_corpus_step_infer_n_shards_auto(foo_corpus_step_inited):
+    """The automatic shard count follows the measured throughput and the runner parallelism."""
+    step = build_step(
+        step="foo_corpus",
+        step_label="auto.test",
+        pipeline_dir=foo_corpus_step_inited.pipeline_dir,
+        **{
+            "dataset_files": None,
+            "prev_corpus_step": foo_corpus_step_inited,
+            "shard_size": "auto",
+            "shard_target_seconds": 100,
+        },
+    )
+    line_counts = {"large": 400000, "small": 100000, "tiny": 10}
+
+    class ParallelRunner:
+        def max_parallel_tasks(self, step) -> int:  # noqa: ARG002
+            return 8
+
+    assert step.infer_n_shards(line_counts) == {"large": 4, "small": 1, "tiny": 1}
+    assert step.infer_n_shards(line_counts, ParallelRunner()) == {"large": 6, "small": 1, "tiny": 1}
+
+    lines_per_second = 1000.0
+    step._save_json({"foo_corpus": {"lines": 1000, "seconds": 1.0}}, step.shard_throughput_path)  # noqa: SLF001
+    assert step.shard_throughput == lines_per_second
+    assert step.infer_n_shards(line_counts) == {"large": 4, "small": 1, "tiny": 1}
+    step.shard_target_seconds = 10
+    assert step.infer_n_shards(line_counts) == {"large": 40, "small": 10, "tiny": 1}
+
+
+@pytest.mark.parametrize("shard_size", [0, -1, "10", 1.5])
+def test_corpus_step_shard_size_invalid_fail(shard_size, foo_corpus_step_inited):
+    """Only positive integers, "auto" and None are valid shard sizes."""
+    with pytest.raises(ValueError, match="shard_size"):
+        build_step(
+            step="foo_corpus",
+            step_label="invalid.test",
+            pipeline_dir=foo_corpus_step_inited.pipeline_dir,
+            **{"dataset_files": None, "prev_corpus_step": foo_corpus_step_inited, "shard_size": shard_size},
+        )
+
+
+@pytest.mark.parametrize("resubmit_finished", [True, False])
+def test_corpus_step_resubmit_keeps_finished_shards(resubmit_finished, foo_corpus_step_inited):
+    """Only the shards without the completion marker are reprocessed, unless resubmitting the finished ones."""
+    runner = DebugRunner("debug", foo_corpus_step_inited.pipeline_dir)
+    runner.submit_step(foo_corpus_step_inited)
+
+    step = build_step(
+        step="foo_corpus",
+        step_label="resubmit.test",
+        pipeline_dir=foo_corpus_step_inited.pipeline_dir,
+        **{"dataset_files": None, "prev_corpus_step": foo_corpus_step_inited, "shard_size": 2},
+    )
+    step.init_step()
+    step.state = StepState.FAILED
+
+    f_name = step.dataset_filename_list[0]
+    finished_shard, unfinished_shard = step.infer_dataset_output_shard_path_list(f_name)[:2]
+    step.shard_dir.mkdir()
+    for shard in [finished_shard, unfinished_shard]:
+        with open_file(shard, "w") as fh:
+            print("FAILED\nFAILED", file=fh)
+    step.shard_done_path(finished_shard).touch()
+    assert step.is_command_target_finished(finished_shard)
+    assert not step.is_command_target_finished(unfinished_shard)
+
+    runner.submit_step(step, resubmit_finished_subtasks=resubmit_finished)
+    assert step.state == StepState.DONE
+    assert not step.shard_dir.exists()
+
+    with open_file(Path(foo_corpus_step_inited.output_dir, f_name), "r") as fh:
+        ref_lines = fh.readlines()
+    with open_file(Path(step.output_dir, f_name), "r") as fh:
+        hyp_lines = fh.readlines()
+    if resubmit_finished:
+        assert hyp_lines == ref_lines
+    else:
+        assert hyp_lines == ["FAILED\n", "FAILED\n", *ref_lines[2:]]
+
+
+@pytest.mark.parametrize("shard_mode", ["lines", "bytes"])
+def test_corpus_step_virtual_datasets(shard_mode, foo_corpus_step_inited):
+    """Sharded outputs are virtual datasets listing the shards, which can be sharded by the following steps."""
+    runner = DebugRunner("debug", foo_corpus_step_inited.pipeline_dir)
+    runner.submit_step(foo_corpus_step_inited)
+
+    virtual_step = build_step(
+        step="foo_corpus",
+        step_label="virtual.test",
+        pipeline_dir=foo_corpus_step_inited.pipeline_dir,
+        **{
+            "dataset_files": None,
+            "prev_corpus_step": foo_corpus_step_inited,
+            "shard_size": 2,
+            "virtual_datasets": True,
+        },
+    )
+    step = build_step(
+        step="foo_corpus",
+        step_label="real.test",
+        pipeline_dir=foo_corpus_step_inited.pipeline_dir,
+        **{
+            "dataset_files": None,
+            "prev_corpus_step": virtual_step,
+            "shard_size": 1,
+            "shard_mode": shard_mode,
+            "virtual_datasets": False,
+        },
+    )
+    step.init_step()
+    runner.submit_step(step)
+    assert virtual_step.state == StepState.DONE
+    assert step.state == StepState.DONE
+    virtual_step.preflight_check()
+
+    for f_name in virtual_step.dataset_filename_list:
+        assert is_virtual_file(Path(virtual_step.output_dir, f_name))
+        assert not is_virtual_file(Path(step.output_dir, f_name))
+        with open_file(Path(foo_corpus_step_inited.output_dir, f_name), "r") as fh:
+            ref_lines = fh.readlines()
+        for corpus_step in [virtual_step, step]:
+            with open_file(Path(corpus_step.output_dir, f_name), "r") as fh:
+                assert fh.readlines() == ref_lines
+
+
+@pytest.mark.parametrize("virtual_datasets", [False, True])
+def test_corpus_step_reinit_incremental(virtual_datasets, train_data_parallel_tiny, languages, tmp_path_factory):
+    """Incremental re-initialization keeps the unchanged datasets and only processes the new or changed ones."""
+    raw_data_dir = tmp_path_factory.mktemp("raw_data")
+    for dset in ["a", "b"]:
+        for file, lang in zip(train_data_parallel_tiny, languages):
+            shutil.copy(file, Path(raw_data_dir, f"{dset}.{lang}.gz"))
+    pipeline_dir = tmp_path_factory.mktemp("incremental.pipeline")
+
+    def build_steps() -> List[CorpusStep]:
+        pipeline_steps.STEP_INSTANCE_REGISTRY = {}
+        raw_step = build_step(
+            step="raw",
+            step_label="raw.test",
+            pipeline_dir=pipeline_dir,
+            **{"raw_data_dir": raw_data_dir, "src_lang": languages[0], "tgt_lang": languages[1]},
+        )
+        step = build_step(
+            step="foo_corpus",
+            step_label="foo.test",
+            pipeline_dir=pipeline_dir,
+            **{
+                "dataset_files": None,
+                "prev_corpus_step": raw_step,
+                "shard_size": 2,
+                "virtual_datasets": virtual_datasets,
+            },
+        )
+        return [raw_step, step]
+
+    raw_step, step = build_steps()
+    step.init_step()
+    runner = DebugRunner("debug", pipeline_dir)
+    runner.submit_step(step)
+    assert step.state == StepState.DONE
+
+    def stored_path(f_name: str) -> Path:
+        output_path = Path(step.output_dir, f_name)
+        return virtual_file_path(output_path) if virtual_datasets else output_path
+
+    kept_inodes = {f_name: stored_path(f_name).stat().st_ino for f_name in step.dataset_filename_list}
+    kept_manifest = step.manifest["datasets"]["a"]
+
+    # Nothing changed
+    for s in build_steps():
+        s.reinit_incremental()
+        assert s.state == StepState.DONE
+
+    # Modify one dataset and add a new one
+    for file, lang in zip(train_data_parallel_tiny, languages):
+        shutil.copy(file, Path(raw_data_dir, f"c.{lang}.gz"))
+        with open_file(Path(raw_data_dir, f"b.{lang}.gz"), "w") as fh:
+            print(f"changed {lang}", file=fh)
+
+    for s in build_steps():
+        s.reinit_incremental()
+        assert s.state == StepState.INITED
+    raw_step, step = build_steps()
+    assert sorted(step.dataset_list) == ["a", "b", "c"]
+    assert sorted(step.dataset_fingerprints) == ["a", "b", "c"]
+    assert not Path(step.output_dir, step.dataset_filename("b", languages[0])).exists()
+
+    runner.submit_step(step)
+    assert step.state == StepState.DONE
+    step.preflight_check()
+    assert step.manifest["datasets"]["a"] == kept_manifest
+    for f_name in step.dataset_filename_list:
+        output_path = Path(step.output_dir, f_name)
+        if f_name.startswith("a."):
+            assert stored_path(f_name).stat().st_ino == kept_inodes[f_name]
+        if virtual_datasets:
+            assert is_virtual_file(output_path)
+        with open_file(output_path, "r") as fh_hyp, open_file(Path(raw_step.output_dir, f_name), "r") as fh_ref:
+            assert fh_hyp.readlines() == fh_ref.readlines()
+
+
+@pytest.mark.parametrize("virtual_datasets", [False, True])
+def test_corpus_step_cache(virtual_datasets, train_data_parallel_tiny, languages, tmp_path_factory):
+    """Identical steps of a different pipeline are restored from the shared cache_dir without being executed."""
+    cache_dir = tmp_path_factory.mktemp("step_cache")
+
+    def build_steps(pipeline_dir: Path) -> List[CorpusStep]:
+        pipeline_steps.STEP_INSTANCE_REGISTRY = {}
+        foo_step = build_step(
+            step="foo_corpus",
+            step_label="foo.test",
+            pipeline_dir=pipeline_dir,
+            **{
+                "dataset_files": train_data_parallel_tiny,
+                "src_lang": languages[0],
+                "tgt_lang": languages[1],
+                "cache_dir": cache_dir,
+            },
+        )
+        step = build_step(
+            step="foo_corpus",
+            step_label="bar.test",
+            pipeline_dir=pipeline_dir,
+            **{
+                "dataset_files": None,
+                "prev_corpus_step": foo_step,
+                "shard_size": 2,
+                "virtual_datasets": virtual_datasets,
+                "cache_dir": cache_dir,
+            },
+        )
+        return [foo_step, step]
+
+    first_dir = tmp_path_factory.mktemp("first.pipeline")
+    _, first_step = build_steps(first_dir)
+    first_step.init_step()
+    assert first_step.state == StepState.INITED
+    DebugRunner("debug", first_dir).submit_step(first_step)
+    assert first_step.state == StepState.DONE
+    n_cached_steps = 2
+    assert len([path for path in cache_dir.iterdir() if not path.name.startswith(".")]) == n_cached_steps
+
+    # The steps of the second pipeline are restored during the initialization
+    second_dir = tmp_path_factory.mktemp("second.pipeline")
+    second_steps = build_steps(second_dir)
+    second_steps[1].init_step()
+    for step in second_steps:
+        assert step.state == StepState.DONE
+        assert not list(step.log_dir.iterdir())
+    second_step = second_steps[1]
+    second_step.preflight_check()
+    assert second_step.output_digest == first_step.output_digest
+    for f_name in second_step.dataset_filename_list:
+        with open_file(Path(second_step.output_dir, f_name), "r") as fh_hyp, open_file(
+            Path(first_step.output_dir, f_name), "r"
+        ) as fh_ref:
+            assert fh_hyp.readlines() == fh_ref.readlines()
+
+
+def test_corpus_step_compression_inherited(foo_corpus_step_inited):
+    """The compression level is only inherited together with the same codec."""
+    foo_corpus_step_inited.compression_level = 9
+    kwargs = {
+        "dataset_files": None,
+        "prev_corpus_step": foo_corpus_step_inited,
+        "shard_size": 3,
+    }
+    step = build_step(
+        step="foo_corpus", step_label="gzip.test", pipeline_dir=foo_corpus_step_inited.pipeline_dir, **kwargs
+    )
+    assert step.compression == "gzip"
+    assert step.compression_level == 9  # noqa: PLR2004
+    step = build_step(
+        step="foo_corpus",
+        step_label="none.test",
+        pipeline_dir=foo_corpus_step_inited.pipeline_dir,
+        compression="none",
+        **kwargs,
+    )
+    assert step.compression_level is None
+    with pytest.raises(ValueError, match="does not support"):
+        build_step(
+            step="foo_corpus",
+            step_label="none.fail.test",
+            pipeline_dir=foo_corpus_step_inited.pipeline_dir,
+            compression="none",
+            compression_level=3,
+            **kwargs,
+        )
+
+
+def test_parallel_corpus(train_data_parallel_tiny, tmp_path):
+    """Test the aligned reading and writing of parallel corpora."""
+    examples = list(ParallelCorpus(files=train_data_parallel_tiny))
+    assert len(examples) == count_lines(train_data_parallel_tiny[0])
+    assert all(len(example) == N_LANGUAGES_BI for example in examples)
+
+    output_files = [Path(tmp_path, file.name) for file in train_data_parallel_tiny]
+    with ParallelCorpusWriter(output_files) as writer:
+        writer.writelines(examples)
+    for input_file, output_file in zip(train_data_parallel_tiny, output_files):
+        with open_file(input_file, "r") as fh_in, open_file(output_file, "r") as fh_out:
+            assert fh_in.readlines() == fh_out.readlines()
+
+
+def test_parallel_corpus_line_count_mismatch(tmp_path):
+    """Misaligned corpus files must be reported."""
+    files = [Path(tmp_path, "corpus.en"), Path(tmp_path, "corpus.fr")]
+    files[0].write_text("a\nb\n")
+    files[1].write_text("a\n")
+    with pytest.raises(ValueError, match="different number of lines"):
+        list(ParallelCorpus(files=files))
+    with pytest.raises(ValueError, match="newline"), ParallelCorpusWriter(files) as writer:
+        writer.write(("a\nb", "c"))
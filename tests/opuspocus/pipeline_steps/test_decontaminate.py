@@ -1,18 +1,20 @@
+import json
 from pathlib import Path
 
 import pytest
 
 from opuspocus.pipeline_steps import StepState, build_step
 from opuspocus.runners.debug import DebugRunner
+from opuspocus.tools.decontaminate import ContaminationIndex, decontaminate
 from opuspocus.utils import count_lines
 
 
-@pytest.fixture()
-def decontaminate_step_inited(train_data_parallel_tiny_raw_step_inited):
+@pytest.fixture(params=["exact", "ngram"])
+def decontaminate_step_inited(request, train_data_parallel_tiny_raw_step_inited):
     """Create and initialize the decontaminate step."""
     step = build_step(
         step="decontaminate",
-        step_label="decontaminate.test",
+        step_label=f"decontaminate.{request.param}.test",
         pipeline_dir=train_data_parallel_tiny_raw_step_inited.pipeline_dir,
         **{
             "prev_corpus_step": train_data_parallel_tiny_raw_step_inited,
@@ -20,6 +22,7 @@ def decontaminate_step_inited(train_data_parallel_tiny_raw_step_inited):
             "tgt_lang": train_data_parallel_tiny_raw_step_inited.tgt_lang,
             "valid_data_step": train_data_parallel_tiny_raw_step_inited,
             "test_data_step": train_data_parallel_tiny_raw_step_inited,
+            "mode": request.param,
         },
     )
     step.init_step()
@@ -44,6 +47,27 @@ def test_decontaminate_step_done(decontaminate_step_done):
     assert decontaminate_step_done.state == StepState.DONE
 
 
+def test_decontaminate_step_test_index(decontaminate_step_done):
+    """The valid/test examples are indexed once by the main task."""
+    decontaminate_step_done.main_task_preprocess()
+    index = ContaminationIndex.load(decontaminate_step_done.test_index_path)
+    assert index.mode == decontaminate_step_done.mode
+    assert index.n_sides == len(decontaminate_step_done.languages)
+    assert all(len(hashes) > 0 for hashes in index.hashes)
+
+
+def test_decontaminate_step_done_report(decontaminate_step_done):
+    """Every dataset is reported, the valid/test datasets (identical to the training data) are leaked."""
+    for dset in decontaminate_step_done.dataset_list:
+        report = decontaminate_step_done.decontamination_report(dset)
+        n_lines = decontaminate_step_done.dataset_line_count(
+            decontaminate_step_done.dataset_filename(dset, decontaminate_step_done.src_lang)
+        )
+        assert report["kept"] == n_lines
+        assert report["examples"] == report["kept"] + report["removed"]
+        assert report["test_sets"][f"{decontaminate_step_done.test_data_step.step_label}/{dset}"]["src"]["matched"] > 0
+
+
 def test_decontaminate_step_done_corpus_lines(decontaminate_step_done):
     """The output corpora should have identical number of lines."""
     # TODO(varisd): this can probably be generalized to all CorpusStep objects
@@ -61,3 +85,71 @@ def test_decontaminate_step_done_corpus_lines(decontaminate_step_done):
             )
         )
         assert src_lines == tgt_lines
+
+
+@pytest.mark.parametrize(("mode", "ngram_threshold", "n_removed"), [("exact", 1, 1), ("ngram", 1, 2), ("ngram", 6, 1)])
+def test_decontaminate_modes(mode, ngram_threshold, n_removed):
+    """The ngram mode also removes the lightly reformatted test examples (sharing at least ngram_threshold n-grams)."""
+    test_examples = [("The quick brown fox jumps over the lazy dog.", "Le renard brun saute par-dessus le chien.")]
+    examples = [
+        ("The quick brown fox jumps over the lazy dog.", "Le renard brun saute par-dessus le chien."),
+        ("the quick brown fox jumps over the lazy dog!", "Une autre traduction du tout."),
+        ("An unrelated sentence of the training corpus.", "Une phrase sans rapport du corpus."),
+    ]
+    kept = list(decontaminate(examples, test_examples, 0, mode=mode, ngram_order=4, ngram_threshold=ngram_threshold))
+    assert len(kept) == len(examples) - n_removed
+    assert kept[-1] == examples[-1]
+
+
+@pytest.mark.parametrize("mode", ["exact", "ngram"])
+def test_decontaminate_parallel(mode, monkeypatch, capsys):
+    """The parallel decontamination keeps the order of the examples and merges the statistics of the batches."""
+    test_examples = [("Sentence number 3.", "Phrase numéro 3."), ("Sentence number 10.", "Phrase numéro 10.")]
+    examples = [(f"Sentence number {i % 13}.", f"Phrase numéro {i % 13}.") for i in range(100)]
+    monkeypatch.setattr("opuspocus.tools.decontaminate.BATCH_LINES", 7)
+
+    kwargs = {"mode": mode, "ngram_order": 1, "ngram_threshold": 3}
+    kept = list(decontaminate(examples, test_examples, 0, **kwargs))
+    stats = capsys.readouterr().err
+    assert kept == [example for example in examples if example not in test_examples]
+
+    assert list(decontaminate(examples, test_examples, 0, n_workers=3, **kwargs)) == kept
+    assert capsys.readouterr().err == stats
+
+
+@pytest.mark.parametrize("mode", ["exact", "ngram"])
+def test_decontaminate_test_index_saved(mode, tmp_path):
+    """The memory-mapped index gives the same results as the index built in memory."""
+    test_examples = [("Sentence number 3.", "Phrase numéro 3."), ("Sentence number 10.", "Phrase numéro 10.")]
+    examples = [(f"Sentence number {i}.", f"Phrase numéro {i}.") for i in range(20)]
+    index = ContaminationIndex.build({"test": test_examples}, mono=False, mode=mode, ngram_order=3)
+    index.save(Path(tmp_path, "index.bin"))
+    loaded = ContaminationIndex.load(Path(tmp_path, "index.bin"))
+    for arrays in ["hashes", "owner_offsets", "owners"]:
+        for array, loaded_array in zip(getattr(index, arrays), getattr(loaded, arrays)):
+            assert list(array) == list(loaded_array)
+
+    kept = list(decontaminate(examples, loaded, 0))
+    assert kept == list(decontaminate(examples, test_examples, 0, mode=mode, ngram_order=3))
+    assert kept == [example for example in examples if example not in test_examples]
+
+
+def test_decontaminate_report(tmp_path):
+    """The report attributes the matches to the test sets containing the matched test samples."""
+    test_sets = {
+        "a": [("one two three", "un deux trois"), ("four five six", "quatre cinq six")],
+        "b": [("four five six", "quatre cinq six"), ("seven eight nine", "sept huit neuf")],
+    }
+    examples = [("four five six", "quatre cinq six"), ("one two three", "autre"), ("ten", "dix")]
+    index = ContaminationIndex.build(test_sets, mono=False, mode="exact", ngram_order=1)
+    kept = list(decontaminate(examples, index, 10, report_file=Path(tmp_path, "report.json")))
+    assert kept == [examples[1], examples[2]]
+
+    with Path(tmp_path, "report.json").open("r") as fh:
+        report = json.load(fh)
+    assert report["examples"] == len(examples)
+    assert report["removed"] == 1
+    assert report["retained_below_min_length"] == 1
+    assert report["test_sets"]["a"]["src"] == {"samples": 2, "matched": 2, "kept": 1, "removed": 1}
+    assert report["test_sets"]["a"]["tgt"] == {"samples": 2, "matched": 1, "kept": 0, "removed": 1}
+    assert report["test_sets"]["b"]["src"] == {"samples": 2, "matched": 1, "kept": 0, "removed": 1}
@@ -0,0 +1,186 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+import pytest
+
+from opuspocus.pipeline_steps import StepState, build_step
+from opuspocus.pipeline_steps.corpus_step import ParallelCorpus
+from opuspocus.pipeline_steps.dedup import DedupCorpusStep
+from opuspocus.runners.debug import DebugRunner
+
+
+def example_key(example, dedup_key):
+    if dedup_key == "src":
+        return example[0]
+    if dedup_key == "tgt":
+        return example[1]
+    return example
+
+
+@pytest.fixture()
+def duplicated_step_inited(train_data_parallel_tiny_raw_step_inited):
+    """Gather the raw step datasets merged with themselves (every example is contained twice)."""
+    raw_step = train_data_parallel_tiny_raw_step_inited
+    merge_step = build_step(
+        step="merge",
+        step_label="merge.duplicated.test",
+        pipeline_dir=raw_step.pipeline_dir,
+        **{
+            "prev_corpus_step": raw_step,
+            "prev_corpus_label": "prev",
+            "other_corpus_step": raw_step,
+            "other_corpus_label": "other",
+            "merge_categories": True,
+        },
+    )
+    merge_step.init_step()
+    step = build_step(
+        step="gather",
+        step_label="gather.duplicated.test",
+        pipeline_dir=raw_step.pipeline_dir,
+        **{"prev_corpus_step": merge_step},
+    )
+    step.init_step()
+    return step
+
+
+@pytest.fixture(params=["src", "tgt", "pair"])
+def dedup_step_inited(request, duplicated_step_inited):
+    """Create and initialize the dedup step."""
+    step = build_step(
+        step="dedup",
+        step_label=f"dedup.{request.param}.test",
+        pipeline_dir=duplicated_step_inited.pipeline_dir,
+        **{
+            "prev_corpus_step": duplicated_step_inited,
+            "dedup_key": request.param,
+            "prefix_bits": 2,
+        },
+    )
+    step.init_step()
+    return step
+
+
+def test_dedup_step_inited(dedup_step_inited):
+    """Test whether the step was initialized successfully."""
+    assert dedup_step_inited.state == StepState.INITED
+
+
+@pytest.fixture()
+def dedup_step_done(dedup_step_inited):
+    """Execute the dedup step."""
+    runner = DebugRunner("debug", dedup_step_inited.pipeline_dir)
+    runner.submit_step(dedup_step_inited)
+    return dedup_step_inited
+
+
+def test_dedup_step_done(dedup_step_done):
+    """Output contains the first occurrences of the examples in the original order, the stats are saved."""
+    assert dedup_step_done.state == StepState.DONE
+    for dset in dedup_step_done.dataset_list:
+        seen = set()
+        expected = []
+        for example in ParallelCorpus.from_step(dedup_step_done.prev_corpus_step, dset):
+            key = example_key(example, dedup_step_done.dedup_key)
+            if key not in seen:
+                seen.add(key)
+                expected.append(example)
+        assert list(ParallelCorpus.from_step(dedup_step_done, dset)) == expected
+
+        n_input = dedup_step_done.prev_corpus_step.dataset_line_count(
+            dedup_step_done.prev_corpus_step.dataset_filename(dset, dedup_step_done.src_lang)
+        )
+        assert dedup_step_done.dedup_stats[dset] == {"kept": len(expected), "dropped": n_input - len(expected)}
+        assert dedup_step_done.dedup_stats[dset]["dropped"] >= n_input // 2
+
+
+def test_dedup_step_across_datasets(train_data_parallel_tiny_raw_step_inited):
+    """With across_datasets, the examples of the preceding datasets are removed from the following datasets."""
+    raw_step = train_data_parallel_tiny_raw_step_inited
+    merge_step = build_step(
+        step="merge",
+        step_label="merge.dedup.test",
+        pipeline_dir=raw_step.pipeline_dir,
+        **{
+            "prev_corpus_step": raw_step,
+            "prev_corpus_label": "prev",
+            "other_corpus_step": raw_step,
+            "other_corpus_label": "other",
+        },
+    )
+    merge_step.init_step()
+    step = build_step(
+        step="dedup",
+        step_label="dedup.across.test",
+        pipeline_dir=raw_step.pipeline_dir,
+        **{"prev_corpus_step": merge_step, "across_datasets": True, "prefix_bits": 1},
+    )
+    step.init_step()
+    runner = DebugRunner("debug", step.pipeline_dir)
+    runner.submit_step(step)
+    assert step.state == StepState.DONE
+
+    seen = set()
+    for dset in step.dataset_list:
+        examples = list(ParallelCorpus.from_step(step, dset))
+        assert not seen.intersection(examples)
+        assert len(set(examples)) == len(examples)
+        seen.update(examples)
+        if dset.startswith("other."):
+            assert step.dedup_stats[dset]["kept"] == 0
+
+
+def test_dedup_step_chunked(duplicated_step_inited, monkeypatch):
+    """The datasets hashed in multiple chunks are deduplicated the same way (the first occurrences are kept)."""
+    monkeypatch.setattr("opuspocus.pipeline_steps.dedup.HASH_CHUNK_LINES", 3)
+    step = build_step(
+        step="dedup",
+        step_label="dedup.chunked.test",
+        pipeline_dir=duplicated_step_inited.pipeline_dir,
+        **{"prev_corpus_step": duplicated_step_inited, "prefix_bits": 2},
+    )
+    step.init_step()
+    DebugRunner("debug", step.pipeline_dir).submit_step(step)
+    assert step.state == StepState.DONE
+    for dset in step.dataset_list:
+        examples = list(ParallelCorpus.from_step(duplicated_step_inited, dset))
+        assert list(ParallelCorpus.from_step(step, dset)) == list(dict.fromkeys(examples))
+
+
+@pytest.mark.parametrize("step_name", ["dedup", "near_dedup"])
+@pytest.mark.parametrize("resubmit_finished", [True, False])
+def test_dedup_step_resubmit_keeps_buckets(step_name, resubmit_finished, duplicated_step_inited, monkeypatch):
+    """The complete buckets of a failed step are reused, unless resubmitting the finished subtasks."""
+    step = build_step(
+        step=step_name,
+        step_label=f"{step_name}.resubmit.test",
+        pipeline_dir=duplicated_step_inited.pipeline_dir,
+        **{"prev_corpus_step": duplicated_step_inited, "across_datasets": True, "prefix_bits": 2},
+    )
+    step.init_step()
+    runner = DebugRunner("debug", step.pipeline_dir)
+    runner.submit_step(duplicated_step_inited)
+    step.main_task_preprocess()
+    assert any(step.bucket_dir.iterdir())
+    step.state = StepState.FAILED
+
+    n_calls = []
+    find_duplicates = type(step).find_duplicates
+
+    def find_duplicates_logged(
+        self: DedupCorpusStep, executor: ProcessPoolExecutor, datasets: List[Tuple[int, str]]
+    ) -> None:
+        n_calls.append(1)
+        find_duplicates(self, executor, datasets)
+
+    monkeypatch.setattr(type(step), "find_duplicates", find_duplicates_logged)
+    runner.submit_step(step, resubmit_finished_subtasks=resubmit_finished)
+    assert step.state == StepState.DONE
+    assert len(n_calls) == int(resubmit_finished)
+    assert not step.bucket_dir.exists()
+
+    seen = set()
+    for dset in step.dataset_list:
+        examples = list(ParallelCorpus.from_step(step, dset))
+        assert not seen.intersection(examples)
+        seen.update(examples)
@@ -0,0 +1,120 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from opuspocus import pipeline_steps
+from opuspocus.pipeline_steps import StepState, build_step
+from opuspocus.pipeline_steps.corpus_step import ParallelCorpus
+from opuspocus.runner_resources import RunnerResources
+from opuspocus.runners.debug import DebugRunner
+from opuspocus.tools.deduplicate import (
+    EDGE_DTYPE,
+    MinHashLSH,
+    drop_near_duplicate_clusters,
+    example_id,
+    load_drop_mask,
+)
+from opuspocus.utils import open_file
+
+NEAR_DEDUP_DATA = {
+    "a": [
+        ("The meeting will be held on 12 March 2021 in Prague.", "La réunion aura lieu le 12 mars 2021 à Prague."),
+        ("Completely different sentence number one.", "Une phrase complètement différente."),
+        ("The meeting will be held on 27 March 2020 in Prague.", "La réunion aura lieu le 27 mars 2020 à Prague."),
+        ("Another unrelated example of a sentence.", "Un autre exemple sans rapport."),
+    ],
+    "b": [
+        ("Completely different sentence number one.", "Une phrase complètement différente."),
+        ("Yet another sentence in the second dataset.", "Encore une autre phrase."),
+    ],
+}
+
+
+@pytest.fixture()
+def near_dedup_raw_step(languages, tmp_path_factory):
+    """Raw step with the near-duplicate examples."""
+    raw_data_dir = tmp_path_factory.mktemp("near_dedup_data")
+    for dset, examples in NEAR_DEDUP_DATA.items():
+        for i, lang in enumerate(languages):
+            with open_file(Path(raw_data_dir, f"{dset}.{lang}.gz"), "w") as fh:
+                for example in examples:
+                    print(example[i], file=fh)
+    pipeline_steps.STEP_INSTANCE_REGISTRY = {}
+    step = build_step(
+        step="raw",
+        step_label="raw.near_dedup.test",
+        pipeline_dir=tmp_path_factory.mktemp("near_dedup.pipeline"),
+        **{"raw_data_dir": raw_data_dir, "src_lang": languages[0], "tgt_lang": languages[1]},
+    )
+    step.init_step()
+    return step
+
+
+@pytest.mark.parametrize(("across_datasets", "n_cpus"), [(False, 1), (True, 1), (True, 2)])
+def test_near_dedup_step(across_datasets, n_cpus, near_dedup_raw_step, monkeypatch):
+    """The near-duplicates (differing in digits) are removed, with across_datasets also from the other datasets."""
+    monkeypatch.setenv(RunnerResources.get_env_name("cpus"), str(n_cpus))
+    step = build_step(
+        step="near_dedup",
+        step_label=f"near_dedup.{across_datasets}.{n_cpus}.test",
+        pipeline_dir=near_dedup_raw_step.pipeline_dir,
+        **{"prev_corpus_step": near_dedup_raw_step, "across_datasets": across_datasets, "prefix_bits": 2},
+    )
+    step.init_step()
+    assert step.state == StepState.INITED
+    DebugRunner("debug", step.pipeline_dir).submit_step(step)
+    assert step.state == StepState.DONE
+
+    # "a" contains a near-duplicate, "b" contains an exact duplicate of an example from "a"
+    expected = {"a": [0, 1, 3], "b": [0, 1]}
+    if across_datasets and step.dataset_list.index("a") < step.dataset_list.index("b"):
+        expected["b"] = [1]
+    elif across_datasets:
+        expected["a"] = [0, 3]
+    for dset, lines in expected.items():
+        assert list(ParallelCorpus.from_step(step, dset)) == [NEAR_DEDUP_DATA[dset][i] for i in lines]
+        assert step.dedup_stats[dset] == {"kept": len(lines), "dropped": len(NEAR_DEDUP_DATA[dset]) - len(lines)}
+
+
+def test_near_dedup_invalid_bands(near_dedup_raw_step):
+    """The number of bands must divide the signature length."""
+    with pytest.raises(ValueError):  # noqa: PT011
+        build_step(
+            step="near_dedup",
+            step_label="near_dedup.invalid.test",
+            pipeline_dir=near_dedup_raw_step.pipeline_dir,
+            **{"prev_corpus_step": near_dedup_raw_step, "num_perm": 128, "bands": 10},
+        )
+
+
+@pytest.mark.parametrize("shingle", ["char", "word"])
+def test_minhash_signatures_batched(shingle, monkeypatch):
+    """The signatures do not depend on the batching of the shingles."""
+    texts = [b"", b"a", b"short"]
+    texts += [example[0].encode() for examples in NEAR_DEDUP_DATA.values() for example in examples]
+    minhash = MinHashLSH(shingle=shingle, shingle_size=3)
+    signatures = minhash.signatures(texts)
+    monkeypatch.setattr("opuspocus.tools.deduplicate.MINHASH_BATCH_SHINGLES", 5)
+    np.testing.assert_array_equal(minhash.signatures(texts), signatures)
+    assert signatures.shape == (len(texts), minhash.num_perm)
+
+
+def test_drop_near_duplicate_clusters(tmp_path):
+    """All but the first member of each connected cluster are dropped (including the chained candidates)."""
+
+    def node(dataset_idx: int, line: int) -> int:
+        return int(example_id(dataset_idx, np.array([line]))[0])
+
+    # Clusters: {0, 1, 2} (1 is not connected to 0 directly), {3, 4, 5}, {(1, 0), (1, 1)}
+    pairs = [(node(0, 0), node(0, 2)), (node(0, 1), node(0, 2)), (node(0, 3), node(0, 4)), (node(0, 4), node(0, 5))]
+    pairs.append((node(1, 0), node(1, 1)))
+    edges = np.array(pairs, dtype=EDGE_DTYPE)
+    # The edges of a cluster can be found in different buckets
+    edges[::2].tofile(Path(tmp_path, "00000.edges"))
+    edges[1::2].tofile(Path(tmp_path, "00001.edges"))
+    drop_near_duplicate_clusters(tmp_path, [6, 2])
+
+    for dataset_idx, n_lines, expected in [(0, 6, [1, 2, 4, 5]), (1, 2, [1])]:
+        mask = load_drop_mask(tmp_path, dataset_idx, n_lines)
+        assert [i for i in range(n_lines) if mask[i >> 3] >> (i & 7) & 1] == expected
@@ -94,3 +94,19 @@ def test_cmd_file_execute_sub(step_command_module, foo_step_inited):
         assert target_file.exists()
         assert open_file(target_file, "r").readline().rstrip("\n") == foo_step_inited.get_output_str(target_file)
     foo_step_inited.state = StepState.DONE
+
+
+def test_reinit_incremental(bar_step_inited):
+    """Finished steps are kept by the incremental re-initialization unless they or their dependencies changed."""
+    foo_step = bar_step_inited.dep_step
+    for step in [foo_step, bar_step_inited]:
+        step.state = StepState.DONE
+
+    for step in [foo_step, bar_step_inited]:
+        step.reinit_incremental()
+        assert step.state == StepState.DONE
+
+    foo_step.sleep_time = 1
+    for step in [foo_step, bar_step_inited]:
+        step.reinit_incremental()
+        assert step.state == StepState.INITED
@@ -200,3 +200,9 @@ def test_resubmit_step(foo_pipeline_runner, foo_pipeline_inited, resubmit_finish
     foo_pipeline_runner.wait_for_tasks([bar_sub_info["main_task"]])
     for step in [foo_step_inited, bar_step_inited]:
         assert step.state == StepState.DONE
+
+
+def test_max_parallel_tasks(foo_step_runner, foo_step_inited):
+    """The runner reports either a positive number of parallel subtasks or None (unlimited/unknown)."""
+    max_parallel = foo_step_runner.max_parallel_tasks(foo_step_inited)
+    assert max_parallel is None or max_parallel > 0
@@ -0,0 +1,131 @@
+import gzip
+import io
+from pathlib import Path
+
+import pytest
+
+from opuspocus import compression
+from opuspocus.compression import (
+    BGZF_BLOCK_SIZE,
+    BgzfWriter,
+    bgzf_index_path,
+    get_codec,
+    get_codec_by_path,
+    is_bgzf,
+    load_block_index,
+)
+from opuspocus.runner_resources import RunnerResources
+from opuspocus.utils import concat_files, file_line_index, open_file, read_shard
+
+N_LINES = 10000
+
+
+@pytest.fixture()
+def bgzf_lines():
+    """Lines of a mock corpus spanning multiple BGZF blocks."""
+    return [f"{i} " + "walrus " * (i % 17) + "\n" for i in range(N_LINES)]
+
+
+@pytest.fixture()
+def bgzf_file(tmp_path, bgzf_lines):
+    """Mock corpus written using open_file."""
+    file_path = Path(tmp_path, "corpus.en.gz")
+    with open_file(file_path, "w") as fh:
+        fh.writelines(bgzf_lines)
+    return file_path
+
+
+def test_bgzf_readable_by_gzip(bgzf_file, bgzf_lines):
+    """BGZF output must be a valid (multi-member) gzip file."""
+    assert is_bgzf(bgzf_file)
+    assert gzip.decompress(bgzf_file.read_bytes()).decode("utf-8") == "".join(bgzf_lines)
+
+
+def test_bgzf_block_index(bgzf_file, bgzf_lines):
+    """Test whether the saved block index describes the file blocks."""
+    assert bgzf_index_path(bgzf_file).exists()
+    coffsets, uoffsets = load_block_index(bgzf_file)
+    n_bytes = len("".join(bgzf_lines).encode("utf-8"))
+    assert len(coffsets) == len(uoffsets) == n_bytes // BGZF_BLOCK_SIZE + 1
+    assert all(int(u) == i * BGZF_BLOCK_SIZE for i, u in enumerate(uoffsets))
+
+
+@pytest.mark.parametrize("use_gzi", [True, False])
+def test_bgzf_read_shard(bgzf_file, bgzf_lines, use_gzi):
+    """Test shard reading with and without the .gzi block index file."""
+    if not use_gzi:
+        bgzf_index_path(bgzf_file).unlink()
+        compression._block_index_cache.clear()  # noqa: SLF001
+    line_index = file_line_index(bgzf_file)
+    for start in [0, 1, 4321, N_LINES - 3]:
+        assert read_shard(bgzf_file, line_index, start, 10) == bgzf_lines[start : start + 10]
+
+
+def test_bgzf_empty_file(tmp_path):
+    """Empty files are still valid gzip files."""
+    file_path = Path(tmp_path, "empty.gz")
+    with open_file(file_path, "w"):
+        pass
+    assert gzip.decompress(file_path.read_bytes()) == b""
+    assert len(file_line_index(file_path)) == 0
+
+
+@pytest.mark.parametrize("threads", [2, 4])
+def test_bgzf_parallel_writer(tmp_path, bgzf_file, bgzf_lines, threads):
+    """Parallel compression must produce output identical to the single-threaded writer."""
+    file_path = Path(tmp_path, f"corpus.{threads}.en.gz")
+    with io.TextIOWrapper(BgzfWriter(file_path, threads=threads), newline="\n") as fh:
+        fh.writelines(bgzf_lines)
+    assert file_path.read_bytes() == bgzf_file.read_bytes()
+    assert bgzf_index_path(file_path).read_bytes() == bgzf_index_path(bgzf_file).read_bytes()
+
+
+def test_bgzf_writer_threads_from_env(tmp_path, monkeypatch):
+    """The number of compression threads is derived from the task CPU allocation."""
+    monkeypatch.setenv(RunnerResources.get_env_name("cpus"), "3")
+    writer = BgzfWriter(Path(tmp_path, "out.gz"))
+    writer.close()
+    assert writer.threads == 3  # noqa: PLR2004
+
+
+@pytest.fixture(params=["none", "gzip", "zstd", "lz4"])
+def codec(request):
+    """Available compression codecs."""
+    if request.param in ("zstd", "lz4"):
+        pytest.importorskip({"zstd": "zstandard", "lz4": "lz4"}[request.param])
+    return get_codec(request.param)
+
+
+def test_codec_by_path(codec):
+    """The codec is determined by the file suffix."""
+    assert get_codec_by_path(Path(f"corpus.en{codec.suffix}")) is codec
+
+
+def test_codec_roundtrip(tmp_path, codec, bgzf_lines):
+    """Test writing and (random access) reading of the files compressed by each codec."""
+    file_path = Path(tmp_path, f"corpus.en{codec.suffix}")
+    with open_file(file_path, "w", compresslevel=None if codec.name == "none" else 1) as fh:
+        fh.writelines(bgzf_lines)
+    with open_file(file_path, "r") as fh:
+        assert fh.readlines() == bgzf_lines
+    line_index = file_line_index(file_path)
+    assert read_shard(file_path, line_index, 4321, 10) == bgzf_lines[4321:4331]
+
+
+def test_codec_concat_raw(tmp_path, codec, bgzf_lines):
+    """Concatenated files (frames) compressed by each codec remain readable."""
+    input_files = []
+    for i, lines in enumerate([bgzf_lines[:100], ["missing newline"], bgzf_lines[100:]]):
+        input_files.append(Path(tmp_path, f"corpus.{i}.en{codec.suffix}"))
+        with open_file(input_files[-1], "w") as fh:
+            fh.writelines(lines)
+    output_file = Path(tmp_path, f"corpus.en{codec.suffix}")
+    concat_files(input_files, output_file)
+    with open_file(output_file, "r") as fh:
+        assert fh.readlines() == [*bgzf_lines[:100], "missing newline\n", *bgzf_lines[100:]]
+
+
+def test_codec_unknown():
+    """Unknown codec names are rejected."""
+    with pytest.raises(ValueError, match="Unknown compression codec"):
+        get_codec("foo")
@@ -35,6 +35,7 @@ def runner(request):
     [
         ("run", "--reinit"),
         ("run", "--reinit-failed"),
+        ("run", "--reinit-incremental"),
         ("run", "--stop-previous-run"),
         ("run", "--resubmit-finished-subtasks"),
         ("traceback", "--verbose"),
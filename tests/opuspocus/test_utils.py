@@ -1,6 +1,21 @@
+from pathlib import Path
+
 import pytest
 
-from opuspocus.utils import count_lines, file_line_index, open_file, read_shard
+from opuspocus.utils import (
+    concat_files,
+    count_lines,
+    cut_file,
+    file_byte_spans,
+    file_line_index,
+    file_weighted_spans,
+    load_line_index,
+    open_file,
+    paste_files,
+    read_byte_range,
+    read_shard,
+    save_line_index,
+)
 
 
 @pytest.mark.parametrize(
@@ -14,6 +29,15 @@ def test_count_lines(train_data_fixture, request):
     assert res == 5  # noqa: PLR2004
 
 
+@pytest.mark.parametrize(("content", "n_lines"), [("", 0), ("a\n", 1), ("a\nb", 2), ("a\n\nb\n", 3)])
+def test_count_lines_unterminated(tmp_path, content, n_lines):
+    """The last line is counted even without the trailing newline."""
+    file_path = Path(tmp_path, "lines.txt.gz")
+    with open_file(file_path, "w") as fh:
+        fh.write(content)
+    assert count_lines(file_path) == n_lines
+
+
 @pytest.fixture(params=["train_data_parallel_tiny", "train_data_parallel_tiny_decompressed"])
 def sample_file(request):
     """Get a sample file."""
@@ -42,3 +66,119 @@ def test_read_shard(sample_file, shard_index, start, size):
         for i, line in enumerate(fh):
             if i >= start and i < start + size:
                 assert lines[i - start] == line
+
+
+@pytest.mark.parametrize("n_spans", [1, 2, 3, 100])
+def test_file_byte_spans(sample_file, n_spans):
+    """The byte spans cover the whole file and start at the line beginnings."""
+    spans = file_byte_spans(sample_file, n_spans)
+    assert 1 <= len(spans) <= n_spans
+    assert spans[0][0] == 0
+    for (_, end), (start, _) in zip(spans, spans[1:]):
+        assert end == start
+    with open_file(sample_file, "r") as fh:
+        lines = fh.readlines()
+    assert [line for start, end in spans for line in read_byte_range(sample_file, start, end)] == lines
+    line_starts = set(file_line_index(sample_file).tolist())
+    assert all(start in line_starts for start, _ in spans)
+
+
+@pytest.mark.parametrize("weight", ["chars", "tokens"])
+def test_file_weighted_spans_balanced(tmp_path, weight):
+    """The spans are balanced by the line weights rather than by the number of lines."""
+    file_path = Path(tmp_path, "corpus.txt.gz")
+    # The long lines are at the beginning of the file, so the line-balanced shards would be unbalanced
+    n_long_lines = 100
+    lines = [("a " * (50 if i < n_long_lines else 1)).strip() + "\n" for i in range(1000)]
+    with open_file(file_path, "w") as fh:
+        fh.writelines(lines)
+
+    spans = file_weighted_spans(file_path, 4, weight=weight, size=sum(len(line) for line in lines))
+    assert len(spans) == 4  # noqa: PLR2004
+    shards = [read_byte_range(file_path, start, end) for start, end in spans]
+    assert [line for shard in shards for line in shard] == lines
+    line_weight = (lambda line: len(line) - 1) if weight == "chars" else (lambda line: len(line.split()))
+    shard_weights = [sum(line_weight(line) for line in shard) for shard in shards]
+    assert max(shard_weights) - min(shard_weights) <= max(shard_weights) * 0.1
+
+
+def test_file_line_index_offsets(sample_file, shard_index):
+    """Test whether the indices point to the beginnings of the lines."""
+    with open_file(sample_file, "rb") as fh:
+        content = fh.read()
+    for i, offset in enumerate(shard_index):
+        assert offset == 0 or content[offset - 1] == ord("\n"), f"Offset of line {i} is not a beginning of line."
+
+
+def test_line_index_save_load(sample_file, shard_index, tmp_path):
+    """Test that the saved line index can be loaded back."""
+    index_file = Path(tmp_path, f"{sample_file.name}.idx")
+    save_line_index(shard_index, index_file)
+    assert index_file.stat().st_size == 8 * len(shard_index)
+    assert list(load_line_index(index_file)) == list(shard_index)
+
+
+@pytest.mark.parametrize("output_suffix", [".gz", ""])
+def test_concat_files(sample_file, tmp_path, output_suffix):
+    """Test concatenation of (possibly differently compressed) files."""
+    output_file = Path(tmp_path, f"concat.txt{output_suffix}")
+    concat_files([sample_file, sample_file], output_file)
+    with open_file(sample_file, "r") as fh:
+        lines = fh.readlines()
+    with open_file(output_file, "r") as fh:
+        assert fh.readlines() == lines + lines
+
+
+@pytest.mark.parametrize("suffix", [".gz", ""])
+def test_concat_files_missing_newline(tmp_path, suffix):
+    """Files without a trailing newline must not be merged with the first line of the following file."""
+    input_files = [Path(tmp_path, f"in{i}.txt{suffix}") for i in range(3)]
+    for i, input_file in enumerate(input_files):
+        with open_file(input_file, "w") as fh:
+            print(f"line {i}", end="", file=fh)
+    output_file = Path(tmp_path, f"concat.txt{suffix}")
+    concat_files(input_files, output_file)
+    with open_file(output_file, "r") as fh:
+        lines = fh.readlines()
+    assert lines == ["line 0\n", "line 1\n", "line 2\n"]
+    if suffix == ".gz":
+        line_index = file_line_index(output_file)
+        assert read_shard(output_file, line_index, 1, 2) == lines[1:]
+
+
+@pytest.mark.parametrize("suffix", [".gz", ""])
+def test_paste_cut_roundtrip(train_data_parallel_tiny, tmp_path, suffix):
+    """Cutting the pasted files must reproduce the original files."""
+    pasted_file = Path(tmp_path, f"pasted.tsv{suffix}")
+    paste_files(train_data_parallel_tiny, pasted_file)
+    output_files = [Path(tmp_path, f"{i}.txt{suffix}") for i in range(len(train_data_parallel_tiny))]
+    cut_file(pasted_file, output_files)
+    for input_file, output_file in zip(train_data_parallel_tiny, output_files):
+        with open_file(input_file, "r") as fh_in, open_file(output_file, "r") as fh_out:
+            assert fh_in.readlines() == fh_out.readlines()
+
+
+def test_paste_files_line_count_mismatch(tmp_path):
+    """Pasting files of different lengths must fail."""
+    input_files = [Path(tmp_path, "a.txt"), Path(tmp_path, "b.txt")]
+    input_files[0].write_text("a\nb\nc\n")
+    input_files[1].write_text("a\nb\n")
+    with pytest.raises(ValueError, match=r"different number of lines.*\(3\).*\(2\)"):
+        paste_files(input_files, Path(tmp_path, "out.tsv"))
+
+
+def test_paste_files_delimiter_in_input(tmp_path):
+    """Input lines containing the delimiter would break the column alignment."""
+    input_files = [Path(tmp_path, "a.txt"), Path(tmp_path, "b.txt")]
+    input_files[0].write_text("a\nb\tb\n")
+    input_files[1].write_text("a\nb\n")
+    with pytest.raises(ValueError, match=r"Line 2 .* has 3 columns"):
+        paste_files(input_files, Path(tmp_path, "out.tsv"))
+
+
+def test_cut_file_column_count_mismatch(tmp_path):
+    """Lines with an unexpected number of columns must be reported."""
+    input_file = Path(tmp_path, "in.tsv")
+    input_file.write_text("a\ta\nb\nc\tc\n")
+    with pytest.raises(ValueError, match=r"Line 2 .* has 1 columns"):
+        cut_file(input_file, [Path(tmp_path, "a.txt"), Path(tmp_path, "b.txt")])
@@ -0,0 +1,160 @@
+from pathlib import Path
+
+import pytest
+
+from opuspocus.utils import (
+    concat_files,
+    file_byte_spans,
+    file_line_index,
+    link_file,
+    link_tree,
+    materialize_file,
+    open_file,
+    open_file_at,
+    read_byte_range,
+)
+from opuspocus.virtual_files import (
+    file_exists,
+    is_relocatable_virtual_file,
+    is_virtual_file,
+    load_virtual_parts,
+    save_virtual_file,
+    virtual_file_path,
+    virtual_file_size,
+)
+
+
+def _write(file_path: Path, content: str) -> Path:
+    with open_file(file_path, "w") as fh:
+        fh.write(content)
+    return file_path
+
+
+@pytest.fixture(params=[".gz", ""])
+def suffix(request):
+    """Compression suffix of the tested files."""
+    return request.param
+
+
+@pytest.fixture()
+def member_files(suffix, tmp_path):
+    """Member files of a virtual file (the second one does not end with a newline)."""
+    return [
+        _write(Path(tmp_path, f"a.txt{suffix}"), "a1\na2\n"),
+        _write(Path(tmp_path, f"b.txt{suffix}"), "b1\nb2"),
+        _write(Path(tmp_path, f"c.txt{suffix}"), ""),
+        _write(Path(tmp_path, f"d.txt{suffix}"), "d1\n"),
+    ]
+
+
+@pytest.fixture()
+def virtual_file(member_files, suffix, tmp_path):
+    """Virtual file concatenating the member files."""
+    file_path = Path(tmp_path, f"virtual.txt{suffix}")
+    save_virtual_file(file_path, member_files)
+    return file_path
+
+
+VIRTUAL_CONTENT = "a1\na2\nb1\nb2\nd1\n"
+
+
+def test_virtual_file_read(virtual_file):
+    """The virtual file is read as the concatenation of its members (empty members are skipped)."""
+    assert is_virtual_file(virtual_file)
+    assert file_exists(virtual_file)
+    assert not virtual_file.exists()
+    assert len(load_virtual_parts(virtual_file)) == 3  # noqa: PLR2004
+    assert virtual_file_size(virtual_file) == len(VIRTUAL_CONTENT)
+    with open_file(virtual_file, "r") as fh:
+        assert fh.read() == VIRTUAL_CONTENT
+
+
+@pytest.mark.parametrize("offset", range(len(VIRTUAL_CONTENT) + 1))
+def test_virtual_file_read_at(virtual_file, offset):
+    """Reading can start at any offset, including the added newline."""
+    with open_file_at(virtual_file, offset, "rb") as fh:
+        assert fh.read() == VIRTUAL_CONTENT[offset:].encode()
+
+
+def test_virtual_file_line_index(virtual_file):
+    """The line index and the byte ranges of a virtual file match its contents."""
+    line_index = file_line_index(virtual_file)
+    assert line_index.tolist() == [0, 3, 6, 9, 12]
+    spans = file_byte_spans(virtual_file, 2)
+    assert "".join(line for start, end in spans for line in read_byte_range(virtual_file, start, end)) == (
+        VIRTUAL_CONTENT
+    )
+
+
+def test_virtual_file_nested_and_ranges(virtual_file, member_files, suffix, tmp_path):
+    """Virtual members are flattened, byte ranges of real members are supported."""
+    nested_file = Path(tmp_path, f"nested.txt{suffix}")
+    save_virtual_file(nested_file, [virtual_file, (member_files[0], 3, 6)])
+    assert all(Path(part["file"]).exists() for part in load_virtual_parts(nested_file))
+    with open_file(nested_file, "r") as fh:
+        assert fh.read() == VIRTUAL_CONTENT + "a2\n"
+
+    with pytest.raises(ValueError, match="Byte ranges of a virtual file"):
+        save_virtual_file(nested_file, [(virtual_file, 0, 3)])
+
+
+def test_virtual_file_modified_member_fail(virtual_file, member_files):
+    """Modification of a member file is detected when opening the virtual file."""
+    _write(member_files[0], "modified\n")
+    with pytest.raises(FileNotFoundError, match="was modified or removed"):
+        open_file(virtual_file, "r")
+
+
+@pytest.mark.parametrize("output_suffix", [None, ".gz", ".zst", ""])
+def test_materialize_file(virtual_file, tmp_path, output_suffix):
+    """Materialization creates a real file (in place or at a given location, possibly re-compressed)."""
+    output_file = None
+    if output_suffix is not None:
+        output_file = Path(tmp_path, f"materialized.txt{output_suffix}")
+    real_file = materialize_file(virtual_file, output_file)
+    assert real_file.exists()
+    assert not is_virtual_file(real_file)
+    if output_file is None:
+        assert real_file == virtual_file
+        assert not virtual_file_path(virtual_file).exists()
+    with open_file(real_file, "r") as fh:
+        assert fh.read() == VIRTUAL_CONTENT
+    # A real file is left untouched
+    assert materialize_file(real_file) == real_file
+
+
+def test_link_and_concat_virtual_file(virtual_file, member_files, suffix, tmp_path):
+    """Linking a virtual file creates another virtual file, concatenation reads the virtual contents."""
+    linked_file = Path(tmp_path, f"linked.txt{suffix}")
+    link_file(virtual_file, linked_file)
+    assert is_virtual_file(linked_file)
+
+    concat_file = Path(tmp_path, "concat.txt.gz")
+    concat_files([virtual_file, member_files[0]], concat_file)
+    with open_file(concat_file, "r") as fh:
+        assert fh.read() == VIRTUAL_CONTENT + "a1\na2\n"
+
+
+def test_virtual_file_relocatable(suffix, tmp_path):
+    """Members inside the virtual file directory are referenced relatively, so the directory can be relinked."""
+    src_dir = Path(tmp_path, "src")
+    Path(src_dir, "parts").mkdir(parents=True)
+    members = [
+        _write(Path(src_dir, "parts", f"a.txt{suffix}"), "a1\n"),
+        _write(Path(src_dir, "parts", f"b.txt{suffix}"), "b1\n"),
+    ]
+    file_path = Path(src_dir, f"virtual.txt{suffix}")
+    save_virtual_file(file_path, members)
+    assert is_relocatable_virtual_file(file_path)
+
+    dst_dir = Path(tmp_path, "dst")
+    link_tree(src_dir, dst_dir)
+    members[0].unlink()
+    moved_path = Path(dst_dir, file_path.name)
+    with open_file(moved_path, "r") as fh:
+        assert fh.read() == "a1\nb1\n"
+
+    external_path = Path(tmp_path, "other", f"external.txt{suffix}")
+    external_path.parent.mkdir()
+    save_virtual_file(external_path, [Path(dst_dir, "parts", f"a.txt{suffix}")])
+    assert not is_relocatable_virtual_file(external_path)
@@ -46,3 +46,14 @@ def test_status_default_values(pipeline_in_state, state, capsys, request):
             out_has_status = True
             assert state.value in line
     assert out_has_status
+
+
+def test_status_verbose(foo_pipeline_done, capsys):
+    """The verbose status does not change the output of the non-corpus steps."""
+    rc = main(["status", "--pipeline-dir", str(foo_pipeline_done.pipeline_dir), "--verbose"])
+    assert rc == 0
+
+    for line in capsys.readouterr().out.split("\n")[2:-1]:
+        line_arr = line.split("|")
+        assert len(line_arr) == STATUS_OUT_N_COLS
+        assert line_arr[2] == StepState.DONE.value